@@ -0,0 +1,153 @@
+"""
+Asset access for the offline renderer: patterns and palettes by DNA index, and each layer rendered on its own.
+
+Kept apart from render.py so that render workers and the asset bundle (bundle.py) can load assets without importing
+the PNG encoder.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from cache import LRUCache, digest
+from definitions import Definitions, load_definitions
+from palettes import PALETTES_DIR, read_palettes
+from patterns import PATTERNS_DIR, PatternFile, read_pattern_file
+
+CANVAS_WIDTH: int = 32
+CANVAS_HEIGHT: int = 32
+NUM_CANVASES: int = 12
+
+# a layer is about 6 KB: enough for all ~35000 layers of a pose
+DEFAULT_LAYER_CACHE_SIZE: int = 256 * 1024 * 1024
+
+
+def pose_crop(canvas_id: int) -> Tuple[int, int]:
+    """
+    The (x, y) of the 32x32 crop of a 128x128 pattern for a canvas id (SPRITE_POSE_CROP_OPTIONS in PatternMaster.ts):
+    the poses are in the last 3 columns, one direction per row.
+    """
+    assert 0 <= canvas_id < NUM_CANVASES, f"invalid canvas id: {canvas_id}"
+    return CANVAS_WIDTH * (canvas_id % 3 + 1), CANVAS_HEIGHT * (canvas_id // 3)
+
+
+@dataclass
+class LayerImage:
+    # the layer rendered on its own, shape (32, 32, 4); color index 0 is transparent
+    rgba: np.ndarray
+    # pixels with alpha 255
+    opaque: np.ndarray
+    # pixels with 0 < alpha < 255, None if there are none
+    translucent: Optional[np.ndarray]
+
+
+class Assets:
+    """
+    Patterns and palettes by DNA index, loaded from the asset files on first use.
+
+    Rendered layers are kept in a content-addressed LRU cache (see cache.py): the key of a layer is a digest of its
+    pose, pattern file and palette colors, so a cache loaded from disk is only used for unchanged assets.
+
+    :param layer_cache: The cache of rendered layers, by default bounded to DEFAULT_LAYER_CACHE_SIZE bytes.
+    """
+
+    def __init__(
+        self,
+        definitions: Optional[Definitions] = None,
+        patterns_dir: str = PATTERNS_DIR,
+        palettes_dir: str = PALETTES_DIR,
+        layer_cache: Optional[LRUCache] = None,
+    ):
+        self.definitions: Definitions = definitions or load_definitions()
+        self.patterns_dir: str = patterns_dir
+        self.palettes_dir: str = palettes_dir
+        self.layer_cache: LRUCache = layer_cache if layer_cache is not None else LRUCache(DEFAULT_LAYER_CACHE_SIZE)
+        self._patterns: Dict[Tuple[str, int], Optional[PatternFile]] = {}
+        self._pattern_digests: Dict[Tuple[str, int], Optional[str]] = {}
+        self._palettes: Dict[int, Dict[str, np.ndarray]] = {}
+        self._layer_keys: Dict[Tuple[int, str, int, int], Optional[str]] = {}
+
+    def pattern_path(self, layer: str, index: int) -> Optional[str]:
+        found = self.definitions.pattern(layer, index)
+        path = None if found is None else os.path.join(self.patterns_dir, layer, f"{found[0]}.json")
+        return path if path and os.path.exists(path) else None
+
+    def pattern(self, layer: str, index: int) -> Optional[PatternFile]:
+        key = (layer, index)
+        if key not in self._patterns:
+            path = self.pattern_path(layer, index)
+            self._patterns[key] = read_pattern_file(path) if path else None
+        return self._patterns[key]
+
+    def pattern_digest(self, layer: str, index: int) -> Optional[str]:
+        """
+        A digest of a pattern file, without parsing it.
+        """
+        key = (layer, index)
+        if key not in self._pattern_digests:
+            path = self.pattern_path(layer, index)
+            if path is None:
+                self._pattern_digests[key] = None
+            else:
+                with open(path, "rb") as f:
+                    self._pattern_digests[key] = digest(f.read())
+        return self._pattern_digests[key]
+
+    def palette(self, code: int, index: int) -> Optional[np.ndarray]:
+        name = self.definitions.palette(code, index)
+        if name is None:
+            return None
+        if code not in self._palettes:
+            self._palettes[code] = read_palettes(code, self.palettes_dir)
+        return self._palettes[code].get(name)
+
+    def layer_key(self, canvas_id: int, layer: str, pattern: int, palette: int) -> Optional[str]:
+        """
+        The content address of a layer, or None if the pattern or palette is missing.
+        """
+        key = (canvas_id, layer, pattern, palette)
+        if key not in self._layer_keys:
+            pattern_digest = self.pattern_digest(layer, pattern)
+            found = self.definitions.pattern(layer, pattern)
+            colors = None if found is None else self.palette(found[1], palette)
+            if pattern_digest is None or colors is None:
+                self._layer_keys[key] = None
+            else:
+                self._layer_keys[key] = digest(canvas_id, layer, pattern_digest, colors)
+        return self._layer_keys[key]
+
+    def layer(self, canvas_id: int, layer: str, pattern: int, palette: int) -> Optional[LayerImage]:
+        """
+        A layer of a pose rendered on its own, or None if it draws nothing (_drawLayer).
+        """
+        key = self.layer_key(canvas_id, layer, pattern, palette)
+        if key is None:
+            return None
+        return self.layer_cache.get_or_compute(key, lambda: self._render_layer(canvas_id, layer, pattern, palette))
+
+    def _render_layer(self, canvas_id: int, layer: str, pattern: int, palette: int) -> Optional[LayerImage]:
+        pattern_file = self.pattern(layer, pattern)
+        if pattern_file is None:
+            return None
+        colors = self.palette(pattern_file.palette_code, palette)
+        if colors is None or len(colors) == 0:
+            return None
+        x, y = pose_crop(canvas_id)
+        indices = pattern_file.indices[y : y + CANVAS_HEIGHT, x : x + CANVAS_WIDTH]
+        assert int(indices.max()) < len(colors), f"color index out of range for {layer} pattern {pattern}"
+        return layer_image(indices, colors)
+
+
+def layer_image(indices: np.ndarray, colors: np.ndarray) -> Optional[LayerImage]:
+    """
+    Render palette indices to RGBA, or None if every pixel is transparent.
+    """
+    rgba = colors[indices]
+    rgba[indices == 0] = 0
+    alpha = rgba[..., 3]
+    opaque = alpha == 255
+    translucent = (alpha != 0) & ~opaque
+    if not opaque.any() and not translucent.any():
+        return None
+    return LayerImage(rgba=rgba, opaque=opaque, translucent=translucent if translucent.any() else None)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the hot paths of the PNG scripts, timed against their zlib equivalents.
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json
+    python benchmark.py --compare before.json after.json --threshold 0.1
+
+Every case runs on deterministic inputs of several sizes, from the 2x2 debug image through the 32x32 avatar canvas
+and the 128x128 spritesheets up to a 1024x1024 image (4 MiB of pixels), and its output is checked against its
+baseline before it is timed. The number of calls per run is chosen so that a run takes about --min-time seconds, and
+the fastest of --repeat runs is reported as the time per call.
+
+Comparing two result files flags every case that got slower by more than the threshold, and exits with status 1 if
+there is any, so the comparison can gate a change.
+"""
+
+import fnmatch
+import json
+import platform
+import sys
+import time
+import timeit
+import zlib
+from argparse import ArgumentParser, Namespace
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from checksum import CRC32_MIN_SEGMENT, adler32, crc32, crc32_parallel
+from decode import VERIFY_LEVELS, decode_png
+from huffman import build_tree, huffman_encode, huffman_encode_bytes
+from image_data import (
+    checkerboard,
+    checkerboard_array,
+    flatten_with_row_prefix,
+    transparent_rainbow_array,
+    with_row_prefix,
+)
+from png import IEND, PNG, PNG_SIGNATURE, encode_chunk
+
+VERSION: int = 1
+
+# name, height, width
+SIZES: Tuple[Tuple[str, int, int], ...] = (
+    ("2x2", 2, 2),
+    ("32x32", 32, 32),
+    ("128x128", 128, 128),
+    ("1024x1024", 1024, 1024),
+)
+
+
+@dataclass
+class Case:
+    """
+    A benchmark: a call and the zlib call that does the same work, if there is one.
+    """
+
+    # e.g. crc32/128x128
+    name: str
+    group: str
+    size: str
+    # the size of the input in bytes, for throughput
+    nbytes: int
+    fn: Callable[[], object]
+    baseline: Optional[Callable[[], object]] = None
+
+
+@dataclass
+class Result:
+    name: str
+    group: str
+    size: str
+    nbytes: int
+    # calls per timed run
+    number: int
+    # seconds per call, the fastest and the median run
+    seconds: float
+    median: float
+    baseline_seconds: Optional[float] = None
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.nbytes / self.seconds / 1e6
+
+    @property
+    def ratio(self) -> Optional[float]:
+        """
+        How many times slower than the baseline.
+        """
+        return None if self.baseline_seconds is None else self.seconds / self.baseline_seconds
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "mb_per_s": self.mb_per_s, "ratio": self.ratio}
+
+    @staticmethod
+    def from_dict(d: dict) -> "Result":
+        return Result(**{k: d[k] for k in Result.__dataclass_fields__ if k in d})
+
+
+def _zlib_huffman_only(data: bytes) -> bytes:
+    """
+    DEFLATE with Huffman coding only (no LZ77 matches), the zlib counterpart of the Huffman coders.
+    """
+    c = zlib.compressobj(6, zlib.DEFLATED, -15, 9, zlib.Z_HUFFMAN_ONLY)
+    return c.compress(data) + c.flush()
+
+
+def _png_file(width: int, height: int, idat: bytes, idat_size: Optional[int] = None) -> bytes:
+    """
+    A PNG file of the zlib stream, split into IDAT chunks of idat_size bytes if given.
+    """
+    idat_size = idat_size or len(idat)
+    idats = [encode_chunk(b"IDAT", idat[i : i + idat_size]) for i in range(0, len(idat), idat_size)]
+    return PNG_SIGNATURE + PNG(width, height).encode_ihdr() + b"".join(idats) + IEND
+
+
+def iter_cases(sizes: Sequence[Tuple[str, int, int]] = SIZES) -> Iterator[Case]:
+    """
+    Yield the benchmark cases for each input size, checking each against its baseline first.
+    """
+    for size, height, width in sizes:
+        image = transparent_rainbow_array(height, width)
+        # the scanlines of the image, as PNG compresses them
+        scanlines = bytes(with_row_prefix(image))
+        n = len(scanlines)
+
+        assert crc32(scanlines) == zlib.crc32(scanlines)
+        yield Case(f"crc32/{size}", "crc32", size, n, lambda d=scanlines: crc32(d), lambda d=scanlines: zlib.crc32(d))
+        if n >= 2 * CRC32_MIN_SEGMENT:
+            assert crc32_parallel(scanlines) == zlib.crc32(scanlines)
+            yield Case(
+                f"crc32_parallel/{size}",
+                "crc32",
+                size,
+                n,
+                lambda d=scanlines: crc32_parallel(d),
+                lambda d=scanlines: zlib.crc32(d),
+            )
+
+        assert adler32(scanlines) == zlib.adler32(scanlines).to_bytes(4, byteorder="big")
+        yield Case(
+            f"adler32/{size}", "adler32", size, n, lambda d=scanlines: adler32(d), lambda d=scanlines: zlib.adler32(d)
+        )
+
+        symbols = list(scanlines)
+        huffman_only = partial(_zlib_huffman_only, scanlines)
+        yield Case(f"build_tree/{size}", "huffman", size, n, lambda d=symbols: build_tree(d), huffman_only)
+        yield Case(f"huffman_encode/{size}", "huffman", size, n, lambda d=symbols: huffman_encode(d), huffman_only)
+        yield Case(
+            f"huffman_encode_bytes/{size}",
+            "huffman",
+            size,
+            n,
+            lambda d=scanlines: huffman_encode_bytes(d),
+            huffman_only,
+        )
+
+        for level in (0, 6):
+            idat = zlib.compress(scanlines, level)
+            png = _png_file(width, height, idat)
+            assert np.array_equal(decode_png(png).pixels(), image)
+            yield Case(
+                f"decode_png/zlib{level}/{size}",
+                "decode_png",
+                size,
+                n,
+                lambda b=png: decode_png(b).pixels(),
+                lambda d=idat: zlib.decompress(d),
+            )
+
+        # the cost of each CRC verify level on parsing the chunks, with the stored stream cut into 8 KiB IDAT chunks
+        png = _png_file(width, height, zlib.compress(scanlines, 0), 8192)
+        for verify in VERIFY_LEVELS:
+            assert decode_png(png, verify).ok
+            yield Case(
+                f"decode_png/verify-{verify}/{size}",
+                "decode_png",
+                size,
+                len(png),
+                lambda b=png, v=verify: decode_png(b, v),
+            )
+
+        nbytes = image.nbytes
+        yield Case(
+            f"checkerboard_array/{size}", "image_data", size, nbytes, lambda h=height, w=width: checkerboard_array(h, w)
+        )
+        yield Case(
+            f"transparent_rainbow_array/{size}",
+            "image_data",
+            size,
+            nbytes,
+            lambda h=height, w=width: transparent_rainbow_array(h, w),
+        )
+        yield Case(f"with_row_prefix/{size}", "image_data", size, nbytes, lambda a=image: with_row_prefix(a))
+        yield Case(f"checkerboard/{size}", "image_data", size, nbytes, lambda h=height, w=width: checkerboard(h, w))
+        rows = checkerboard(height, width)
+        yield Case(
+            f"flatten_with_row_prefix/{size}", "image_data", size, nbytes, lambda r=rows: flatten_with_row_prefix(r, 0)
+        )
+
+
+def time_call(fn: Callable[[], object], min_time: float, repeat: int) -> Tuple[int, List[float]]:
+    """
+    Time a call, after a warm-up call that also sizes the runs.
+
+    :return: The number of calls per run and the seconds per call of each run.
+    """
+    first = timeit.timeit(fn, number=1)
+    number = max(1, int(min_time / max(first, 1e-9)))
+    return number, [t / number for t in timeit.repeat(fn, number=number, repeat=repeat)]
+
+
+def run(cases: Iterator[Case], min_time: float = 0.05, repeat: int = 5, verbose: bool = True) -> List[Result]:
+    results: List[Result] = []
+    if verbose:
+        print_header()
+    for case in cases:
+        number, times = time_call(case.fn, min_time, repeat)
+        baseline_seconds = None
+        if case.baseline is not None:
+            baseline_seconds = min(time_call(case.baseline, min_time, repeat)[1])
+        result = Result(
+            name=case.name,
+            group=case.group,
+            size=case.size,
+            nbytes=case.nbytes,
+            number=number,
+            seconds=min(times),
+            median=float(np.median(times)),
+            baseline_seconds=baseline_seconds,
+        )
+        results.append(result)
+        if verbose:
+            print_result(result)
+    return results
+
+
+def print_header() -> None:
+    f = 14
+    print("case".ljust(40), "us / call".rjust(f), "MB/s".rjust(f), "zlib us".rjust(f), "x zlib".rjust(f))
+
+
+def print_result(result: Result) -> None:
+    f = 14
+    baseline = "" if result.baseline_seconds is None else f"{1e6 * result.baseline_seconds:.1f}"
+    ratio = "" if result.ratio is None else f"{result.ratio:.1f}"
+    print(
+        result.name.ljust(40),
+        f"{1e6 * result.seconds:.1f}".rjust(f),
+        f"{result.mb_per_s:.2f}".rjust(f),
+        baseline.rjust(f),
+        ratio.rjust(f),
+    )
+
+
+def save_results(filename: str, results: List[Result], min_time: float, repeat: int) -> None:
+    report = {
+        "version": VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "min_time": min_time,
+        "repeat": repeat,
+        "results": [result.to_dict() for result in results],
+    }
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+def load_results(filename: str) -> Dict[str, Result]:
+    with open(filename) as f:
+        report = json.load(f)
+    assert report.get("version") == VERSION, f"unsupported benchmark results version: {report.get('version')}"
+    return {d["name"]: Result.from_dict(d) for d in report["results"]}
+
+
+def compare(old: Dict[str, Result], new: Dict[str, Result], threshold: float = 0.1) -> List[str]:
+    """
+    Print the change in time per call of every case in both runs.
+
+    :param threshold: The relative slowdown above which a case is flagged, e.g. 0.1 for 10%.
+    :return: The names of the flagged cases.
+    """
+    f = 14
+    regressions: List[str] = []
+    print("case".ljust(40), "old us".rjust(f), "new us".rjust(f), "change".rjust(f))
+    for name, result in new.items():
+        if name not in old:
+            print(name.ljust(40), "".rjust(f), f"{1e6 * result.seconds:.1f}".rjust(f), "new".rjust(f))
+            continue
+        change = result.seconds / old[name].seconds - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        print(
+            name.ljust(40),
+            f"{1e6 * old[name].seconds:.1f}".rjust(f),
+            f"{1e6 * result.seconds:.1f}".rjust(f),
+            f"{100 * change:+.1f}%".rjust(f) + flag,
+        )
+    for name in [name for name in old if name not in new]:
+        print(name.ljust(40), f"{1e6 * old[name].seconds:.1f}".rjust(f), "".rjust(f), "missing".rjust(f))
+    print(f"{len(regressions)} of {len(new)} cases slower by more than {100 * threshold:.0f}%")
+    return regressions
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    # only run the cases whose name or group matches one of these glob patterns, e.g. "huffman", "crc32/*" or
+    # "*/128x128"
+    parser.add_argument("--filter", nargs="*", default=[])
+    # skip the 1024x1024 inputs
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--min-time", type=float, default=0.05, help="the minimum seconds per timed run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead")
+    parser.add_argument("--threshold", type=float, default=0.1, help="the relative slowdown to flag when comparing")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.compare:
+        regressions = compare(load_results(args.compare[0]), load_results(args.compare[1]), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    sizes = [s for s in SIZES if not (args.quick and s[1] * s[2] > 128 * 128)]
+    cases = iter_cases(sizes)
+    if args.filter:
+        cases = (
+            case
+            for case in cases
+            if any(fnmatch.fnmatch(case.name, p) or fnmatch.fnmatch(case.group, p) for p in args.filter)
+        )
+    results = run(cases, args.min_time, args.repeat)
+    if args.out:
+        save_results(args.out, results, args.min_time, args.repeat)
+        print(f"wrote {len(results)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
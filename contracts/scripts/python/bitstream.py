@@ -0,0 +1,222 @@
+"""
+Bit-level I/O in DEFLATE bit order.
+
+https://www.ietf.org/rfc/rfc1951.txt (section 3.1.1)
+
+Data elements are packed into bytes in order of increasing bit number within the byte, i.e. starting with the least
+significant bit of the byte. Data elements other than Huffman codes are packed starting with the least significant bit
+of the data element. Huffman codes are packed starting with the most significant bit of the code, so they are written
+here as bit-reversed integers (see huffman.canonical_codes(reverse=True)).
+"""
+
+from typing import Tuple, Union
+
+import numpy as np
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def pack_bits(values: np.ndarray, nbits: np.ndarray) -> Tuple[bytes, int]:
+    """
+    Pack a sequence of bit fields, least significant bit first.
+
+    :param values: The field values, each at most 64 bits wide. Bits above a field's width are ignored.
+    :param nbits: The width of each field in bits.
+    :return: The packed bytes (the last one zero-padded) and the total number of bits.
+
+    The output is built as little-endian 64 bit words. Each field lands in the word containing its first bit, with the
+    bits that do not fit spilling into the next word. Fields are in stream order, so the fields starting in the same
+    word form a run, and each run is OR-ed together with a single np.bitwise_or.reduceat.
+    """
+    nbits = np.asarray(nbits, dtype=np.uint64)
+    end = np.cumsum(nbits)
+    total = int(end[-1]) if len(end) else 0
+    start = end - nbits
+    word = (start >> np.uint64(6)).astype(np.int64)
+    shift = start & np.uint64(63)
+    # keep only the lowest nbits bits of each value, so they do not spill into the fields that follow
+    mask = np.where(nbits < 64, (np.uint64(1) << np.minimum(nbits, np.uint64(63))) - np.uint64(1), ~np.uint64(0))
+    v = np.asarray(values, dtype=np.uint64) & mask
+    low = v << shift
+    # v >> 64 is undefined, so shift the spilled bits down in two steps
+    high = (v >> (np.uint64(63) - shift)) >> np.uint64(1)
+
+    out = np.zeros((total + 63) // 64 + 1, dtype="<u8")
+    if total:
+        first = np.flatnonzero(np.r_[True, word[1:] != word[:-1]])
+        out[word[first]] |= np.bitwise_or.reduceat(low, first)
+        out[word[first] + 1] |= np.bitwise_or.reduceat(high, first)
+    return out.tobytes()[: (total + 7) // 8], total
+
+
+class BitWriter:
+    """
+    Writes bit fields least significant bit first.
+
+    Bits are collected in an integer accumulator and whole bytes are flushed to a bytearray, so writing a field costs a
+    shift, an OR and (every few fields) a small int.to_bytes.
+
+        >>> w = BitWriter()
+        >>> w.write(0b011, 3)
+        >>> w.write(0b1, 1)
+        >>> w.getvalue()
+        b'\\x0b'
+    """
+
+    def __init__(self) -> None:
+        self._out: bytearray = bytearray()
+        self._acc: int = 0
+        self._n: int = 0
+
+    def __len__(self) -> int:
+        """
+        The number of bits written so far.
+        """
+        return len(self._out) * 8 + self._n
+
+    def write(self, value: int, nbits: int) -> None:
+        """
+        Write the lowest `nbits` bits of `value`, least significant bit first.
+        """
+        self._acc |= (value & ((1 << nbits) - 1)) << self._n
+        self._n += nbits
+        if self._n >= 64:
+            self._flush()
+
+    def write_fields(self, values: np.ndarray, nbits: np.ndarray) -> None:
+        """
+        Write many fields at once (see pack_bits).
+        """
+        if not len(values):
+            return
+        self._flush()
+        # the pending bits (fewer than 8) become the first field
+        packed, total = pack_bits(np.concatenate([[self._acc], values]), np.concatenate([[self._n], nbits]))
+        whole = total // 8
+        self._out += packed[:whole]
+        self._n = total - whole * 8
+        self._acc = packed[whole] if self._n else 0
+
+    def align(self) -> None:
+        """
+        Skip to the next byte boundary, padding with zero bits.
+        """
+        self._flush()
+        if self._n:
+            self._out.append(self._acc)
+            self._acc = 0
+            self._n = 0
+
+    def write_bytes(self, data: Buffer) -> None:
+        """
+        Write whole bytes, after skipping to the next byte boundary.
+        """
+        self.align()
+        self._out += data
+
+    def getvalue(self) -> bytes:
+        """
+        The bytes written so far, the last one zero-padded.
+        """
+        self._flush()
+        if self._n:
+            return bytes(self._out) + bytes([self._acc])
+        return bytes(self._out)
+
+    def _flush(self) -> None:
+        whole = self._n >> 3
+        if whole:
+            self._out += (self._acc & ((1 << (whole * 8)) - 1)).to_bytes(whole, byteorder="little")
+            self._acc >>= whole * 8
+            self._n -= whole * 8
+
+
+class BitReader:
+    """
+    Reads bit fields least significant bit first.
+
+    Bytes are loaded into an integer accumulator up to 8 at a time, so reading a field is usually just a mask and a
+    shift. peek() and skip() allow table-driven Huffman decoding: look at the next few bits, then consume only as many
+    as the matched code is long.
+    """
+
+    def __init__(self, data: Buffer, pos: int = 0) -> None:
+        self._data: memoryview = memoryview(data).cast("B")
+        # position of the next byte to load into the accumulator
+        self._pos: int = pos
+        self._acc: int = 0
+        self._n: int = 0
+
+    def _refill(self, nbits: int) -> None:
+        while self._n < nbits:
+            chunk = self._data[self._pos : self._pos + 8]
+            if not chunk:
+                raise EOFError("read past the end of the bit stream")
+            self._acc |= int.from_bytes(chunk, byteorder="little") << self._n
+            self._pos += len(chunk)
+            self._n += 8 * len(chunk)
+
+    def peek(self, nbits: int) -> int:
+        """
+        Return the next `nbits` bits without consuming them. Bits past the end of the data read as zeros.
+        """
+        if self._n < nbits:
+            try:
+                self._refill(nbits)
+            except EOFError:
+                pass
+        return self._acc & ((1 << nbits) - 1)
+
+    def skip(self, nbits: int) -> None:
+        """
+        Consume `nbits` bits.
+        """
+        if self._n < nbits:
+            self._refill(nbits)
+        self._acc >>= nbits
+        self._n -= nbits
+
+    def read(self, nbits: int) -> int:
+        """
+        Read a field of `nbits` bits, least significant bit first.
+        """
+        if self._n < nbits:
+            self._refill(nbits)
+        value = self._acc & ((1 << nbits) - 1)
+        self._acc >>= nbits
+        self._n -= nbits
+        return value
+
+    def align(self) -> None:
+        """
+        Skip to the next byte boundary.
+        """
+        drop = self._n & 7
+        self._acc >>= drop
+        self._n -= drop
+
+    def read_bytes(self, n: int) -> memoryview:
+        """
+        Read `n` whole bytes, after skipping to the next byte boundary. The result is a view into the input.
+        """
+        self.align()
+        # hand buffered whole bytes back to the input
+        self._pos -= self._n >> 3
+        self._acc = 0
+        self._n = 0
+        if self._pos + n > len(self._data):
+            raise EOFError("read past the end of the bit stream")
+        out = self._data[self._pos : self._pos + n]
+        self._pos += n
+        return out
+
+    @property
+    def byte_position(self) -> int:
+        """
+        The offset of the first byte not (completely) consumed yet.
+        """
+        return self._pos - (self._n >> 3)
+
+    @property
+    def bits_consumed(self) -> int:
+        return self._pos * 8 - self._n
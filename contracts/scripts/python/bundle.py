@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Packed asset bundle.
+
+Compiles the pattern and palette files (assets/assets/patterns, palettes) and their DNA index order (definitions.py)
+into a single binary file, which render workers memory-map instead of parsing JSON and JASC-PAL text. Patterns and
+palettes are read as zero-copy NumPy views of the mapping.
+
+All integers are little-endian.
+
+    header      HEADER                  magic, version, entry counts, offsets of the sections
+    patterns    PATTERN_RECORD x n      one per (layer, pattern index) of the definitions, in DNA order
+    palettes    PALETTE_RECORD x n      one per (palette code, palette index) of the definitions
+    names       utf-8                   pattern and palette names, referenced by (offset, length)
+    data        uint8                   pattern indices (height x width) and palette colors (n x RGBA), each aligned
+                                        to ALIGNMENT bytes
+
+A pattern of the definitions without a pattern file has width and height 0. The digest of an entry is the first 16
+bytes of the SHA-256 of its data, the content address used by the layer cache.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from assets import Assets
+from definitions import LAYERS, Definitions, load_definitions
+from palettes import PALETTES_DIR, read_palettes
+from patterns import PATTERNS_DIR, PatternFile, read_pattern_file
+
+MAGIC: bytes = b"OAVBUNDL"
+VERSION: int = 1
+ALIGNMENT: int = 64
+
+# magic, version, number of patterns, number of palettes, offset of the names, offset of the data
+HEADER = struct.Struct("<8sIIIQQ")
+# layer index, pattern index, palette code, width, height, data offset, name offset, name length, digest
+PATTERN_RECORD = struct.Struct("<BBBxHHQIH16s")
+# palette code, palette index, number of colors, data offset, name offset, name length, digest
+PALETTE_RECORD = struct.Struct("<BBHQIH16s")
+
+LAYER_INDEX: Dict[str, int] = {layer.name: layer.index for layer in LAYERS}
+LAYER_NAME: Dict[int, str] = {layer.index: layer.name for layer in LAYERS}
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()[:16]
+
+
+def _align(n: int) -> int:
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def build_bundle(
+    filename: str,
+    definitions: Optional[Definitions] = None,
+    patterns_dir: str = PATTERNS_DIR,
+    palettes_dir: str = PALETTES_DIR,
+) -> int:
+    """
+    Compile the assets into a bundle file.
+
+    :return: The size of the bundle in bytes.
+    """
+    definitions = definitions or load_definitions()
+    names = bytearray()
+    data = bytearray()
+
+    def add_name(name: str) -> Tuple[int, int]:
+        encoded = name.encode()
+        names.extend(encoded)
+        return len(names) - len(encoded), len(encoded)
+
+    def add_data(array: np.ndarray) -> Tuple[int, bytes]:
+        data.extend(bytes(_align(len(data)) - len(data)))
+        raw = np.ascontiguousarray(array, dtype=np.uint8).tobytes()
+        data.extend(raw)
+        return len(data) - len(raw), _digest(raw)
+
+    pattern_records = []
+    for layer in LAYERS:
+        for index, (name, code) in enumerate(definitions.patterns.get(layer.name, [])):
+            path = os.path.join(patterns_dir, layer.name, f"{name}.json")
+            width = height = offset = 0
+            digest = bytes(16)
+            if os.path.exists(path):
+                pattern = read_pattern_file(path)
+                width, height = pattern.width, pattern.height
+                offset, digest = add_data(pattern.indices)
+            pattern_records.append((layer.index, index, code, width, height, offset, *add_name(name), digest))
+
+    palette_records = []
+    for code, palette_names in sorted(definitions.palettes.items()):
+        colors = read_palettes(code, palettes_dir)
+        for index, name in enumerate(palette_names):
+            assert name in colors, f"missing palette file for palette code {code}: {name}"
+            offset, digest = add_data(colors[name])
+            palette_records.append((code, index, len(colors[name]), offset, *add_name(name), digest))
+
+    index_size = HEADER.size + len(pattern_records) * PATTERN_RECORD.size + len(palette_records) * PALETTE_RECORD.size
+    names_offset = index_size
+    data_offset = _align(names_offset + len(names))
+    out = bytearray(HEADER.pack(MAGIC, VERSION, len(pattern_records), len(palette_records), names_offset, data_offset))
+    for record in pattern_records:
+        out += PATTERN_RECORD.pack(*record)
+    for record in palette_records:
+        out += PALETTE_RECORD.pack(*record)
+    out += names
+    out += bytes(data_offset - len(out))
+    out += data
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(out)
+    os.replace(tmp, filename)
+    return len(out)
+
+
+class Bundle:
+    """
+    A memory-mapped asset bundle.
+
+    The returned arrays are read-only views of the mapping, valid until close.
+    """
+
+    def __init__(self, filename: str):
+        self.filename: str = filename
+        with open(filename, "rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_patterns, num_palettes, names_offset, data_offset = HEADER.unpack_from(self._mmap, 0)
+        assert magic == MAGIC, f"not an asset bundle: {filename}"
+        assert version == VERSION, f"unsupported asset bundle version: {version}"
+        self._names_offset: int = names_offset
+        self._data_offset: int = data_offset
+        # (layer index, pattern index) -> record
+        self._patterns: Dict[Tuple[int, int], tuple] = {}
+        offset = HEADER.size
+        for record in PATTERN_RECORD.iter_unpack(self._mmap[offset : offset + num_patterns * PATTERN_RECORD.size]):
+            self._patterns[(record[0], record[1])] = record
+        offset += num_patterns * PATTERN_RECORD.size
+        # (palette code, palette index) -> record
+        self._palettes: Dict[Tuple[int, int], tuple] = {}
+        for record in PALETTE_RECORD.iter_unpack(self._mmap[offset : offset + num_palettes * PALETTE_RECORD.size]):
+            self._palettes[(record[0], record[1])] = record
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __enter__(self) -> "Bundle":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _name(self, offset: int, length: int) -> str:
+        start = self._names_offset + offset
+        return self._mmap[start : start + length].decode()
+
+    def _view(self, offset: int, count: int) -> np.ndarray:
+        return np.frombuffer(self._mmap, dtype=np.uint8, count=count, offset=self._data_offset + offset)
+
+    def definitions(self) -> Definitions:
+        """
+        The definitions the bundle was built from.
+        """
+        patterns: Dict[str, List[Tuple[str, int]]] = {}
+        for (layer, _), record in self._patterns.items():
+            patterns.setdefault(LAYER_NAME[layer], []).append((self._name(record[6], record[7]), record[2]))
+        palettes: Dict[int, List[str]] = {}
+        for (code, _), record in self._palettes.items():
+            palettes.setdefault(code, []).append(self._name(record[4], record[5]))
+        return Definitions(patterns=patterns, palettes=palettes)
+
+    def pattern(self, layer: str, index: int) -> Optional[PatternFile]:
+        record = self._patterns.get((LAYER_INDEX[layer], index))
+        if record is None or record[3] == 0:
+            return None
+        _, _, code, width, height, offset, name_offset, name_length, _ = record
+        return PatternFile(
+            layer=layer,
+            pattern_name=self._name(name_offset, name_length),
+            palette_code=code,
+            width=width,
+            height=height,
+            indices=self._view(offset, width * height).reshape(height, width),
+        )
+
+    def pattern_digest(self, layer: str, index: int) -> Optional[str]:
+        record = self._patterns.get((LAYER_INDEX[layer], index))
+        if record is None or record[3] == 0:
+            return None
+        return record[8].hex()
+
+    def palette(self, code: int, index: int) -> Optional[np.ndarray]:
+        record = self._palettes.get((code, index))
+        if record is None:
+            return None
+        return self._view(record[3], 4 * record[2]).reshape(record[2], 4)
+
+
+class BundleAssets(Assets):
+    """
+    Assets (see render.Assets) served from a bundle.
+    """
+
+    def __init__(self, bundle: Bundle, **kwargs):
+        super().__init__(definitions=bundle.definitions(), **kwargs)
+        self.bundle: Bundle = bundle
+
+    def pattern(self, layer: str, index: int) -> Optional[PatternFile]:
+        return self.bundle.pattern(layer, index)
+
+    def pattern_digest(self, layer: str, index: int) -> Optional[str]:
+        return self.bundle.pattern_digest(layer, index)
+
+    def palette(self, code: int, index: int) -> Optional[np.ndarray]:
+        return self.bundle.palette(code, index)
+
+
+def check_bundle(bundle: Bundle, assets: Assets) -> None:
+    """
+    Check every pattern and palette of the bundle against the asset files.
+    """
+    definitions = assets.definitions
+    assert bundle.definitions() == definitions, "bundle definitions differ"
+    for layer, patterns in definitions.patterns.items():
+        for index in range(len(patterns)):
+            expected, found = assets.pattern(layer, index), bundle.pattern(layer, index)
+            assert (expected is None) == (found is None), f"{layer} pattern {index}"
+            if expected is not None:
+                assert np.array_equal(expected.indices, found.indices), f"{layer} pattern {index}"
+                assert expected.palette_code == found.palette_code, f"{layer} pattern {index}"
+    for code, palettes in definitions.palettes.items():
+        for index in range(len(palettes)):
+            assert np.array_equal(assets.palette(code, index), bundle.palette(code, index)), f"palette {code} {index}"
+    print(f"bundle: {len(bundle._patterns)} patterns and {len(bundle._palettes)} palettes match the asset files")
+
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from assets import Assets
+from bundle import Bundle, BundleAssets
+from render import Renderer, random_dnas
+imported = time.perf_counter()
+assets = BundleAssets(Bundle(sys.argv[1])) if sys.argv[1] else Assets()
+renderer = Renderer(assets)
+loaded = time.perf_counter()
+for dna in random_dnas(assets.definitions, 1):
+    renderer.render_png(dna)
+rendered = time.perf_counter()
+print(json.dumps({"imports": imported - start, "load": loaded - imported, "render": rendered - loaded}))
+"""
+
+
+def cold_start(filename: Optional[str]) -> Dict[str, float]:
+    """
+    The time for a new render worker to load the assets and render a first avatar, from the bundle or (None) the asset
+    files. Measured in a fresh interpreter, so that module imports count; "interpreter" is the interpreter start and
+    exit, the time of the process not spent in the other phases.
+
+    :return: the time in seconds of each phase and the total
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START_SCRIPT, filename or ""],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    total = time.perf_counter() - start
+    phases = json.loads(result.stdout)
+    return {"interpreter": total - sum(phases.values()), **phases, "total": total}
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    parser.add_argument("bundle", help="the bundle file to write")
+    return parser.parse_args()
+
+
+def main() -> None:
+    f = 18
+    args = parse_args()
+    start = time.perf_counter()
+    size = build_bundle(args.bundle)
+    print("built".ljust(f), args.bundle, f"({size} bytes, {1e3 * (time.perf_counter() - start):.0f} ms)")
+    with Bundle(args.bundle) as bundle:
+        check_bundle(bundle, Assets())
+    for name, filename in ("files", None), ("bundle", args.bundle):
+        phases = cold_start(filename)
+        print(f"cold start, {name}".ljust(f), ", ".join(f"{k} {1e3 * v:.1f} ms" for k, v in phases.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Content-addressed LRU caches for the offline renderer.
+
+Two tiers:
+
+    layers  the RGBA rendering of a (pose, layer, pattern, palette), keyed by a digest of the pattern and palette
+            contents, so an entry is only reused while the asset files it was rendered from are unchanged
+    pngs    the PNG bytes of an avatar, keyed by a digest of its layer keys and the PNG encoding settings
+
+Both are bounded by the total size of their values in bytes, evicting the least recently used entries first, and
+count hits, misses and evictions. A cache can be saved to and loaded from a file (pickle, so only load files written
+by your own workers), so a restarted worker starts warm.
+"""
+
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+import numpy as np
+
+CACHE_FILE_VERSION: int = 1
+
+_MISSING = object()
+
+
+def digest(*parts: Any) -> str:
+    """
+    A hex digest of strings, bytes and numbers.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = part.tobytes()
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = str(part).encode()
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def sizeof(value: Any) -> int:
+    """
+    The approximate size in bytes of a cached value: arrays, bytes, and objects of those (e.g. render.LayerImage).
+    """
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if hasattr(value, "__dict__"):
+        return sum(sizeof(v) for v in vars(value).values())
+    return 0
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print(self, name: str = "cache"):
+        f = 18
+        print(name)
+        print("  hits".ljust(f), self.hits)
+        print("  misses".ljust(f), self.misses)
+        print("  hit rate".ljust(f), f"{100 * self.hit_rate:.1f}%")
+        print("  evictions".ljust(f), self.evictions)
+        print("  entries".ljust(f), self.entries)
+        print("  size".ljust(f), self.size)
+
+
+class LRUCache:
+    """
+    A least recently used cache bounded by the total size of its values.
+
+    :param max_size: The maximum total size of the values, in bytes (see sizeof). None for no limit.
+    :param sizeof: The size of a value.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, sizeof: Callable[[Any], int] = sizeof):
+        self.max_size: Optional[int] = max_size
+        self.sizeof: Callable[[Any], int] = sizeof
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: dict = {}
+        self.stats: CacheStats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if key in self._entries:
+            self._remove(key)
+        size = self.sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            # would evict everything and still not fit
+            return
+        self._entries[key] = value
+        self._sizes[key] = size
+        self.stats.size += size
+        self.stats.entries = len(self._entries)
+        while self.max_size is not None and self.stats.size > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        The cached value of a key, computing and caching it on a miss. None values are cached too.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._sizes.clear()
+        self.stats.entries = 0
+        self.stats.size = 0
+
+    def _remove(self, key: Hashable) -> None:
+        del self._entries[key]
+        self.stats.size -= self._sizes.pop(key)
+        self.stats.entries = len(self._entries)
+
+    def save(self, filename: str) -> None:
+        """
+        Write the entries to a file, least recently used first. The write is atomic.
+        """
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((CACHE_FILE_VERSION, list(self._entries.items())), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+
+    def load(self, filename: str) -> int:
+        """
+        Add the entries of a file written by save, if it exists, up to max_size.
+
+        :return: The number of entries loaded.
+        """
+        if not os.path.exists(filename):
+            return 0
+        with open(filename, "rb") as f:
+            version, entries = pickle.load(f)
+        if version != CACHE_FILE_VERSION:
+            return 0
+        for key, value in entries:
+            self.put(key, value)
+        # loading is not an eviction
+        self.stats.evictions = 0
+        return len(entries)
+
+
+def main() -> None:
+    """
+    Render random avatars cold, warm, and after a restart from the saved caches.
+    """
+    import tempfile
+
+    from assets import Assets
+    from render import Renderer, random_dnas
+
+    def run(label: str, renderer: Renderer) -> None:
+        start = time.perf_counter()
+        for dna in dnas:
+            renderer.render_png(dna)
+        elapsed = time.perf_counter() - start
+        print(f"{label}".ljust(18), f"{len(dnas) / elapsed:.0f} avatars/s")
+
+    renderer = Renderer()
+    definitions = renderer.assets.definitions
+    # repeat DNAs, as in a bulk render of a collection with duplicates and re-renders
+    dnas = random_dnas(definitions, 500) * 4
+    run("cold", renderer)
+    run("warm", renderer)
+    renderer.assets.layer_cache.stats.print("layers")
+    renderer.png_cache.stats.print("pngs")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        layers_file = os.path.join(tmp, "layers.cache")
+        pngs_file = os.path.join(tmp, "pngs.cache")
+        renderer.assets.layer_cache.save(layers_file)
+        renderer.png_cache.save(pngs_file)
+        print("saved".ljust(18), os.path.getsize(layers_file) + os.path.getsize(pngs_file), "bytes")
+
+        restarted = Renderer(Assets(definitions))
+        restarted.assets.layer_cache.load(layers_file)
+        run("restart, layers", restarted)
+        restarted = Renderer(Assets(definitions))
+        restarted.assets.layer_cache.load(layers_file)
+        restarted.png_cache.load(pngs_file)
+        run("restart, all", restarted)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,447 @@
-def adler32(data: bytes) -> bytes:
+#!/usr/bin/env python3
+import mmap
+import os
+import struct
+import timeit
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from typing import List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure Python path is used without it
+    np = None
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+# The magic number 65521 is the largest prime smaller than 2^16
+# It is used as the modulus for the checksum calculation
+# This is done to avoid overflows and to keep the checksum value small
+ADLER32_BASE: int = 65521
+
+# NMAX is the largest n such that 255n(n+1)/2 + (n+1)(BASE-1) <= 2^32-1, i.e. the
+# number of bytes that can be summed before the modulo has to be taken (as in zlib)
+ADLER32_NMAX: int = 5552
+
+
+def _adler32_update_python(a: int, b: int, data: memoryview) -> Tuple[int, int]:
+    """
+    Advance the Adler-32 sums over the input data, one NMAX block at a time.
+
+    Within a block the modulo is deferred: `a` grows by the sum of the block and `b` grows
+    by the sum of the running values of `a`, which itertools.accumulate produces in C.
+    """
+    for i in range(0, len(data), ADLER32_NMAX):
+        block = data[i : i + ADLER32_NMAX]
+        b = (b + sum(accumulate(block, initial=a)) - a) % ADLER32_BASE
+        a = (a + sum(block)) % ADLER32_BASE
+    return a, b
+
+
+def _adler32_update_numpy(a: int, b: int, data: memoryview) -> Tuple[int, int]:
+    """
+    Advance the Adler-32 sums over the input data using NumPy.
+
+    The data is viewed as a (blocks, NMAX) matrix. The cumulative sum along each row gives
+    the per-block increase of `a` (last column) and of `b` (row sum, relative to the value
+    of `a` at the start of the block), which are then folded in order.
+    """
+    x = np.frombuffer(data, dtype=np.uint8)
+    n_blocks = len(x) // ADLER32_NMAX
+    if n_blocks:
+        sums = np.cumsum(x[: n_blocks * ADLER32_NMAX].reshape(n_blocks, ADLER32_NMAX), axis=1, dtype=np.uint64)
+        for a_inc, b_inc in zip(sums[:, -1].tolist(), sums.sum(axis=1).tolist()):
+            b = (b + ADLER32_NMAX * a + b_inc) % ADLER32_BASE
+            a = (a + a_inc) % ADLER32_BASE
+    tail = x[n_blocks * ADLER32_NMAX :]
+    if len(tail):
+        sums = np.cumsum(tail, dtype=np.uint64)
+        b = (b + len(tail) * a + int(sums.sum())) % ADLER32_BASE
+        a = (a + int(sums[-1])) % ADLER32_BASE
+    return a, b
+
+
+def _adler32_update(value: int, data: Buffer) -> int:
+    a = value & 0xFFFF
+    b = value >> 16
+    mv = memoryview(data).cast("B")
+    if np is not None and len(mv) >= ADLER32_NMAX:
+        a, b = _adler32_update_numpy(a, b, mv)
+    else:
+        a, b = _adler32_update_python(a, b, mv)
+    return b << 16 | a
+
+
+def adler32(data: Buffer, value: int = 1) -> bytes:
     """
     Calculates the Adler-32 checksum of the input data.
 
     :param data: The input data to calculate the checksum for.
+    :param value: The running checksum to continue from, as with zlib.adler32.
     :return: The Adler-32 checksum as a 4-byte value.
     """
-    a: int = 1
-    b: int = 0
+    # The Adler-32 checksum is stored as a 4-byte value
+    return _adler32_update(value, data).to_bytes(4, byteorder="big", signed=False)
+
+
+def adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """
+    Combine the Adler-32 checksums of two adjacent pieces of data.
 
-    # The magic number 65521 is the largest prime smaller than 2^16
-    # It is used as the modulus for the checksum calculation
-    # This is done to avoid overflows and to keep the checksum value small
+    :param adler1: The Adler-32 checksum of the first piece.
+    :param adler2: The Adler-32 checksum of the second piece.
+    :param len2: The length of the second piece in bytes.
+    :return: The Adler-32 checksum of the concatenation, as with zlib's adler32_combine.
+    """
+    a1, b1 = adler1 & 0xFFFF, adler1 >> 16
+    a2, b2 = adler2 & 0xFFFF, adler2 >> 16
+    # adler2 was computed starting from a = 1 rather than a = a1, so each of its len2
+    # running values of `a` is short by (a1 - 1)
+    a = (a1 + a2 - 1) % ADLER32_BASE
+    b = (b1 + b2 + (len2 % ADLER32_BASE) * (a1 - 1)) % ADLER32_BASE
+    return b << 16 | a
 
-    # Process each byte of the data in order
-    for i in range(len(data)):
-        a = (a + data[i]) % 65521
-        b = (b + a) % 65521
 
-    # The Adler-32 checksum is stored as a 4-byte value
-    return (b << 16 | a).to_bytes(4, byteorder="big", signed=False)
+class Adler32:
+    """
+    Incremental Adler-32 calculator.
+
+    Equivalent to zlib.adler32, but allows the input to be fed in pieces, e.g. one
+    scanline at a time while building a zlib stream.
+    """
+
+    def __init__(self, data: Buffer = b"", value: int = 1) -> None:
+        self.value: int = value
+        if data:
+            self.update(data)
+
+    def update(self, data: Buffer) -> "Adler32":
+        self.value = _adler32_update(self.value, data)
+        return self
+
+    def digest(self) -> bytes:
+        """
+        :return: The Adler-32 checksum as a 4-byte big-endian value, as stored in the zlib trailer.
+        """
+        return self.value.to_bytes(4, byteorder="big")
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def copy(self) -> "Adler32":
+        return Adler32(value=self.value)
+
+
+# 0xEDB88320 is the CRC-32 polynomial in reversed bit order
+# this translates to the polynomial with equation
+# x^32 + x^26 + x^23 + x^22 + x^16 + x^12 + x^11 + x^10 + x^8 + x^7 + x^5 + x^4 + x^2 + x + 1
+# which is the same as the one used in the PNG specification
+CRC32_POLYNOMIAL: int = 0xEDB88320
+
+
+def _crc32_tables(n: int) -> List[List[int]]:
+    """
+    Build the lookup tables for slicing-by-n CRC-32.
+
+    Table 0 is the classic byte-at-a-time table: the CRC of a single byte value.
+    Table k is the CRC of that byte followed by k zero bytes, which lets us process
+    n bytes with n independent lookups instead of n sequential table steps.
+    """
+    table0: List[int] = []
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            # If the LSB of the checksum is 1, shift it right and XOR it with the polynomial
+            # Otherwise, just shift it right
+            c = (c >> 1) ^ CRC32_POLYNOMIAL if c & 1 else c >> 1
+        table0.append(c)
+
+    tables: List[List[int]] = [table0]
+    for k in range(1, n):
+        prev = tables[k - 1]
+        tables.append([(prev[i] >> 8) ^ table0[prev[i] & 0xFF] for i in range(256)])
+    return tables
+
+
+T0, T1, T2, T3, T4, T5, T6, T7 = _crc32_tables(8)
+
+
+def _crc32_update(crc: int, data: Buffer) -> int:
+    """
+    Advance a raw (pre-inverted) CRC-32 register over the input data.
+
+    The bulk of the data is consumed 8 bytes at a time (slicing-by-8), the trailing
+    bytes are consumed with the byte-at-a-time table.
+    """
+    mv = memoryview(data).cast("B")
+    n = len(mv)
+    bulk = n - (n & 7)
+    t0, t1, t2, t3, t4, t5, t6, t7 = T0, T1, T2, T3, T4, T5, T6, T7
+
+    # Slicing-by-8: fold 8 bytes into the register with 8 independent lookups
+    for lo, hi in struct.iter_unpack("<II", mv[:bulk]):
+        lo ^= crc
+        crc = (
+            t7[lo & 0xFF]
+            ^ t6[(lo >> 8) & 0xFF]
+            ^ t5[(lo >> 16) & 0xFF]
+            ^ t4[lo >> 24]
+            ^ t3[hi & 0xFF]
+            ^ t2[(hi >> 8) & 0xFF]
+            ^ t1[(hi >> 16) & 0xFF]
+            ^ t0[hi >> 24]
+        )
+
+    # Remaining 0-7 bytes
+    for byte in mv[bulk:]:
+        crc = t0[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+
+    return crc
+
+
+class Crc32:
+    """
+    Incremental CRC-32 calculator.
+
+    Equivalent to zlib.crc32, but allows the input to be fed in pieces, e.g. the chunk
+    type followed by the chunk data of a PNG chunk, without concatenating them first.
+
+        >>> Crc32(b"IEND").value == zlib.crc32(b"IEND")
+        True
+        >>> Crc32().update(b"IDAT").update(b"...").digest()  # doctest: +SKIP
+    """
+
+    def __init__(self, data: Buffer = b"", value: int = 0) -> None:
+        # The register holds the checksum in its pre/post-inverted form
+        self._crc: int = value ^ 0xFFFFFFFF
+        if data:
+            self.update(data)
+
+    def update(self, data: Buffer) -> "Crc32":
+        self._crc = _crc32_update(self._crc, data)
+        return self
+
+    @property
+    def value(self) -> int:
+        return self._crc ^ 0xFFFFFFFF
 
+    def digest(self) -> bytes:
+        """
+        :return: The CRC-32 checksum as a 4-byte big-endian value, as stored in PNG chunks.
+        """
+        return self.value.to_bytes(4, byteorder="big")
 
-def crc32(chunkData: bytes) -> int:
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def copy(self) -> "Crc32":
+        return Crc32(value=self.value)
+
+
+def crc32(chunkData: Buffer, value: int = 0) -> int:
     """
     Calculates the CRC-32 checksum of the input data.
 
     :param chunkData: The input data to calculate the checksum for.
+    :param value: The running checksum to continue from, as with zlib.crc32.
     :return: The CRC-32 checksum as a 4-byte value.
     """
-    # Initialize the checksum to 0xffffffff
-    checksum = 0xFFFFFFFF
+    return _crc32_update(value ^ 0xFFFFFFFF, chunkData) ^ 0xFFFFFFFF
 
-    # Loop through each byte of the chunk data
-    for i in range(len(chunkData)):
-        # XOR the checksum with the current byte
-        checksum ^= chunkData[i]
 
-        # Loop through each bit of the current byte
-        for j in range(8):
-            # If the LSB of the checksum is 1, shift it right and XOR it with the polynomial
-            if checksum & 1:
-                # 0xEDB88320 is the CRC-32 polynomial in reversed bit order
-                # this translates to the polynomial with equation
-                # x^32 + x^26 + x^23 + x^22 + x^16 + x^12 + x^11 + x^10 + x^8 + x^7 + x^5 + x^4 + x^2 + x + 1
-                # which is the same as the one used in the PNG specification
-                checksum = (checksum >> 1) ^ 0xEDB88320
-            # Otherwise, just shift it right
-            else:
-                checksum >>= 1
+def _gf2_matrix_times(mat: List[int], vec: int) -> int:
+    """
+    Multiply a 32x32 matrix over GF(2), given as its columns, by a 32-bit vector.
+    """
+    result = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            result ^= mat[i]
+        vec >>= 1
+        i += 1
+    return result
+
+
+def _gf2_matrix_square(mat: List[int]) -> List[int]:
+    return [_gf2_matrix_times(mat, column) for column in mat]
+
+
+# _CRC32_ZEROS[k] is the operator (a GF(2) matrix) advancing a CRC-32 over 2^k zero bytes, built on first use
+_CRC32_ZEROS: List[List[int]] = []
+
+
+def _crc32_zeros(k: int) -> List[int]:
+    if not _CRC32_ZEROS:
+        # the operator for one zero bit: shift right, and add the polynomial if the bit shifted out was set
+        bit = [CRC32_POLYNOMIAL] + [1 << (n - 1) for n in range(1, 32)]
+        # square three times for one zero byte
+        _CRC32_ZEROS.append(_gf2_matrix_square(_gf2_matrix_square(_gf2_matrix_square(bit))))
+    while len(_CRC32_ZEROS) <= k:
+        _CRC32_ZEROS.append(_gf2_matrix_square(_CRC32_ZEROS[-1]))
+    return _CRC32_ZEROS[k]
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """
+    Combine the CRC-32 checksums of two adjacent pieces of data.
+
+    The CRC of the concatenation is the CRC of the first piece advanced over len2 zero bytes, XOR the CRC of the second
+    piece. Advancing over zeros is linear over GF(2), so it is done with the precomputed operators for 2^k zero bytes,
+    one for each bit set in len2.
+
+    :param crc1: The CRC-32 checksum of the first piece.
+    :param crc2: The CRC-32 checksum of the second piece.
+    :param len2: The length of the second piece in bytes.
+    :return: The CRC-32 checksum of the concatenation, as with zlib's crc32_combine.
+    """
+    k = 0
+    while len2 > 0:
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(_crc32_zeros(k), crc1)
+        len2 >>= 1
+        k += 1
+    return crc1 ^ crc2
+
+
+# buffers smaller than this are not worth splitting across threads
+CRC32_MIN_SEGMENT: int = 1 << 20
+
+
+def crc32_parallel(
+    data: Buffer,
+    workers: Optional[int] = None,
+    value: int = 0,
+    executor: Optional[ThreadPoolExecutor] = None,
+    min_segment: int = CRC32_MIN_SEGMENT,
+) -> int:
+    """
+    Calculates the CRC-32 checksum of a large buffer on several cores.
+
+    The buffer (e.g. an mmap of a file) is split into one segment per worker, each checksummed with zlib.crc32 on a
+    memoryview of the segment, and the segment CRCs are merged in order with crc32_combine. zlib.crc32 releases the GIL,
+    so a thread pool scales with the number of cores without copying or pickling the data. The pool must be a thread
+    pool: memoryview segments cannot be pickled, so a ProcessPoolExecutor would fail.
+
+    :param data: The input data to calculate the checksum for.
+    :param workers: The number of segments, by default the number of CPUs.
+    :param value: The running checksum to continue from, as with zlib.crc32.
+    :param executor: The thread pool to run on, by default one created for the call.
+    :param min_segment: The minimum segment size in bytes.
+    :return: The CRC-32 checksum, equal to zlib.crc32(data, value).
+    """
+    mv = memoryview(data).cast("B")
+    if len(mv) < 2 * min_segment:
+        return zlib.crc32(mv, value)
+    workers = workers or os.cpu_count() or 1
+    n = min(workers, len(mv) // min_segment)
+    if n <= 1:
+        return zlib.crc32(mv, value)
+    bounds = [len(mv) * i // n for i in range(n + 1)]
+    segments = [mv[start:end] for start, end in zip(bounds, bounds[1:])]
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            crcs = list(pool.map(zlib.crc32, segments))
+    else:
+        assert isinstance(executor, ThreadPoolExecutor), f"crc32_parallel needs a thread pool, not {executor!r}"
+        crcs = list(executor.map(zlib.crc32, segments))
+    crc = crc32_combine(value, crcs[0], len(segments[0]))
+    for segment, segment_crc in zip(segments[1:], crcs[1:]):
+        crc = crc32_combine(crc, segment_crc, len(segment))
+    return crc
+
+
+def benchmark_crc32(sizes: Tuple[int, ...] = (16, 4 * 1024, 64 * 1024, 1024 * 1024)) -> None:
+    """
+    Compare crc32 against zlib.crc32 for a few input sizes.
+    """
+    f = 12
+    print("size".ljust(f), "crc32 MB/s".ljust(f), "zlib MB/s".ljust(f), "ratio".ljust(f))
+    for size in sizes:
+        data = bytes((i * 31 + (i >> 7)) & 0xFF for i in range(size))
+        assert crc32(data) == zlib.crc32(data)
+        number = max(1, (1024 * 1024) // size)
+        ours = min(timeit.repeat(lambda: crc32(data), number=number, repeat=3)) / number
+        ref = min(timeit.repeat(lambda: zlib.crc32(data), number=number * 100, repeat=3)) / (number * 100)
+        print(
+            str(size).ljust(f),
+            f"{size / ours / 1e6:.2f}".ljust(f),
+            f"{size / ref / 1e6:.2f}".ljust(f),
+            f"{ours / ref:.1f}x".ljust(f),
+        )
+
+
+def benchmark_adler32(sizes: Tuple[int, ...] = (16, 4 * 1024, 64 * 1024, 1024 * 1024)) -> None:
+    """
+    Compare adler32 against zlib.adler32 for a few input sizes.
+    """
+    f = 12
+    print("size".ljust(f), "adler32 MB/s".ljust(f), "zlib MB/s".ljust(f), "ratio".ljust(f))
+    for size in sizes:
+        data = bytes((i * 31 + (i >> 7)) & 0xFF for i in range(size))
+        assert adler32(data) == zlib.adler32(data).to_bytes(4, byteorder="big")
+        number = max(1, (1024 * 1024) // size)
+        ours = min(timeit.repeat(lambda: adler32(data), number=number, repeat=3)) / number
+        ref = min(timeit.repeat(lambda: zlib.adler32(data), number=number * 100, repeat=3)) / (number * 100)
+        print(
+            str(size).ljust(f),
+            f"{size / ours / 1e6:.2f}".ljust(f),
+            f"{size / ref / 1e6:.2f}".ljust(f),
+            f"{ours / ref:.1f}x".ljust(f),
+        )
+
+
+def check_crc32_combine(n: int = 200, seed: int = 0) -> None:
+    """
+    Check crc32_combine and crc32_parallel against zlib.crc32 on random splits of random data.
+    """
+    import random
+
+    rng = random.Random(seed)
+    for _ in range(n):
+        data = rng.randbytes(rng.randrange(0, 4096))
+        split = rng.randrange(0, len(data) + 1)
+        value = rng.getrandbits(32)
+        first, second = zlib.crc32(data[:split], value), zlib.crc32(data[split:])
+        assert crc32_combine(first, second, len(data) - split) == zlib.crc32(data, value)
+        segments = rng.randrange(1, 9)
+        assert crc32_parallel(data, segments, value, min_segment=1) == zlib.crc32(data, value)
+    print(f"crc32_combine: {n} random splits match zlib.crc32")
+
+
+def benchmark_crc32_parallel(size: int = 64 * 1024 * 1024) -> None:
+    """
+    Time crc32_parallel with 1, 2, 4, ... workers up to the number of CPUs, against a single zlib.crc32 call.
+    """
+    cpus = os.cpu_count() or 1
+    data = os.urandom(size)
+    expected = zlib.crc32(data)
+    ref = min(timeit.repeat(lambda: zlib.crc32(data), number=1, repeat=5))
+    f = 12
+    print(f"{size / 1e6:.0f} MB, {cpus} CPUs")
+    print("workers".ljust(f), "MB/s".ljust(f), "speedup".ljust(f))
+    print("zlib".ljust(f), f"{size / ref / 1e6:.0f}".ljust(f), "1.0x".ljust(f))
+    workers = 1
+    while True:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            assert crc32_parallel(data, workers, executor=pool) == expected
+            seconds = min(timeit.repeat(lambda: crc32_parallel(data, workers, executor=pool), number=1, repeat=5))
+        print(str(workers).ljust(f), f"{size / seconds / 1e6:.0f}".ljust(f), f"{ref / seconds:.1f}x".ljust(f))
+        if workers >= cpus:
+            break
+        workers = min(2 * workers, cpus)
+
+
+def main() -> None:
+    benchmark_crc32()
+    print()
+    benchmark_adler32()
+    print()
+    check_crc32_combine()
+    benchmark_crc32_parallel()
+
 
-    # Return the checksum with the bytes reversed
-    return checksum ^ 0xFFFFFFFF
+if __name__ == "__main__":
+    main()
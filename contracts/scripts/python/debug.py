@@ -4,13 +4,16 @@
 This is a debug script for debugging a hand-written implementation of the DEFLATE algorithm as used in PNG files.
 """
 
-from typing import Any, Dict, List
-
+import numpy as np
 from checksum import adler32, crc32
 from decode import DecodedPNG, decode_png
-from huffman import huffman_encode
-from image_data import RGBA, checkerboard, flatten, flatten_with_row_prefix, transparent_rainbow
-from png import PNG
+from deflate import BTYPE_FIXED, BTYPE_STORED, deflate_stored, zlib_compress
+from filters import FILTER_NAMES, FILTER_TYPES, STRATEGY_BRUTE_FORCE, STRATEGY_FIXED, STRATEGY_MIN_SAD
+from huffman import huffman_encode_bytes
+from image_data import checkerboard_array, with_row_prefix
+from inflate import BlockTrace, zlib_decompress
+from lz77 import lz77
+from png import PNG, encode_chunk
 
 F = 24
 
@@ -29,6 +32,7 @@ def main() -> None:
     bit_depth = 8
     compression_level = 1
     filter_type = 0
+    filter_strategy = STRATEGY_FIXED
     png: PNG = PNG(
         width=w,
         height=h,
@@ -36,19 +40,30 @@ def main() -> None:
         bit_depth=bit_depth,
         compression_level=compression_level,
         filter_type=filter_type,
+        filter_strategy=filter_strategy,
     )
 
-    rgba_grid: List[List[RGBA]] = checkerboard(h=h, w=w)
-    rgba_flat: List[RGBA] = flatten(data=rgba_grid)
+    rgba_grid: np.ndarray = checkerboard_array(h=h, w=w)
     png_bytes: bytes = png.bytes(rgba_grid)
-    input_data: bytes = bytes(rgba_flat)
-    filtered_input_data: bytes = bytes(flatten_with_row_prefix(data=rgba_grid, prefix=0))
+    input_data: bytes = rgba_grid.tobytes()
+    filtered_input_data: bytes = bytes(with_row_prefix(data=rgba_grid, prefix=filter_type, strategy=filter_strategy))
     log("input_data", input_data)
     log("filtered_input_data", filtered_input_data)
 
     decoded_png: DecodedPNG = decode_png(png_bytes)
     log("decoded_png.idat.data", decoded_png.idat.data)
 
+    # step through the blocks the encoder produced
+    inflated: bytes = zlib_decompress(decoded_png.idat.data, trace=BlockTrace.print)
+    log("inflated", inflated)
+    assert inflated == filtered_input_data
+
+    # the scanlines under every filter selection
+    for name, kwargs in [(FILTER_NAMES[t], dict(prefix=t)) for t in FILTER_TYPES] + [
+        (strategy, dict(strategy=strategy)) for strategy in (STRATEGY_MIN_SAD, STRATEGY_BRUTE_FORCE)
+    ]:
+        log(f"scanlines[{name}]", bytes(with_row_prefix(data=rgba_grid, **kwargs)))
+
     #  DEFLATE Compressed Data Format
     #  https://www.ietf.org/rfc/rfc1951.txt
     #
@@ -102,63 +117,44 @@ def main() -> None:
     #     deflate_data.append((~len(block) >> 8) & 0xff)
     #     deflate_data.extend(block)
     # return deflate_data
+    #
+    # deflate.deflate_stored builds exactly this, and deflate.zlib_compress wraps it in the
+    # zlib header (78 01) and the Adler-32 trailer.
 
-    block_data: bytes = filtered_input_data
-    checksum: bytes = adler32(block_data)
-    # BFINAL = 1
-    # BTYPE = 00
-    block_header: int = 0b00000001
-    # block LEN and NLEN
-    block_len_nlen = bytearray()
-    l = len(block_data)
-    block_len_nlen.append(l & 0xFF)
-    block_len_nlen.append((l >> 8) & 0xFF)
-    block_len_nlen.append(~l & 0xFF)
-    block_len_nlen.append((~l >> 8) & 0xFF)
-
-    log("block_len_nlen", block_len_nlen)
-
-    block = bytearray()
-    block.append(block_header)
-    block.extend(block_len_nlen)
-    block.extend(block_data)
+    block: bytes = deflate_stored(filtered_input_data)
+    log("block_len_nlen", block[1:5])
     log("block", block)
 
-    idat = bytearray()
-    idat.extend(b"\x78\x01")
-    idat.extend(block)
-    idat.extend(checksum)
+    idat: bytes = zlib_compress(filtered_input_data, BTYPE_STORED)
     log("idat", idat)
+    # the encoder uses zlib's checksums, the trailer is checked against the hand-written Adler-32
+    trailer: bytes = adler32(filtered_input_data)
+    log("adler32", trailer)
+    assert idat[-4:] == trailer, "zlib trailer differs from checksum.adler32"
     log("decoded_png.idat.data", decoded_png.idat.data)
 
-    idat_chunk_length = len(idat)
-    idat_chunk_type = b"IDAT"
-    idat_typedata = idat_chunk_type + idat
-    idat_chunk_crc = crc32(idat_typedata)
-    idat_chunk = bytearray()
-    idat_chunk.extend(idat_chunk_length.to_bytes(4, byteorder="big"))
-    idat_chunk.extend(idat_chunk_type)
-    idat_chunk.extend(idat)
-    idat_chunk.extend(idat_chunk_crc.to_bytes(4, byteorder="big"))
+    # the same scanlines as LZ77 length/distance tokens in a fixed Huffman block
+    tokens = lz77(filtered_input_data, level=9)
+    symbols = [f"<{v}, {d}>" if d else f"{v:02x}" for v, d in zip(tokens[0].tolist(), tokens[1].tolist())]
+    print(f"{'lz77_tokens'.ljust(F)}{' '.join(symbols)}")
+    idat_lz77: bytes = zlib_compress(filtered_input_data, BTYPE_FIXED, level=9)
+    log("idat_lz77", idat_lz77)
+    assert zlib_decompress(idat_lz77, trace=BlockTrace.print) == filtered_input_data
+
+    idat_chunk: bytes = encode_chunk(b"IDAT", idat)
     log("idat_chunk", idat_chunk)
+    # and the chunk CRC against the hand-written CRC-32 of the chunk type and data
+    idat_chunk_crc: bytes = crc32(b"IDAT" + idat).to_bytes(4, byteorder="big")
+    log("idat_chunk_crc", idat_chunk_crc)
+    assert idat_chunk[-4:] == idat_chunk_crc, "IDAT CRC differs from checksum.crc32"
     log("decoded_png.idat.chunk", decoded_png.idat.chunk)
 
     print("\nhuffman encoding:")
-    encoding_table: Dict[Any, str] = huffman_encode(list(filtered_input_data))
-    for k, v in sorted(encoding_table.items()):
-        print(f"{' ' * F}0x{'{:02x}'.format(k)} :  {v}")
-
-    # encode the data using the encoding table
-    encoded_data: str = ""
-    for b in input_data:
-        # appends the corresponding Huffman code from the encoding table
-        encoded_data += encoding_table[b]
-
-    # 101010100111011011001100000000111111111101
-    print("encoded_data".ljust(F) + encoded_data)
+    # canonical code built from the byte frequencies, packed LSB-first as in DEFLATE
+    encoded_data_bytes, encoding_table = huffman_encode_bytes(filtered_input_data)
+    for k, (code, length) in sorted(encoding_table.items()):
+        print(f"{' ' * F}0x{'{:02x}'.format(k)} :  {code:0{length}b}")
 
-    # interpret as bit sequence and convert to bytes
-    encoded_data_bytes = bytes(int(encoded_data[i : i + 8], 2) for i in range(0, len(encoded_data), 8))
     log("encoded_data_bytes", encoded_data_bytes)
 
 
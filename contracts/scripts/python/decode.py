@@ -1,12 +1,194 @@
 #!/usr/bin/env python3
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import time
 import zlib
 from argparse import ArgumentParser, Namespace
-from dataclasses import dataclass
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from checksum import crc32_parallel
+from filters import unfilter_row
+from image_data import unpack_samples
+from instrument import count, span
+
+# the buffer types a PNG datastream is read from
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# chunk length, chunk type
+CHUNK_HEADER = struct.Struct(">I4s")
+# width, height, bit depth, color type, compression, filter and interlace method
+IHDR_DATA = struct.Struct(">IIBBBBB")
+
+
+# which chunk CRCs decode_png checks
+VERIFY_NONE: str = "none"
+# the IHDR only
+VERIFY_HEADER: str = "header"
+# every chunk, and the zlib datastream
+VERIFY_ALL: str = "all"
+# every chunk but IDAT, and every VERIFY_SAMPLE_INTERVAL-th IDAT chunk starting with the first
+VERIFY_SAMPLED: str = "sampled"
+VERIFY_LEVELS: Tuple[str, ...] = (VERIFY_NONE, VERIFY_HEADER, VERIFY_ALL, VERIFY_SAMPLED)
+VERIFY_SAMPLE_INTERVAL: int = 8
+# at VERIFY_ALL the zlib datastream is also checked (DecodedPNG.verify_zlib), inflated this many bytes at a time
+VERIFY_INFLATE_BLOCK: int = 1 << 16
+
+
+@dataclass(frozen=True, slots=True)
+class CRCError:
+    """
+    A chunk whose stored CRC does not match the CRC of its type and data.
+    """
+
+    type: bytes
+    # offset of the chunk in the datastream
+    offset: int
+    expected: int
+    computed: int
+
+    def __str__(self) -> str:
+        return (
+            f"{self.type.decode('latin-1')} chunk at offset {self.offset}: "
+            f"crc32 computed: {self.computed:08x} != {self.expected:08x}"
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ZlibError:
+    """
+    A zlib datastream (the concatenated IDAT payloads) that is corrupt, truncated (no final block or no Adler-32
+    checksum), has data after its end, or does not hold the image's scanlines.
+    """
+
+    reason: str
+    # bytes inflated before the error was found
+    inflated: int
+
+    def __str__(self) -> str:
+        return f"zlib datastream after {self.inflated} inflated bytes: {self.reason}"
+
+
+# an error decode_png returns rather than raises
+PNGError = Union[CRCError, ZlibError]
+
+
+def _zlib_end_error(d: Any, inflated: int, trailing: int = 0) -> Optional[ZlibError]:
+    """
+    The error of a decompressor fed the whole zlib datastream, if it has not reached the end of the stream (and so not
+    checked the Adler-32) or was given data after it.
+
+    :param trailing: The bytes after the end of the stream that were not passed to the decompressor.
+    """
+    if not d.eof:
+        return ZlibError("ended before the final block and the Adler-32 checksum", inflated)
+    trailing += len(d.unused_data)
+    if trailing:
+        return ZlibError(f"{trailing} bytes after the Adler-32 checksum", inflated)
+    return None
+
+
+class _ChunkView:
+    """
+    The byte ranges of a chunk record, sliced on access from the buffer the chunk was read from.
+    """
+
+    __slots__ = ()
+
+    @property
+    def end(self) -> int:
+        """
+        The offset of the next chunk in the datastream.
+        """
+        return self.offset + 4 + 4 + self.length + 4
+
+    @property
+    def data(self) -> memoryview:
+        return memoryview(self.buffer)[self.offset + 8 : self.offset + 8 + self.length]
+
+    @property
+    def crc(self) -> memoryview:
+        return memoryview(self.buffer)[self.offset + 8 + self.length : self.end]
+
+    @property
+    def chunk(self) -> memoryview:
+        """
+        The full chunk.
+        """
+        return memoryview(self.buffer)[self.offset : self.end]
+
+    def verify(self) -> Optional[CRCError]:
+        """
+        Check the CRC of the chunk.
+
+        The CRC-32 is taken of the chunk type field and the chunk data fields, in that order (not of the length field),
+        which are adjacent in the datastream, so it is computed over one view of the buffer without copying.
+
+        :return: The error if the CRC does not match, otherwise None.
+        """
+        checked = memoryview(self.buffer)[self.offset + 4 : self.offset + 8 + self.length]
+        with span("crc32"):
+            computed = crc32_parallel(checked)
+        count("crc32.bytes", len(checked))
+        expected = int.from_bytes(self.crc, byteorder="big")
+        if computed == expected:
+            return None
+        return CRCError(type=bytes(checked[:4]), offset=self.offset, expected=expected, computed=computed)
+
+
+@dataclass(frozen=True, slots=True)
+class Chunk(_ChunkView):
+    """
+    A chunk viewed in place in the PNG datastream.
+
+    Every chunk has the following format:
+
+    Bytes  Meaning
+    4      chunk length (n)
+    4      chunk type
+    n      chunk data (n bytes)
+    4      chunk crc
+
+    The record is a reference to the buffer the chunk was read from plus the chunk's offset, and `data`, `crc` and
+    `chunk` are memoryviews sliced from the buffer on access, so no payload bytes are copied and a record costs a few
+    words. Chunks other than IHDR, IDAT and IEND (e.g. PLTE, tRNS, tEXt) are kept in this generic form.
+
+    https://www.w3.org/TR/2003/REC-PNG-20031110/#5Chunk-layout
+    """
+
+    # the datastream, shared by every chunk read from it
+    buffer: Buffer
+    # offset of the chunk in the datastream
+    offset: int
+    length: int
+    type: bytes
+
+    @staticmethod
+    def read(b: Buffer, offset: int) -> "Chunk":
+        assert offset + 8 <= len(b), f"truncated chunk header at offset {offset}"
+        length, chunk_type = CHUNK_HEADER.unpack_from(b, offset)
+        chunk = Chunk(buffer=b, offset=offset, length=length, type=chunk_type)
+        assert chunk.end <= len(b), f"truncated {chunk_type!r} chunk at offset {offset}"
+        return chunk
+
+    def print(self):
+        f = 18
+        name = self.type.decode("latin-1")
+        print(name)
+        print(f"{name.lower()}_length".ljust(f), self.length)
+        print(f"{name.lower()}_data".ljust(f), self.data.hex(" "))
+        print(f"{name.lower()}_crc".ljust(f), self.crc.hex(" "))
 
 
-@dataclass
-class IHDR:
+@dataclass(frozen=True, slots=True)
+class IHDR(_ChunkView):
     """
     Image Header.
 
@@ -33,8 +215,9 @@ class IHDR:
     Only filter method 0 (adaptive filtering with five basic filter types) is defined in this International Standard.
     """
 
-    length: int
-    ihdr: bytes
+    # the datastream and the offset of the chunk in it
+    buffer: Buffer
+    offset: int
     # chunk data
     width: int
     height: int
@@ -43,17 +226,21 @@ class IHDR:
     compression: int
     filtering: int
     interlace: int
-    # checksum
-    crc: bytes
+
+    length = 13
+    ihdr = b"IHDR"
 
     @staticmethod
     def parse(b: bytes) -> "IHDR":
-        f = 18
+        ihdr = IHDR.from_chunk(Chunk.read(b, 0))
+        error = ihdr.verify()
+        assert error is None, str(error)
+        return ihdr
 
-        length_bytes, length = unpack_int(b[0:4])
-        assert length == 13
-        ihdr_ihdr = b[4:8]
-        assert ihdr_ihdr == b"IHDR"
+    @staticmethod
+    def from_chunk(chunk: Chunk) -> "IHDR":
+        assert chunk.length == IHDR.length, f"invalid IHDR length: {chunk.length}"
+        assert chunk.type == IHDR.ihdr
 
         # Bytes  Meaning
         # 4      Width of the image in pixels
@@ -63,14 +250,11 @@ class IHDR:
         # 1      Compression method used (always 0 for PNG files)
         # 1      Filter method used (always 0 for PNG files)
         # 1      Interlace method used (0 for non-interlaced, 1 for Adam7 interlacing)
-        ihdr_chunk = b[8 : 8 + length]
-        ihdr_width_bytes, ihdr_width = unpack_int(ihdr_chunk[0:4])
-        ihdr_height_bytes, ihdr_height = unpack_int(ihdr_chunk[4:8])
-        ihdr_bit_depth_bytes, ihdr_bit_depth = unpack_int(ihdr_chunk[8:9])
-        ihdr_color_type_bytes, ihdr_color_type = unpack_int(ihdr_chunk[9:10])
-        ihdr_compression_bytes, ihdr_compression = unpack_int(ihdr_chunk[10:11])
-        ihdr_filtering_bytes, ihdr_filtering = unpack_int(ihdr_chunk[11:12])
-        ihdr_interlace_bytes, ihdr_interlace = unpack_int(ihdr_chunk[12:13])
+        ihdr: IHDR = IHDR(chunk.buffer, chunk.offset, *IHDR_DATA.unpack_from(chunk.buffer, chunk.offset + 8))
+        assert ihdr.color_type in COLOR_TYPE_BIT_DEPTHS, f"invalid color type: {ihdr.color_type}"
+        assert (
+            ihdr.bit_depth in COLOR_TYPE_BIT_DEPTHS[ihdr.color_type]
+        ), f"invalid bit depth {ihdr.bit_depth} for color type {ihdr.color_type}"
 
         # CRC checksum
         # The CRC checksum is a 4-byte value that is used to verify the integrity of the chunk.
@@ -79,26 +263,32 @@ class IHDR:
         # The CRC-32 is expressed as a 4-byte integer, most significant byte first.
         # The CRC-32 algorithm is described in RFC 1952.
         # The CRC-32 is always present, even for chunks containing no data.
-        ihdr_crc = b[8 + length : 8 + length + 4]
-        computed: int = zlib.crc32(ihdr_ihdr + ihdr_chunk)
-        computed_bytes = computed.to_bytes(4, byteorder="big")
-        assert ihdr_crc == computed_bytes, f"crc32 computed: {computed_bytes.hex(' ')} != {ihdr_crc.hex(' ')}"
-
-        ihdr: IHDR = IHDR(
-            length=length,
-            ihdr=ihdr_ihdr,
-            width=ihdr_width,
-            height=ihdr_height,
-            bit_depth=ihdr_bit_depth,
-            color_type=ihdr_color_type,
-            compression=ihdr_compression,
-            filtering=ihdr_filtering,
-            interlace=ihdr_interlace,
-            crc=ihdr_crc,
-        )
+        # It is checked by verify(), as decode_png's verify level asks.
 
         return ihdr
 
+    @property
+    def channels(self) -> int:
+        """
+        The number of samples per pixel for the color type.
+        """
+        return COLOR_TYPE_CHANNELS[self.color_type]
+
+    @property
+    def bytes_per_pixel(self) -> int:
+        """
+        The number of bytes per complete pixel, rounded up to 1. This is the distance to the left neighbour `a` used by
+        the scanline filters.
+        """
+        return max(1, self.channels * self.bit_depth // 8)
+
+    @property
+    def stride(self) -> int:
+        """
+        The number of bytes in a scanline, excluding the filter type byte.
+        """
+        return (self.width * self.channels * self.bit_depth + 7) // 8
+
     def print(self):
         f = 18
         print("IHDR")
@@ -114,8 +304,8 @@ class IHDR:
         print("ihdr_crc".ljust(f), self.crc.hex(" "))
 
 
-@dataclass
-class IDAT:
+@dataclass(frozen=True, slots=True)
+class IDAT(_ChunkView):
     """
     Image Data.
 
@@ -159,37 +349,25 @@ class IDAT:
     to a power of 2 (256 minimum).
     """
 
+    # the datastream and the offset of the chunk in it
+    buffer: Buffer
+    offset: int
     # chunk length = len(chunk_data)
     length: int
-    idat: bytes
-    # chunk data
-    data: bytes
-    # checksum
-    crc: bytes
 
-    # full chunk
-    chunk: bytes
+    idat = b"IDAT"
 
     @staticmethod
     def parse(b: bytes) -> "IDAT":
-        f = 18
-
-        length_bytes, length = unpack_int(b[0:4])
-        idat_idat = b[4:8]
-        assert idat_idat == b"IDAT"
+        return IDAT.from_chunk(Chunk.read(b, 0))
 
-        # chunk data
-        idat_data = b[8 : 8 + length]
+    @staticmethod
+    def from_chunk(chunk: Chunk) -> "IDAT":
+        assert chunk.type == IDAT.idat
 
-        # CRC checksum
-        idat_crc = b[8 + length : 8 + length + 4]
-        # computed: int = zlib.crc32(idat_idat + idat_data)
-        # computed_bytes = computed.to_bytes(4, byteorder="big")
-        # assert (
-        #     idat_crc == computed_bytes
-        # ), f"crc32 computed: {computed_bytes.hex(' ')} != {idat_crc.hex(' ')}"
+        # CRC checksum, checked by verify()
 
-        idat: IDAT = IDAT(length=length, idat=idat_idat, data=idat_data, crc=idat_crc, chunk=b)
+        idat: IDAT = IDAT(buffer=chunk.buffer, offset=chunk.offset, length=chunk.length)
 
         return idat
 
@@ -203,8 +381,8 @@ class IDAT:
         print("idat_crc".ljust(f), self.crc.hex(" "))
 
 
-@dataclass
-class IEND:
+@dataclass(frozen=True, slots=True)
+class IEND(_ChunkView):
     """
     Image Trailer.
 
@@ -218,27 +396,25 @@ class IEND:
     https://www.w3.org/TR/2003/REC-PNG-20031110/#11IEND
     """
 
-    length: int
-    iend: bytes
-    crc: bytes
+    # the datastream and the offset of the chunk in it
+    buffer: Buffer
+    offset: int
+
+    length = 0
+    iend = b"IEND"
 
     @staticmethod
     def parse(b: bytes) -> "IEND":
-        f = 18
+        return IEND.from_chunk(Chunk.read(b, 0))
 
-        length_bytes, length = unpack_int(b[0:4])
-        iend_iend = b[4:8]
-        assert iend_iend == b"IEND"
+    @staticmethod
+    def from_chunk(chunk: Chunk) -> "IEND":
+        assert chunk.length == IEND.length, f"invalid IEND length: {chunk.length}"
+        assert chunk.type == IEND.iend
 
-        # CRC checksum
-        iend_crc = b[8:12]
-        # computed: int = zlib.crc32(iend_iend)
-        # computed_bytes = computed.to_bytes(4, byteorder="big")
-        # assert (
-        #     iend_crc == computed_bytes
-        # ), f"crc32 computed: {computed_bytes.hex(' ')} != {iend_crc.hex(' ')}"
+        # CRC checksum, checked by verify()
 
-        iend: IEND = IEND(length=length, iend=iend_iend, crc=iend_crc)
+        iend: IEND = IEND(buffer=chunk.buffer, offset=chunk.offset)
 
         return iend
 
@@ -250,13 +426,201 @@ class IEND:
         print("iend_crc".ljust(f), self.crc.hex(" "))
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DecodedPNG:
-    raw_data: bytes
-    header: bytes
+    # the datastream, which every chunk record views
+    raw_data: Buffer
     ihdr: IHDR
-    idat: IDAT
+    idats: Tuple[IDAT, ...]
     iend: IEND
+    # ancillary chunks (and any other chunk types not parsed above), in datastream order
+    chunks: Tuple[Chunk, ...]
+    # the chunks that failed CRC verification and, at VERIFY_ALL, the zlib datastream error, at the verify level the
+    # datastream was decoded with
+    errors: Tuple[PNGError, ...] = ()
+
+    @property
+    def header(self) -> bytes:
+        return bytes(self.raw_data[:8])
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def idat(self) -> IDAT:
+        """
+        The first IDAT chunk. Use idat_data() for the full zlib datastream when there may be several.
+        """
+        return self.idats[0]
+
+    def iter_idat_data(self) -> Iterator[memoryview]:
+        """
+        Yield the payload of each IDAT chunk in order, without copying.
+        """
+        for idat in self.idats:
+            yield idat.data
+
+    def idat_data(self) -> Union[bytes, memoryview]:
+        """
+        The zlib datastream, i.e. the concatenation of all IDAT payloads.
+
+        With a single IDAT chunk this is a view into the datastream; the payloads are only joined when there are several.
+        """
+        if len(self.idats) == 1:
+            return self.idats[0].data
+        return b"".join(self.iter_idat_data())
+
+    def chunk(self, chunk_type: bytes) -> Optional[Chunk]:
+        """
+        The first ancillary chunk of the given type, if any.
+        """
+        for chunk in self.chunks:
+            if chunk.type == chunk_type:
+                return chunk
+        return None
+
+    def iter_scanlines(self) -> Iterator[memoryview]:
+        """
+        Inflate the zlib datastream incrementally and yield one filtered scanline (filter type byte included) at a time.
+
+        The decompressor is asked for no more than one scanline of output at a time, so at most one scanline of
+        inflated data is buffered regardless of the image size.
+        """
+        size = 1 + self.ihdr.stride
+        d = zlib.decompressobj()
+        row = bytearray()
+        inflated = trailing = 0
+        try:
+            for data in self.iter_idat_data():
+                if d.eof:
+                    # IDAT chunks after the end of the stream
+                    trailing += len(data)
+                    continue
+                while data:
+                    with span("inflate"):
+                        row += d.decompress(data, size - len(row))
+                    # at the end of the stream, the rest of the chunk is in unused_data
+                    data = b"" if d.eof else d.unconsumed_tail
+                    if len(row) == size:
+                        inflated += size
+                        yield memoryview(row)
+                        row = bytearray()
+            # flush anything the decompressor still holds back
+            while not d.eof and len(row) < size:
+                out = d.decompress(b"", size - len(row))
+                if not out:
+                    break
+                row += out
+                if len(row) == size:
+                    inflated += size
+                    yield memoryview(row)
+                    row = bytearray()
+        except zlib.error as e:
+            # e.g. "incorrect data check", a bad Adler-32
+            raise AssertionError(str(ZlibError(str(e), inflated + len(row)))) from e
+        assert not row, str(ZlibError(f"ended inside a scanline ({len(row)} of {size} bytes)", inflated + len(row)))
+        error = _zlib_end_error(d, inflated, trailing)
+        assert error is None, str(error)
+
+    def verify_zlib(self) -> Optional[ZlibError]:
+        """
+        Check the zlib datastream: inflate it (discarding the output, VERIFY_INFLATE_BLOCK bytes at a time) through
+        its final block and Adler-32 checksum, with nothing after it, to exactly the size of the image's scanlines.
+
+        :return: The error if the datastream is not valid, otherwise None.
+        """
+        d = zlib.decompressobj()
+        inflated = trailing = 0
+        try:
+            with span("inflate"):
+                for data in self.iter_idat_data():
+                    if d.eof:
+                        trailing += len(data)
+                        continue
+                    while data:
+                        inflated += len(d.decompress(data, VERIFY_INFLATE_BLOCK))
+                        data = b"" if d.eof else d.unconsumed_tail
+                while not d.eof:
+                    out = d.decompress(b"", VERIFY_INFLATE_BLOCK)
+                    if not out:
+                        break
+                    inflated += len(out)
+        except zlib.error as e:
+            return ZlibError(str(e), inflated)
+        error = _zlib_end_error(d, inflated, trailing)
+        if error is not None:
+            return error
+        ihdr = self.ihdr
+        expected = ihdr.height * (1 + ihdr.stride)
+        if ihdr.interlace == 0 and inflated != expected:
+            return ZlibError(f"{inflated} bytes of scanlines, expected {expected}", inflated)
+        return None
+
+    def palette(self) -> np.ndarray:
+        """
+        The palette of an indexed-color image: the PLTE colors with the tRNS alpha values (255 past the end of tRNS),
+        as a uint8 array of shape (n, 4).
+        """
+        plte = self.chunk(b"PLTE")
+        assert plte is not None, "indexed-color image without a PLTE chunk"
+        assert plte.length % 3 == 0 and 0 < plte.length <= 3 * 256, f"invalid PLTE length: {plte.length}"
+        n = plte.length // 3
+        palette = np.full((n, 4), 255, dtype=np.uint8)
+        palette[:, :3] = np.frombuffer(plte.data, dtype=np.uint8).reshape(n, 3)
+        trns = self.chunk(b"tRNS")
+        if trns is not None:
+            assert trns.length <= n, f"tRNS has {trns.length} entries for {n} palette colors"
+            palette[: trns.length, 3] = np.frombuffer(trns.data, dtype=np.uint8)
+        return palette
+
+    def pixels(self) -> np.ndarray:
+        """
+        Decode the image into an array of shape (height, width, channels).
+
+        Indexed-color images are expanded through the palette to RGBA (see samples() for the palette indices).
+        """
+        samples = self.samples()
+        if self.ihdr.color_type != 3:
+            return samples
+        palette = self.palette()
+        indices = samples[..., 0]
+        assert int(indices.max(initial=0)) < len(palette), "palette index out of range"
+        return palette[indices]
+
+    def samples(self) -> np.ndarray:
+        """
+        Decode the samples of the image into an array of shape (height, width, channels): the palette indices of an
+        indexed-color image, the color (and alpha) values otherwise.
+
+        Supports non-interlaced images of every color type and bit depth: samples of 1, 2, 4 and 8 bits are returned as
+        uint8, one per element, and 16 bit samples as uint16.
+
+        Scanlines are inflated and unfiltered one at a time straight into the output array, so apart from the output
+        only the current and the previous scanline are held in memory.
+        """
+        ihdr: IHDR = self.ihdr
+        assert ihdr.interlace == 0, "interlaced images are not supported"
+
+        out = np.empty((ihdr.height, ihdr.stride), dtype=np.uint8)
+        prior = np.zeros(ihdr.stride, dtype=np.uint8)
+        y = 0
+        with span("pixels"):
+            for scanline in self.iter_scanlines():
+                assert y < ihdr.height, "zlib datastream has more scanlines than the image height"
+                row = np.frombuffer(scanline, dtype=np.uint8, offset=1)
+                with span("unfilter"):
+                    out[y] = prior = unfilter_row(scanline[0], row, prior, ihdr.bytes_per_pixel)
+                y += 1
+        count("unfilter.rows", y)
+        assert y == ihdr.height, f"zlib datastream has {y} scanlines, expected {ihdr.height}"
+
+        if ihdr.bit_depth == 16:
+            # samples are stored most significant byte first
+            return out.view(">u2").astype(np.uint16).reshape(ihdr.height, ihdr.width, ihdr.channels)
+        if ihdr.bit_depth < 8:
+            out = unpack_samples(out, ihdr.bit_depth, ihdr.width * ihdr.channels)
+        return out.reshape(ihdr.height, ihdr.width, ihdr.channels)
 
     def print(self):
         f = 18
@@ -264,69 +628,484 @@ class DecodedPNG:
         print("header".ljust(f), self.header.hex(" "))
 
         self.ihdr.print()
-        self.idat.print()
+        for chunk in self.chunks:
+            chunk.print()
+        for idat in self.idats:
+            idat.print()
         self.iend.print()
+        for error in self.errors:
+            print(("crc_error" if isinstance(error, CRCError) else "zlib_error").ljust(f), error)
 
-        print("bytes".ljust(f), self.raw_data.hex(" "))
-
-
-def unpack_int(b: bytes) -> Tuple[bytes, int]:
-    return b, int.from_bytes(b, byteorder="big")
+        print("bytes".ljust(f), memoryview(self.raw_data).hex(" "))
 
 
 PNG_SIGNATURE: bytes = b"\x89PNG\r\n\x1a\n"
 
+# number of samples per pixel for each color type
+# https://www.w3.org/TR/2003/REC-PNG-20031110/#6Colour-values
+COLOR_TYPE_CHANNELS = {
+    # grayscale
+    0: 1,
+    # truecolor (RGB)
+    2: 3,
+    # indexed-color
+    3: 1,
+    # grayscale with alpha
+    4: 2,
+    # truecolor with alpha (RGBA)
+    6: 4,
+}
+
+# allowed bit depths for each color type
+# https://www.w3.org/TR/2003/REC-PNG-20031110/#table111
+COLOR_TYPE_BIT_DEPTHS = {
+    0: (1, 2, 4, 8, 16),
+    2: (8, 16),
+    3: (1, 2, 4, 8),
+    4: (8, 16),
+    6: (8, 16),
+}
+
+# typed views for the critical chunks, every other chunk type is yielded as a generic Chunk
+CHUNK_TYPES = {
+    b"IHDR": IHDR,
+    b"IDAT": IDAT,
+    b"IEND": IEND,
+}
+
+AnyChunk = Union[IHDR, IDAT, IEND, Chunk]
+
+
+def iter_chunks(b: Buffer) -> Iterator[AnyChunk]:
+    """
+    Iterate over the chunks of a PNG datastream, in order, up to and including IEND.
 
-def decode_png(b: bytes) -> DecodedPNG:
-    f = 18
+    Chunk records reference the datastream by offset, so chunk payloads are not copied. IHDR, IDAT and IEND are yielded
+    as their typed views, every other chunk as a generic Chunk. Since chunks are parsed lazily, callers that only need
+    part of the datastream (e.g. the IHDR for the image dimensions) can stop iterating early.
+    """
     # parse PNG header
-    header: bytes = b[:8]
-    assert header == PNG_SIGNATURE, f"PNG signature: {header.hex(' ')} != {PNG_SIGNATURE.hex(' ')}"
-
-    # parse IHDR chunk
-    # to parse the IHDR chunk, we need to know the length of the chunk
-    # which is the first 4 bytes of the chunk
-    offset_ihdr_start = 8
-    ihdr_length_bytes, ihdr_length = unpack_int(b[offset_ihdr_start : offset_ihdr_start + 4])
-    offset_ihdr_end = offset_ihdr_start + 4 + 4 + ihdr_length + 4
-    ihdr_bytes: bytes = b[offset_ihdr_start:offset_ihdr_end]
-    ihdr: IHDR = IHDR.parse(ihdr_bytes)
-
-    # parse IDAT chunk
-    offset_idat_start = offset_ihdr_end
-    idat_length_bytes, idat_length = unpack_int(b[offset_idat_start : offset_idat_start + 4])
-    offset_idat_end = offset_idat_start + 4 + 4 + idat_length + 4
-    idat_bytes: bytes = b[offset_idat_start:offset_idat_end]
-    idat: IDAT = IDAT.parse(idat_bytes)
-
-    # parse IEND chunk
-    offset_iend_start = offset_idat_end
-    iend_length_bytes, iend_length = unpack_int(b[offset_iend_start : offset_iend_start + 4])
-    offset_iend_end = offset_iend_start + 12
-    iend_bytes: bytes = b[offset_iend_start:offset_iend_end]
-    iend: IEND = IEND.parse(iend_bytes)
-
-    decoded: DecodedPNG = DecodedPNG(raw_data=b, header=header, ihdr=ihdr, idat=idat, iend=iend)
+    with span("signature"):
+        header = bytes(b[:8])
+        assert header == PNG_SIGNATURE, f"PNG signature: {header.hex(' ')} != {PNG_SIGNATURE.hex(' ')}"
+
+    offset = len(PNG_SIGNATURE)
+    while offset < len(b):
+        with span("chunk"):
+            chunk: Chunk = Chunk.read(b, offset)
+            chunk_type = CHUNK_TYPES.get(chunk.type)
+            parsed = chunk if chunk_type is None else chunk_type.from_chunk(chunk)
+        count("chunks")
+        yield parsed
+        if chunk.type == b"IEND":
+            return
+        offset = chunk.end
+    raise AssertionError("PNG datastream ended without an IEND chunk")
+
+
+def should_verify(verify: str, chunk: AnyChunk, idat_index: int = 0) -> bool:
+    """
+    Whether a chunk's CRC is checked at a verify level.
+
+    :param idat_index: The index of the chunk among the IDAT chunks, for the sampled level.
+    """
+    if verify == VERIFY_ALL:
+        return True
+    if verify == VERIFY_SAMPLED:
+        return not isinstance(chunk, IDAT) or idat_index % VERIFY_SAMPLE_INTERVAL == 0
+    if verify == VERIFY_HEADER:
+        return isinstance(chunk, IHDR)
+    assert verify == VERIFY_NONE, f"invalid verify level: {verify}"
+    return False
+
+
+def decode_ihdr(b: Buffer, verify: str = VERIFY_HEADER) -> IHDR:
+    """
+    Parse only the signature and the IHDR chunk, which the PNG specification requires to come first.
+
+    :param verify: Any level but VERIFY_NONE checks the IHDR CRC, which raises if it does not match.
+    """
+    ihdr = next(iter_chunks(b))
+    assert isinstance(ihdr, IHDR), "IHDR must be the first chunk"
+    if should_verify(verify, ihdr):
+        error = ihdr.verify()
+        assert error is None, str(error)
+    return ihdr
+
+
+def decode_png(b: Buffer, verify: str = VERIFY_ALL) -> DecodedPNG:
+    """
+    Decode the chunks of a PNG datastream.
+
+    Malformed datastreams raise, but CRC mismatches and (at VERIFY_ALL) an invalid zlib datastream are returned in
+    DecodedPNG.errors, so that a caller can report or skip a corrupted file.
+
+    :param verify: Which chunk CRCs to check (see VERIFY_LEVELS).
+    """
+    with span("decode_png"):
+        return _decode_png(b, verify)
+
+
+def _decode_png(b: Buffer, verify: str) -> DecodedPNG:
+    assert verify in VERIFY_LEVELS, f"invalid verify level: {verify}"
+    chunks = iter_chunks(b)
+    errors: List[PNGError] = []
+
+    # the IHDR chunk must appear first
+    ihdr = next(chunks)
+    assert isinstance(ihdr, IHDR), "IHDR must be the first chunk"
+    if should_verify(verify, ihdr):
+        error = ihdr.verify()
+        if error is not None:
+            errors.append(error)
+
+    idats: List[IDAT] = []
+    ancillary: List[Chunk] = []
+    iend: Optional[IEND] = None
+    previous: AnyChunk = ihdr
+    for chunk in chunks:
+        if should_verify(verify, chunk, len(idats)):
+            error = chunk.verify()
+            if error is not None:
+                errors.append(error)
+        if isinstance(chunk, IDAT):
+            # multiple IDAT chunks shall be consecutive
+            assert not idats or isinstance(previous, IDAT), "IDAT chunks must be consecutive"
+            idats.append(chunk)
+        elif isinstance(chunk, IEND):
+            iend = chunk
+        elif isinstance(chunk, IHDR):
+            raise AssertionError("duplicate IHDR chunk")
+        else:
+            ancillary.append(chunk)
+        previous = chunk
+    assert idats, "PNG datastream has no IDAT chunk"
+    assert iend is not None
+
+    decoded: DecodedPNG = DecodedPNG(
+        raw_data=b, ihdr=ihdr, idats=tuple(idats), iend=iend, chunks=tuple(ancillary), errors=tuple(errors)
+    )
+    if verify == VERIFY_ALL:
+        error = decoded.verify_zlib()
+        if error is not None:
+            decoded = replace(decoded, errors=(*errors, error))
 
     return decoded
 
 
-def decode_file(filename: str) -> DecodedPNG:
+# signature (8) + IHDR length (4) + IHDR type (4) + IHDR data (13) + IHDR crc (4)
+PNG_HEADER_SIZE: int = 33
+
+
+class PNGFile:
+    """
+    A PNG file whose signature and IHDR are read eagerly and whose remaining chunks are memory-mapped on first use.
+
+    Only the first 33 bytes of the file are read when it is opened, which is all that is needed for the image
+    dimensions and format. Accessing any of the other chunks (idats, idat_data(), chunks, iend) maps the file read-only
+    and decodes it in place, so IDAT payloads are views into the page cache rather than copies.
+
+    :param verify: The verify level (see decode_png). Unless VERIFY_NONE, an IHDR CRC mismatch raises when the file is
+        opened; the CRCs of the other chunks are checked when the file is mapped.
+    """
+
+    def __init__(self, filename: str, verify: str = VERIFY_ALL):
+        self.filename: str = filename
+        self.verify: str = verify
+        with open(filename, "rb") as f:
+            self.header: bytes = f.read(PNG_HEADER_SIZE)
+        self.ihdr: IHDR = decode_ihdr(self.header, verify)
+        self._decoded: Optional[DecodedPNG] = None
+
+    @property
+    def decoded(self) -> DecodedPNG:
+        if self._decoded is None:
+            with open(self.filename, "rb") as f:
+                # the mapping keeps its own reference to the file, and is unmapped once no views into it remain
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._decoded = decode_png(memoryview(mapped), self.verify)
+        return self._decoded
+
+    @property
+    def errors(self) -> Tuple[PNGError, ...]:
+        return self.decoded.errors
+
+    @property
+    def ok(self) -> bool:
+        return self.decoded.ok
+
+    @property
+    def raw_data(self) -> memoryview:
+        return self.decoded.raw_data
+
+    @property
+    def idats(self) -> Tuple[IDAT, ...]:
+        return self.decoded.idats
+
+    @property
+    def idat(self) -> IDAT:
+        return self.decoded.idat
+
+    @property
+    def iend(self) -> IEND:
+        return self.decoded.iend
+
+    @property
+    def chunks(self) -> Tuple[Chunk, ...]:
+        return self.decoded.chunks
+
+    def iter_idat_data(self) -> Iterator[memoryview]:
+        return self.decoded.iter_idat_data()
+
+    def idat_data(self) -> Union[bytes, memoryview]:
+        return self.decoded.idat_data()
+
+    def chunk(self, chunk_type: bytes) -> Optional[Chunk]:
+        return self.decoded.chunk(chunk_type)
+
+    def iter_scanlines(self) -> Iterator[memoryview]:
+        return self.decoded.iter_scanlines()
+
+    def palette(self) -> np.ndarray:
+        return self.decoded.palette()
+
+    def pixels(self) -> np.ndarray:
+        return self.decoded.pixels()
+
+    def samples(self) -> np.ndarray:
+        return self.decoded.samples()
+
+    def print(self):
+        self.decoded.print()
+
+
+def decode_file(filename: str, lazy: bool = False, verify: str = VERIFY_ALL) -> Union[DecodedPNG, PNGFile]:
+    """
+    Decode a PNG file.
+
+    :param filename: The path of the PNG file.
+    :param lazy: If set, only read the signature and IHDR now and memory-map the rest of the file on first use.
+    :param verify: Which chunk CRCs to check (see decode_png).
+    :return: The decoded PNG, or a PNGFile with the same attributes when lazy.
+    """
+    if lazy:
+        return PNGFile(filename, verify)
     with open(filename, "rb") as f:
-        return decode_png(f.read())
+        return decode_png(f.read(), verify)
+
+
+class PNGHeader(NamedTuple):
+    """
+    Compact IHDR metadata for one file, as returned by scan_headers().
+    """
+
+    path: str
+    width: int
+    height: int
+    bit_depth: int
+    color_type: int
+    interlace: int
+    # set instead of the fields above when the file is not a valid PNG
+    error: Optional[str] = None
+
+
+def iter_png_paths(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Expand directories to the .png files below them and glob patterns (e.g. "out/**/*.png") to the paths they match,
+    in sorted order. Other paths are passed through.
+    """
+    for path in paths:
+        if glob.has_magic(path):
+            for match in sorted(glob.glob(path, recursive=True)):
+                yield from iter_png_paths([match])
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(".png"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def scan_headers(paths: Iterable[str]) -> List[PNGHeader]:
+    """
+    Read the IHDR metadata of many PNG files, reading only the first 33 bytes of each.
+
+    :param paths: PNG files and/or directories to search for PNG files.
+    :return: One record per file. Files that cannot be read or parsed get a record with `error` set.
+    """
+    headers: List[PNGHeader] = []
+    for path in iter_png_paths(paths):
+        try:
+            with open(path, "rb") as f:
+                ihdr: IHDR = decode_ihdr(f.read(PNG_HEADER_SIZE))
+        except (OSError, AssertionError) as e:
+            headers.append(
+                PNGHeader(path=path, width=0, height=0, bit_depth=0, color_type=0, interlace=0, error=str(e))
+            )
+            continue
+        headers.append(
+            PNGHeader(
+                path=path,
+                width=ihdr.width,
+                height=ihdr.height,
+                bit_depth=ihdr.bit_depth,
+                color_type=ihdr.color_type,
+                interlace=ihdr.interlace,
+            )
+        )
+    return headers
+
+
+def inspect_file(path: str, verify: str = VERIFY_ALL) -> Dict[str, Any]:
+    """
+    Summarize one PNG file for batch validation: dimensions, chunk list, CRC validity and sizes.
+
+    Never raises; a file that cannot be read or parsed gets an "error" entry alongside whatever was parsed before the
+    failure.
+
+    :param verify: Which chunk CRCs to check (see VERIFY_LEVELS).
+    """
+    assert verify in VERIFY_LEVELS, f"invalid verify level: {verify}"
+    result: Dict[str, Any] = {"path": path}
+    try:
+        with open(path, "rb") as f:
+            b = f.read()
+        result["file_size"] = len(b)
+        chunk_types: List[str] = []
+        bad_crc: List[str] = []
+        idat_size = idats = 0
+        result["chunks"] = chunk_types
+        result["bad_crc"] = bad_crc
+        for chunk in iter_chunks(b):
+            if isinstance(chunk, IHDR):
+                result["width"] = chunk.width
+                result["height"] = chunk.height
+                result["bit_depth"] = chunk.bit_depth
+                result["color_type"] = chunk.color_type
+                result["interlace"] = chunk.interlace
+                name = "IHDR"
+            elif isinstance(chunk, IDAT):
+                idat_size += chunk.length
+                name = "IDAT"
+            elif isinstance(chunk, IEND):
+                name = "IEND"
+            else:
+                name = chunk.type.decode("latin-1")
+            if should_verify(verify, chunk, idats) and chunk.verify() is not None:
+                bad_crc.append(name)
+            idats += isinstance(chunk, IDAT)
+            chunk_types.append(name)
+        result["idat_size"] = idat_size
+        result["crc_ok"] = not bad_crc
+    except (OSError, AssertionError) as e:
+        result["error"] = str(e) or type(e).__name__
+    return result
+
+
+def batch(paths: Iterable[str], workers: Optional[int] = None, chunksize: int = 16, verify: str = VERIFY_ALL) -> None:
+    """
+    Inspect many PNG files in parallel and print one JSON line per file, in input order, followed by a throughput
+    summary on stderr.
+
+    :param paths: PNG files, directories and/or glob patterns.
+    :param workers: The number of worker processes (defaults to the number of CPUs).
+    :param chunksize: The number of files handed to a worker at a time.
+    :param verify: Which chunk CRCs to check (see inspect_file).
+    """
+    start = time.perf_counter()
+    files = errors = total_bytes = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        inspect = partial(inspect_file, verify=verify)
+        for result in executor.map(inspect, iter_png_paths(paths), chunksize=chunksize):
+            print(json.dumps(result))
+            files += 1
+            errors += "error" in result or not result.get("crc_ok", False)
+            total_bytes += result.get("file_size", 0)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{files} files ({errors} invalid), {total_bytes / 1e6:.2f} MB in {elapsed:.3f}s: "
+        f"{files / elapsed:.1f} files/s, {total_bytes / 1e6 / elapsed:.2f} MB/s",
+        file=sys.stderr,
+    )
+
+
+def measure_footprint(paths: Iterable[str]) -> Dict[str, float]:
+    """
+    Measure with tracemalloc the memory held per record when decoding many files: the IHDR of each file parsed from its
+    first 33 bytes (as by scan_headers), and the records of each fully decoded file. The file contents the records
+    view are read beforehand and not counted.
+
+    :return: The bytes per IHDR, per decoded file and per chunk record.
+    """
+    import tracemalloc
+
+    contents = []
+    for path in iter_png_paths(paths):
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    assert contents, "no PNG files"
+    headers = [b[:PNG_HEADER_SIZE] for b in contents]
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        ihdrs = [decode_ihdr(b) for b in headers]
+        ihdrs_size = tracemalloc.get_traced_memory()[0] - start
+        start = tracemalloc.get_traced_memory()[0]
+        decoded = [decode_png(b) for b in contents]
+        decoded_size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    num_chunks = sum(2 + len(d.idats) + len(d.chunks) for d in decoded)
+    assert len(ihdrs) == len(decoded)
+    return {
+        "files": len(decoded),
+        "ihdr": ihdrs_size / len(ihdrs),
+        "png": decoded_size / len(decoded),
+        "chunk": decoded_size / num_chunks,
+    }
 
 
 def parse_args() -> Namespace:
     parser = ArgumentParser()
     # list of filenames to decode
     parser.add_argument("filenames", nargs="+")
+    # only print the IHDR metadata of each file (directories are searched for .png files)
+    parser.add_argument("--headers", action="store_true")
+    # print one JSON line per file instead of a hex dump, inspecting files in parallel
+    # (directories and glob patterns are expanded to .png files)
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=16)
+    # print the memory held per decoded record
+    parser.add_argument("--footprint", action="store_true")
+    # which chunk CRCs to check when decoding
+    parser.add_argument("--verify", choices=VERIFY_LEVELS, default=VERIFY_ALL)
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
 
-    decoded = [decode_file(filename) for filename in args.filenames]
+    if args.headers:
+        for header in scan_headers(args.filenames):
+            print(" ".join(str(v) for v in header if v is not None))
+        return
+
+    if args.footprint:
+        f = 18
+        footprint = measure_footprint(args.filenames)
+        print("files".ljust(f), footprint.pop("files"))
+        for name, size in footprint.items():
+            print(f"bytes / {name}".ljust(f), f"{size:.0f}")
+        return
+
+    if args.batch:
+        batch(args.filenames, workers=args.workers, chunksize=args.chunksize, verify=args.verify)
+        return
+
+    decoded = [decode_file(filename, verify=args.verify) for filename in args.filenames]
     for d in decoded:
         d.print()
 
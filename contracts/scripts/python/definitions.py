@@ -0,0 +1,341 @@
+"""
+Avatar definitions: the layers, and the pattern and palette index spaces of the DNA.
+
+The layers and their order are those of DNA.sol and OpenAvatarGen0CanvasRenderer.sol. Pattern and palette indices are
+positions in the @openavatar/types config (types/src/gen0): a layer's patterns are numbered in the order of its
+'pattern:<name>' keys in AvatarConfig.ts, and the palettes of a palette code in the order of its list in
+PaletteConfig.ts. The lists are read from the TypeScript sources, so they cannot drift from what is uploaded on-chain.
+PaletteConfig.ts builds some lists with spreads, Array.from and flatMap, which are evaluated by a small interpreter
+for the subset of TypeScript array expressions the config uses.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from patterns import PATTERNS_DIR
+
+TYPES_DIR: str = os.path.normpath(os.path.join(PATTERNS_DIR, "..", "..", "..", "types", "src", "gen0"))
+
+
+class Layer(NamedTuple):
+    name: str
+    index: int
+
+
+# in DNA order (DNA.sol), 2 bytes each: pattern, palette
+LAYERS: Tuple[Layer, ...] = (
+    Layer("body", 10),
+    Layer("tattoos", 20),
+    Layer("makeup", 30),
+    Layer("left_eye", 40),
+    Layer("right_eye", 50),
+    Layer("bottomwear", 60),
+    Layer("footwear", 70),
+    Layer("topwear", 80),
+    Layer("handwear", 90),
+    Layer("outerwear", 100),
+    Layer("jewelry", 110),
+    Layer("facial_hair", 120),
+    Layer("facewear", 130),
+    Layer("eyewear", 140),
+    Layer("hair", 150),
+)
+
+# the order in which OpenAvatarGen0CanvasRenderer draws the layers (outerwear goes under handwear)
+DRAW_ORDER: Tuple[str, ...] = (
+    "body",
+    "tattoos",
+    "makeup",
+    "left_eye",
+    "right_eye",
+    "bottomwear",
+    "footwear",
+    "topwear",
+    "outerwear",
+    "handwear",
+    "jewelry",
+    "facial_hair",
+    "facewear",
+    "eyewear",
+    "hair",
+)
+
+_TOKEN = re.compile(
+    r"""\s*(?:(?P<str>'[^']*'|"[^"]*")|(?P<tpl>`[^`]*`)|(?P<num>\d+)|(?P<name>[A-Za-z_$][\w$]*)"""
+    r"""|(?P<op>\.\.\.|=>|[\[\](){},.:+]))"""
+)
+
+# ${(i + 1).toString()} or ${(i + 1).toString().padStart(3, '0')}
+_TEMPLATE_FIELD = re.compile(r"\$\{\((\w+) \+ 1\)\.toString\(\)(?:\.padStart\((\d+), '(.)'\))?\}")
+
+Env = Dict[str, Any]
+Thunk = Callable[[Env], Any]
+
+
+class _ArrayExpression:
+    """
+    Compiles a TypeScript array expression to a function of the variables in scope.
+
+    Supported: string, template and number literals, names, array literals with spreads, a + b, Array.from({ length:
+    n }, (_, i) => ...), and .map / .flatMap with arrow functions.
+    """
+
+    def __init__(self, source: str):
+        self.tokens: List[Tuple[str, str]] = []
+        pos = 0
+        source = source.strip()
+        while pos < len(source):
+            m = _TOKEN.match(source, pos)
+            assert m and m.end() > pos, f"unsupported syntax: {source[pos:pos + 40]!r}"
+            self.tokens.append((m.lastgroup, m.group(m.lastgroup)))
+            pos = m.end()
+        self.pos = 0
+
+    def compile(self) -> Thunk:
+        thunk = self._concat()
+        assert self.pos == len(self.tokens), f"unexpected {self.tokens[self.pos:][:5]}"
+        return thunk
+
+    def _peek(self, offset: int = 0) -> Optional[str]:
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset][1]
+        return None
+
+    def _next(self, expected: Optional[str] = None) -> Tuple[str, str]:
+        token = self.tokens[self.pos]
+        assert expected is None or token[1] == expected, f"expected {expected!r}, got {token[1]!r}"
+        self.pos += 1
+        return token
+
+    def _concat(self) -> Thunk:
+        terms = [self._postfix()]
+        while self._peek() == "+":
+            self._next("+")
+            terms.append(self._postfix())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda env: "".join(term(env) for term in terms)
+
+    def _postfix(self) -> Thunk:
+        thunk = self._primary()
+        while self._peek() == ".":
+            self._next(".")
+            _, method = self._next()
+            assert method in ("map", "flatMap"), f"unsupported method: {method}"
+            self._next("(")
+            params, body = self._arrow()
+            self._next(")")
+            thunk = self._apply(thunk, method, params[0], body)
+        return thunk
+
+    @staticmethod
+    def _apply(array: Thunk, method: str, param: str, body: Thunk) -> Thunk:
+        def apply(env: Env) -> List[Any]:
+            out = []
+            for item in array(env):
+                value = body({**env, param: item})
+                if method == "flatMap":
+                    out.extend(value)
+                else:
+                    out.append(value)
+            return out
+
+        return apply
+
+    def _arrow(self) -> Tuple[List[str], Thunk]:
+        self._next("(")
+        params = []
+        while self._peek() != ")":
+            params.append(self._next()[1])
+            if self._peek() == ",":
+                self._next(",")
+        self._next(")")
+        self._next("=>")
+        return params, self._concat()
+
+    def _primary(self) -> Thunk:
+        kind, value = self._next()
+        if kind == "str":
+            return lambda env: value[1:-1]
+        if kind == "num":
+            return lambda env: int(value)
+        if kind == "tpl":
+            return self._template(value[1:-1])
+        if value == "[":
+            return self._array()
+        if value == "(":
+            thunk = self._concat()
+            self._next(")")
+            return thunk
+        assert kind == "name", f"unexpected {value!r}"
+        if value == "Array" and self._peek(1) == "from":
+            return self._array_from()
+        name = value
+        while self._peek() == "." and self._peek(1) not in ("map", "flatMap"):
+            self._next(".")
+            name += "." + self._next()[1]
+        return lambda env: env[name]
+
+    def _array(self) -> Thunk:
+        elements: List[Tuple[bool, Thunk]] = []
+        while self._peek() != "]":
+            spread = self._peek() == "..."
+            if spread:
+                self._next("...")
+            elements.append((spread, self._concat()))
+            if self._peek() == ",":
+                self._next(",")
+        self._next("]")
+
+        def array(env: Env) -> List[Any]:
+            out = []
+            for spread, element in elements:
+                if spread:
+                    out.extend(element(env))
+                else:
+                    out.append(element(env))
+            return out
+
+        return array
+
+    def _array_from(self) -> Thunk:
+        self._next(".")
+        self._next("from")
+        self._next("(")
+        self._next("{")
+        self._next("length")
+        self._next(":")
+        length = int(self._next()[1])
+        self._next("}")
+        self._next(",")
+        params, body = self._arrow()
+        self._next(")")
+        return lambda env: [body({**env, params[1]: i}) for i in range(length)]
+
+    @staticmethod
+    def _template(template: str) -> Thunk:
+        def render(env: Env) -> str:
+            def field(m: re.Match) -> str:
+                s = str(env[m.group(1)] + 1)
+                return s.rjust(int(m.group(2)), m.group(3)) if m.group(2) else s
+
+            out = _TEMPLATE_FIELD.sub(field, template)
+            assert "${" not in out, f"unsupported template: {template}"
+            return out
+
+        return render
+
+
+def _strip_comments(source: str) -> str:
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.S)
+    return re.sub(r"(?m)^\s*//.*$", "", source)
+
+
+def _bracketed(source: str, start: int) -> int:
+    """
+    The index just past the bracket matching the one at `start`.
+    """
+    depth = 0
+    for i in range(start, len(source)):
+        c = source[i]
+        if c in "[({":
+            depth += 1
+        elif c in "])}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    raise ValueError("unbalanced brackets")
+
+
+def _expression_end(source: str, start: int) -> int:
+    """
+    The end of the expression starting at `start`, just before the comma or brace ending it.
+    """
+    i = start
+    while i < len(source) and source[i] not in ",}\n":
+        if source[i] in "[({":
+            i = _bracketed(source, i)
+        elif source[i] in "'\"`":
+            i = source.index(source[i], i + 1) + 1
+        else:
+            i += 1
+    return i
+
+
+def parse_palette_config(source: str) -> Dict[int, List[str]]:
+    """
+    Parse PaletteConfig.ts: the palette names of every palette code, in palette index order.
+    """
+    source = _strip_comments(source)
+    env: Env = {}
+    # public static NAME: string[] = [...]
+    for m in re.finditer(r"public static (\w+): string\[\] = ", source):
+        end = _bracketed(source, m.end())
+        env[f"PaletteList.{m.group(1)}"] = _ArrayExpression(source[m.end() : end]).compile()(env)
+    # const name = [...]
+    for m in re.finditer(r"(?m)^const (\w+)(?:: string\[\])? = (?=\[)", source):
+        end = _bracketed(source, m.end())
+        env[m.group(1)] = _ArrayExpression(source[m.end() : end]).compile()(env)
+    palettes: Dict[int, List[str]] = {}
+    for m in re.finditer(r"export const palettes__(\d+)__\w+: PaletteConfig = \{", source):
+        body = source[m.end() - 1 : _bracketed(source, m.end() - 1)]
+        start = body.index("palettes:") + len("palettes:")
+        expression = body[start : _expression_end(body, start)]
+        palettes[int(m.group(1))] = _ArrayExpression(expression).compile()(env)
+    return palettes
+
+
+def parse_avatar_config(source: str) -> Dict[str, List[Tuple[str, int]]]:
+    """
+    Parse AvatarConfig.ts: the (pattern name, palette code) of every layer, in pattern index order.
+    """
+    source = _strip_comments(source)
+    layers: Dict[str, List[Tuple[str, int]]] = {}
+    for m in re.finditer(r"\[AvatarLayerStack\.(\w+)\.name\]: \{", source):
+        body = source[m.end() - 1 : _bracketed(source, m.end() - 1)]
+        patterns = re.findall(r"'pattern:(\w+)': palettes__(\d+)__\w+", body)
+        layers[m.group(1)] = [(name, int(code)) for name, code in patterns]
+    return layers
+
+
+@dataclass
+class Definitions:
+    # layer name -> [(pattern name, palette code)], by pattern index
+    patterns: Dict[str, List[Tuple[str, int]]]
+    # palette code -> [palette name], by palette index
+    palettes: Dict[int, List[str]]
+
+    @staticmethod
+    def parse(avatar_config: str, palette_config: str) -> "Definitions":
+        return Definitions(patterns=parse_avatar_config(avatar_config), palettes=parse_palette_config(palette_config))
+
+    def pattern(self, layer: str, index: int) -> Optional[Tuple[str, int]]:
+        """
+        The (pattern name, palette code) of a pattern index, or None if there is no such pattern.
+        """
+        patterns = self.patterns.get(layer, [])
+        return patterns[index] if index < len(patterns) else None
+
+    def palette(self, code: int, index: int) -> Optional[str]:
+        """
+        The palette name of a palette index, or None if there is no such palette.
+        """
+        palettes = self.palettes.get(code, [])
+        return palettes[index] if index < len(palettes) else None
+
+    def print(self):
+        f = 18
+        for layer in LAYERS:
+            print(layer.name.ljust(f), len(self.patterns.get(layer.name, [])), "patterns")
+        for code, names in sorted(self.palettes.items()):
+            print(f"palette code {code}".ljust(f), len(names), "palettes")
+
+
+def load_definitions(types_dir: str = TYPES_DIR) -> Definitions:
+    with open(os.path.join(types_dir, "AvatarConfig.ts"), "r") as f:
+        avatar_config = f.read()
+    with open(os.path.join(types_dir, "PaletteConfig.ts"), "r") as f:
+        palette_config = f.read()
+    return Definitions.parse(avatar_config, palette_config)
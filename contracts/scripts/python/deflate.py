@@ -0,0 +1,395 @@
+"""
+DEFLATE and zlib encoding.
+
+DEFLATE Compressed Data Format
+https://www.ietf.org/rfc/rfc1951.txt
+
+ZLIB Compressed Data Format
+https://www.rfc-editor.org/rfc/rfc1950
+
+A DEFLATE stream is a sequence of blocks. Each block begins with 3 header bits
+
+    first bit       BFINAL
+    next 2 bits     BTYPE
+
+    BTYPE  00 - no compression (stored)
+           01 - compressed with fixed Huffman codes
+           10 - compressed with dynamic Huffman codes
+           11 - reserved (error)
+
+Data elements are packed into bytes starting with the least significant bit of the byte. Huffman codes are packed
+starting with the most significant bit of the code, every other field starting with its least significant bit.
+"""
+
+import zlib
+from typing import List, Tuple, Union
+
+import numpy as np
+from bitstream import BitWriter
+from huffman import canonical_code_lengths, canonical_codes
+from instrument import count, span
+from lz77 import Tokens, lz77
+
+BTYPE_STORED: int = 0
+BTYPE_FIXED: int = 1
+BTYPE_DYNAMIC: int = 2
+
+# LEN is a 16 bit field, so a stored block holds at most 65535 bytes
+MAX_STORED_BLOCK_SIZE: int = 65535
+
+# end-of-block symbol of the literal/length alphabet
+END_OF_BLOCK: int = 256
+
+# literal/length codes are limited to 15 bits, code length codes to 7 bits
+MAX_BITS: int = 15
+MAX_CODE_LENGTH_BITS: int = 7
+
+# order in which the code length code lengths are transmitted
+CODE_LENGTH_ORDER: Tuple[int, ...] = (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15)
+
+# Fixed Huffman code lengths for the literal/length alphabet
+#
+#    Lit Value    Bits        Codes
+#    ---------    ----        -----
+#      0 - 143     8          00110000 through 10111111
+#    144 - 255     9          110010000 through 111111111
+#    256 - 279     7          0000000 through 0010111
+#    280 - 287     8          11000000 through 11000111
+FIXED_LITERAL_LENGTHS: List[int] = [8] * 144 + [9] * 112 + [7] * 24 + [8] * 8
+
+# Distance codes 0-31 are represented by (fixed-length) 5-bit codes
+FIXED_DISTANCE_LENGTHS: List[int] = [5] * 32
+
+# Length codes 257-285: base match length and number of extra bits
+#
+#         Extra               Extra               Extra
+#    Code Bits Length(s) Code Bits Lengths   Code Bits Length(s)
+#    ---- ---- ------     ---- ---- -------   ---- ---- -------
+#     257   0     3       267   1   15,16     277   4   67-82
+#     258   0     4       268   1   17,18     278   4   83-98
+#     259   0     5       269   2   19-22     279   4   99-114
+#     260   0     6       270   2   23-26     280   4  115-130
+#     261   0     7       271   2   27-30     281   5  131-162
+#     262   0     8       272   2   31-34     282   5  163-194
+#     263   0     9       273   3   35-42     283   5  195-226
+#     264   0    10       274   3   43-50     284   5  227-257
+#     265   1  11,12      275   3   51-58     285   0    258
+#     266   1  13,14      276   3   59-66
+LENGTH_BASE: Tuple[int, ...] = (
+    3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31, 35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258,
+)  # fmt: skip
+LENGTH_EXTRA: Tuple[int, ...] = (
+    0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0,
+)  # fmt: skip
+
+# Distance codes 0-29: base distance and number of extra bits
+DIST_BASE: Tuple[int, ...] = (
+    1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193,
+    257, 385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145, 8193, 12289, 16385, 24577,
+)  # fmt: skip
+DIST_EXTRA: Tuple[int, ...] = (
+    0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13,
+)  # fmt: skip
+
+
+def _code_lengths(freqs: List[int], max_bits: int) -> List[int]:
+    """
+    Compute Huffman code lengths of at most `max_bits` bits for the given symbol frequencies.
+
+    At least two symbols are always given a code (as zlib does), so that every code is complete.
+    """
+    freqs = list(freqs)
+    used = sum(1 for freq in freqs if freq)
+    for symbol in range(len(freqs)):
+        if used >= 2:
+            break
+        if not freqs[symbol]:
+            freqs[symbol] = 1
+            used += 1
+    return canonical_code_lengths(freqs, max_bits)
+
+
+def deflate_stored(data: bytes, final: bool = True) -> bytes:
+    """
+    Encode the data as a sequence of non-compressed blocks (BTYPE=00).
+
+    :param final: Whether to set BFINAL on the last block.
+
+    Any bits of input up to the next byte boundary are ignored.
+    The rest of the block consists of the following information:
+
+         0   1   2   3   4...
+       +---+---+---+---+================================+
+       |  LEN  | NLEN  |... LEN bytes of literal data...|
+       +---+---+---+---+================================+
+
+    LEN is the number of data bytes in the block.  NLEN is the
+    one's complement of LEN.
+    """
+    out = bytearray()
+    mv = memoryview(data)
+    offset = 0
+    while True:
+        block = mv[offset : offset + MAX_STORED_BLOCK_SIZE]
+        offset += len(block)
+        bfinal = final and offset >= len(mv)
+        l = len(block)
+        # BFINAL, BTYPE = 00 and the padding up to the byte boundary
+        out.append(1 if bfinal else 0)
+        out.append(l & 0xFF)
+        out.append((l >> 8) & 0xFF)
+        out.append(~l & 0xFF)
+        out.append((~l >> 8) & 0xFF)
+        out.extend(block)
+        if offset >= len(mv):
+            return bytes(out)
+
+
+def _token_symbols(tokens: Tokens) -> Tuple[np.ndarray, ...]:
+    """
+    Map tokens to their literal/length and distance symbols and extra bits.
+
+    :return: (literal/length symbol, length extra value, length extra bits, distance symbol, distance extra value,
+        distance extra bits) per token. The length and distance fields of literals are all 0.
+    """
+    values, distances = tokens
+    match = distances > 0
+    length_code = np.searchsorted(LENGTH_BASE, values, side="right") - 1
+    # 258 has its own code (285), 227-257 use code 284
+    length_code[values == 258] = 28
+    dist_code = np.searchsorted(DIST_BASE, distances, side="right") - 1
+    lit_symbol = np.where(match, 257 + length_code, values)
+    length_extra = np.where(match, values - np.take(LENGTH_BASE, length_code), 0)
+    length_bits = np.where(match, np.take(LENGTH_EXTRA, length_code), 0)
+    dist_symbol = np.where(match, dist_code, 0)
+    dist_extra = np.where(match, distances - np.take(DIST_BASE, dist_code), 0)
+    dist_bits = np.where(match, np.take(DIST_EXTRA, dist_code), 0)
+    return lit_symbol, length_extra, length_bits, dist_symbol, dist_extra, dist_bits
+
+
+def _huffman_block(
+    header_values: List[int],
+    header_nbits: List[int],
+    tokens: Tokens,
+    lit_codes: Union[List[int], np.ndarray],
+    lit_lengths: Union[List[int], np.ndarray],
+    dist_codes: Union[List[int], np.ndarray],
+    dist_lengths: Union[List[int], np.ndarray],
+    final: bool = True,
+) -> bytes:
+    """
+    Pack a Huffman-coded block: the block header fields, the tokens and the end-of-block code.
+
+    Each token becomes the fields [literal/length code, length extra bits, distance code, distance extra bits], of
+    which a literal only uses the first (the others are 0 bits wide and dropped). Tokens without any match (level 0)
+    are all literals, whose codes are looked up by byte value directly.
+
+    A block that is not final is followed by an empty stored block, as with zlib's Z_SYNC_FLUSH: its 3 header bits
+    and the padding bring the stream to a byte boundary, so that more blocks can be appended to the bytes.
+    """
+    lit_codes = np.asarray(lit_codes, dtype=np.int64)
+    lit_lengths = np.asarray(lit_lengths, dtype=np.int64)
+    if not tokens[1].any():
+        values = lit_codes[tokens[0]]
+        nbits = lit_lengths[tokens[0]]
+    else:
+        dist_codes = np.asarray(dist_codes, dtype=np.int64)
+        dist_lengths = np.asarray(dist_lengths, dtype=np.int64)
+        lit_symbol, length_extra, length_bits, dist_symbol, dist_extra, dist_bits = _token_symbols(tokens)
+        match = tokens[1] > 0
+        values = np.stack(
+            [lit_codes[lit_symbol], length_extra, np.where(match, dist_codes[dist_symbol], 0), dist_extra], axis=1
+        ).reshape(-1)
+        nbits = np.stack(
+            [lit_lengths[lit_symbol], length_bits, np.where(match, dist_lengths[dist_symbol], 0), dist_bits], axis=1
+        ).reshape(-1)
+        keep = nbits > 0
+        values, nbits = values[keep], nbits[keep]
+    count("deflate.tokens", len(tokens[0]))
+    header_values = list(header_values)
+    header_values[0] |= int(final)
+    writer = BitWriter()
+    writer.write_fields(
+        np.concatenate([header_values, values, [lit_codes[END_OF_BLOCK]]]),
+        np.concatenate([header_nbits, nbits, [lit_lengths[END_OF_BLOCK]]]),
+    )
+    if final:
+        return writer.getvalue()
+    # BFINAL = 0, BTYPE = 00, LEN = 0, NLEN = 0xffff
+    writer.write_fields([0], [3])
+    return writer.getvalue() + b"\x00\x00\xff\xff"
+
+
+FIXED_LITERAL_CODES: List[int] = canonical_codes(FIXED_LITERAL_LENGTHS, reverse=True)
+FIXED_DISTANCE_CODES: List[int] = canonical_codes(FIXED_DISTANCE_LENGTHS, reverse=True)
+
+# the fixed codes as arrays, converted once rather than per block
+_FIXED_TABLES: Tuple[np.ndarray, ...] = tuple(
+    np.array(table, dtype=np.int64)
+    for table in (FIXED_LITERAL_CODES, FIXED_LITERAL_LENGTHS, FIXED_DISTANCE_CODES, FIXED_DISTANCE_LENGTHS)
+)
+
+
+def deflate_fixed(data: bytes, level: int = 0, final: bool = True) -> bytes:
+    """
+    Encode the data as a single block compressed with the fixed Huffman codes (BTYPE=01).
+
+    :param level: The LZ77 level (see lz77.lz77), 0 encodes every byte as a literal.
+    :param final: Whether this is the last block (see _huffman_block).
+    """
+    with span("lz77"):
+        tokens = lz77(data, level)
+    # BTYPE = 01, BFINAL is set by _huffman_block
+    return _huffman_block(
+        [0b010],
+        [3],
+        tokens,
+        *_FIXED_TABLES,
+        final=final,
+    )
+
+
+def _run_length_encode(lengths: List[int]) -> List[Tuple[int, int, int]]:
+    """
+    Run-length encode a sequence of code lengths with the code length alphabet.
+
+         0 - 15: Represent code lengths of 0 - 15
+             16: Copy the previous code length 3 - 6 times (2 extra bits)
+             17: Repeat a code length of 0 for 3 - 10 times (3 extra bits)
+             18: Repeat a code length of 0 for 11 - 138 times (7 extra bits)
+
+    :return: A list of (symbol, extra bits value, number of extra bits).
+    """
+    out: List[Tuple[int, int, int]] = []
+    i = 0
+    n = len(lengths)
+    while i < n:
+        length = lengths[i]
+        run = 1
+        while i + run < n and lengths[i + run] == length:
+            run += 1
+        i += run
+        if length == 0:
+            while run >= 11:
+                r = min(run, 138)
+                out.append((18, r - 11, 7))
+                run -= r
+            if run >= 3:
+                out.append((17, run - 3, 3))
+                run = 0
+        else:
+            out.append((length, 0, 0))
+            run -= 1
+            while run >= 3:
+                r = min(run, 6)
+                out.append((16, r - 3, 2))
+                run -= r
+        out.extend((length, 0, 0) for _ in range(run))
+    return out
+
+
+def deflate_dynamic(data: bytes, level: int = 0, final: bool = True) -> bytes:
+    """
+    Encode the data as a single block compressed with dynamic Huffman codes (BTYPE=10).
+
+    :param level: The LZ77 level (see lz77.lz77), 0 encodes every byte as a literal.
+    :param final: Whether this is the last block (see _huffman_block).
+
+    The block header describes the literal/length and distance code lengths, run-length encoded and themselves
+    Huffman coded with the code length code:
+
+          5 Bits: HLIT, # of Literal/Length codes - 257 (257 - 286)
+          5 Bits: HDIST, # of Distance codes - 1        (1 - 32)
+          4 Bits: HCLEN, # of Code Length codes - 4     (4 - 19)
+          (HCLEN + 4) x 3 bits: code lengths for the code length alphabet, in CODE_LENGTH_ORDER
+          HLIT + 257 code lengths for the literal/length alphabet
+          HDIST + 1 code lengths for the distance alphabet
+    """
+    with span("lz77"):
+        tokens = lz77(data, level)
+    with span("huffman_build"):
+        lit_symbol, _, _, dist_symbol, _, _ = _token_symbols(tokens)
+        freqs = np.bincount(lit_symbol, minlength=286).tolist()
+        freqs[END_OF_BLOCK] = 1
+        lit_lengths = _code_lengths(freqs, MAX_BITS)
+        lit_codes = canonical_codes(lit_lengths, reverse=True)
+        # a distance code is described even if there are no matches
+        dist_lengths = _code_lengths(np.bincount(dist_symbol[tokens[1] > 0], minlength=30).tolist(), MAX_BITS)
+        dist_codes = canonical_codes(dist_lengths, reverse=True)
+
+        hlit = max(257, max(s for s, l in enumerate(lit_lengths) if l) + 1)
+        hdist = max(1, max(s for s, l in enumerate(dist_lengths) if l) + 1)
+        rle = _run_length_encode(lit_lengths[:hlit] + dist_lengths[:hdist])
+
+        cl_freqs = [0] * 19
+        for symbol, _, _ in rle:
+            cl_freqs[symbol] += 1
+        cl_lengths = _code_lengths(cl_freqs, MAX_CODE_LENGTH_BITS)
+        cl_codes = canonical_codes(cl_lengths, reverse=True)
+        hclen = 19
+        while hclen > 4 and cl_lengths[CODE_LENGTH_ORDER[hclen - 1]] == 0:
+            hclen -= 1
+
+    # BTYPE = 10, BFINAL is set by _huffman_block
+    header_values: List[int] = [0b100, hlit - 257, hdist - 1, hclen - 4]
+    header_nbits: List[int] = [3, 5, 5, 4]
+    for symbol in CODE_LENGTH_ORDER[:hclen]:
+        header_values.append(cl_lengths[symbol])
+        header_nbits.append(3)
+    for symbol, extra, extra_bits in rle:
+        header_values.append(cl_codes[symbol])
+        header_nbits.append(cl_lengths[symbol])
+        if extra_bits:
+            header_values.append(extra)
+            header_nbits.append(extra_bits)
+
+    return _huffman_block(header_values, header_nbits, tokens, lit_codes, lit_lengths, dist_codes, dist_lengths, final)
+
+
+def deflate(data: bytes, btype: int = BTYPE_STORED, level: int = 0, final: bool = True) -> bytes:
+    """
+    Encode the data as a raw DEFLATE stream using the given block type and, for Huffman-coded blocks, LZ77 level.
+
+    With final=False the stream is left open on a byte boundary: the output of further calls can be appended to it,
+    the last one with final=True. Each call only matches within its own data, so the pieces are independent.
+    """
+    if btype == BTYPE_STORED:
+        return deflate_stored(data, final)
+    if btype == BTYPE_FIXED:
+        return deflate_fixed(data, level, final)
+    if btype == BTYPE_DYNAMIC:
+        return deflate_dynamic(data, level, final)
+    raise ValueError(f"invalid block type: {btype}")
+
+
+def zlib_header(flevel: int = 0) -> bytes:
+    """
+    The 2 byte zlib header for a 32K window.
+
+    CMF: CM = 8 (deflate), CINFO = 7 (32K window size)
+    FLG: FLEVEL (compression level hint), FDICT = 0 (no preset dictionary), FCHECK such that CMF * 256 + FLG is a
+    multiple of 31
+    """
+    cmf = 0x78
+    flg = flevel << 6
+    flg |= (31 - (cmf * 256 + flg) % 31) % 31
+    return bytes([cmf, flg])
+
+
+def zlib_flevel(level: int) -> int:
+    """
+    The FLEVEL header hint for a compression level: 0 fastest, 1 fast, 2 default, 3 maximum compression (as zlib).
+    """
+    if level < 2:
+        return 0
+    if level < 6:
+        return 1
+    return 2 if level == 6 else 3
+
+
+def zlib_compress(data: bytes, btype: int = BTYPE_STORED, level: int = 0) -> bytes:
+    """
+    Compress the data into a zlib stream: header, DEFLATE blocks and the Adler-32 checksum of the uncompressed data.
+    """
+    header = zlib_header(zlib_flevel(level))
+    return header + deflate(data, btype, level) + zlib.adler32(data).to_bytes(4, byteorder="big")
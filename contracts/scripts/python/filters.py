@@ -0,0 +1,283 @@
+"""
+PNG scanline filtering.
+
+https://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters
+
+Filter method 0 defines five basic filter types. Each scanline is prefixed with the filter type byte, and each byte
+x of the filtered scanline is computed from the raw byte and its already reconstructed neighbours:
+
+    c b
+    a x
+
+    a  the byte corresponding to x in the pixel immediately before the pixel containing x (0 for the first pixel)
+    b  the byte corresponding to x in the previous scanline (0 for the first scanline)
+    c  the byte corresponding to b in the pixel immediately before the pixel containing b
+
+    Type  Name     Filter Function                 Reconstruction Function
+    0     None     Filt(x) = Orig(x)               Recon(x) = Filt(x)
+    1     Sub      Filt(x) = Orig(x) - Orig(a)     Recon(x) = Filt(x) + Recon(a)
+    2     Up       Filt(x) = Orig(x) - Orig(b)     Recon(x) = Filt(x) + Recon(b)
+    3     Average  Filt(x) = Orig(x) - floor((Orig(a) + Orig(b)) / 2)
+                                                   Recon(x) = Filt(x) + floor((Recon(a) + Recon(b)) / 2)
+    4     Paeth    Filt(x) = Orig(x) - PaethPredictor(Orig(a), Orig(b), Orig(c))
+                                                   Recon(x) = Filt(x) + PaethPredictor(Recon(a), Recon(b), Recon(c))
+
+All arithmetic is modulo 256.
+
+An encoder may choose a different filter type for every scanline. The selection strategies here are
+
+    fixed   the same given filter type on every scanline (PNG.sol uses None)
+    minsad  the filter type whose output has the minimum sum of absolute values, as signed bytes (libpng's heuristic)
+    brute   the filter type that adds the fewest bytes to the zlib stream of the scanlines chosen so far
+"""
+
+import glob
+import os
+import zlib
+from argparse import ArgumentParser, Namespace
+from typing import Dict, List, Union
+
+import numpy as np
+
+FILTER_NONE: int = 0
+FILTER_SUB: int = 1
+FILTER_UP: int = 2
+FILTER_AVERAGE: int = 3
+FILTER_PAETH: int = 4
+
+FILTER_TYPES: List[int] = [FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE, FILTER_PAETH]
+FILTER_NAMES: List[str] = ["none", "sub", "up", "average", "paeth"]
+
+STRATEGY_FIXED: str = "fixed"
+STRATEGY_MIN_SAD: str = "minsad"
+STRATEGY_BRUTE_FORCE: str = "brute"
+STRATEGIES: List[str] = [STRATEGY_FIXED, STRATEGY_MIN_SAD, STRATEGY_BRUTE_FORCE]
+
+# zlib level of the trial compression of the brute force strategy
+BRUTE_FORCE_LEVEL: int = 9
+
+
+def filter_rows(rows: np.ndarray, bpp: int) -> np.ndarray:
+    """
+    Apply every filter type to every scanline.
+
+    :param rows: The raw scanlines without filter type bytes, as uint8 of shape (h, stride).
+    :param bpp: The number of bytes per complete pixel, rounded up to 1.
+    :return: The filtered scanlines, as uint8 of shape (5, h, stride), indexed by filter type.
+
+    Filtering only depends on the raw bytes, so each filter is a difference of shifted copies of the whole image.
+    """
+    x = rows.astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, bpp:] = x[:, :-bpp]
+    b = np.zeros_like(x)
+    b[1:] = x[:-1]
+    c = np.zeros_like(x)
+    c[1:, bpp:] = x[:-1, :-bpp]
+    p = a + b - c
+    pa = np.abs(p - a)
+    pb = np.abs(p - b)
+    pc = np.abs(p - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    out = np.stack([x, x - a, x - b, x - ((a + b) >> 1), x - paeth])
+    return (out & 0xFF).astype(np.uint8)
+
+
+def _brute_force(filtered: np.ndarray) -> np.ndarray:
+    """
+    Pick the filter type of each scanline by trial compression: compress the scanlines chosen so far plus each
+    candidate, and keep the candidate that grows the stream the least.
+    """
+    h = filtered.shape[1]
+    types = np.zeros(h, dtype=np.uint8)
+    compressor = zlib.compressobj(BRUTE_FORCE_LEVEL)
+    for y in range(h):
+        best = None
+        for t in FILTER_TYPES:
+            trial = compressor.copy()
+            line = bytes([t]) + filtered[t, y].tobytes()
+            n = len(trial.compress(line)) + len(trial.flush(zlib.Z_SYNC_FLUSH))
+            if best is None or n < best[0]:
+                best = (n, t)
+        types[y] = best[1]
+        compressor.compress(bytes([best[1]]) + filtered[best[1], y].tobytes())
+    return types
+
+
+def select_filters(
+    filtered: np.ndarray, strategy: str = STRATEGY_FIXED, filter_type: Union[int, np.ndarray] = FILTER_NONE
+) -> np.ndarray:
+    """
+    Choose the filter type of every scanline.
+
+    :param filtered: The output of filter_rows.
+    :param strategy: One of STRATEGIES.
+    :param filter_type: The filter type of every scanline, or one per scanline, for STRATEGY_FIXED.
+    :return: The filter types, as uint8 of shape (h,).
+    """
+    h = filtered.shape[1]
+    if strategy == STRATEGY_FIXED:
+        return np.broadcast_to(np.asarray(filter_type, dtype=np.uint8), (h,)).copy()
+    if strategy == STRATEGY_MIN_SAD:
+        sad = np.abs(filtered.view(np.int8).astype(np.int32)).sum(axis=2)
+        return np.argmin(sad, axis=0).astype(np.uint8)
+    if strategy == STRATEGY_BRUTE_FORCE:
+        return _brute_force(filtered)
+    raise ValueError(f"invalid filter strategy: {strategy}")
+
+
+def filter_scanlines(
+    rows: np.ndarray, bpp: int, strategy: str = STRATEGY_FIXED, filter_type: Union[int, np.ndarray] = FILTER_NONE
+) -> np.ndarray:
+    """
+    Filter an image into PNG scanlines, each prefixed with its filter type byte.
+
+    :param rows: The raw scanlines, as uint8 of shape (h, stride).
+    :param bpp: The number of bytes per complete pixel, rounded up to 1.
+    :param strategy: How to choose the filter type of each scanline, one of STRATEGIES.
+    :param filter_type: The filter type(s) for STRATEGY_FIXED.
+    :return: The scanlines, as uint8 of shape (h, 1 + stride).
+    """
+    h, stride = rows.shape
+    out = np.empty((h, stride + 1), dtype=np.uint8)
+    if strategy == STRATEGY_FIXED and np.all(np.asarray(filter_type) == FILTER_NONE):
+        out[:, 0] = FILTER_NONE
+        out[:, 1:] = rows
+        return out
+    filtered = filter_rows(rows, bpp)
+    types = select_filters(filtered, strategy, filter_type)
+    out[:, 0] = types
+    out[:, 1:] = filtered[types, np.arange(h)]
+    return out
+
+
+def unfilter_row(filter_type: int, row: np.ndarray, prior: np.ndarray, bpp: int) -> np.ndarray:
+    """
+    Reconstruct one scanline.
+
+    :param filter_type: The filter type byte of the scanline.
+    :param row: The filtered scanline without its filter type byte, as uint8.
+    :param prior: The reconstructed previous scanline, as uint8 (all zeros for the first scanline).
+    :param bpp: The number of bytes per complete pixel, rounded up to 1.
+    :return: The reconstructed scanline, as uint8.
+
+    None, Sub and Up are computed with whole-row NumPy operations (Sub is a cumulative sum per channel, which wraps
+    modulo 256 in uint8). Average and Paeth depend on the reconstructed byte to the left, so only the part of the
+    predictor that comes from the previous scanline is vectorized and the rest is a loop over the bytes of the row.
+    """
+    if filter_type == FILTER_NONE:
+        return row
+    if filter_type == FILTER_SUB:
+        return np.cumsum(row.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)
+    if filter_type == FILTER_UP:
+        return row + prior
+    if filter_type == FILTER_AVERAGE:
+        out = bytearray(row.tobytes())
+        up = (prior >> 1).tolist()
+        b = prior.tolist()
+        # the first pixel has no left neighbour, so a = 0
+        for i in range(bpp):
+            out[i] = (out[i] + up[i]) & 0xFF
+        for i in range(bpp, len(out)):
+            out[i] = (out[i] + ((out[i - bpp] + b[i]) >> 1)) & 0xFF
+        return np.frombuffer(out, dtype=np.uint8)
+    if filter_type == FILTER_PAETH:
+        out = bytearray(row.tobytes())
+        b = prior.tolist()
+        # the first pixel has no left neighbour, so a = c = 0 and the predictor is b
+        for i in range(bpp):
+            out[i] = (out[i] + b[i]) & 0xFF
+        for i in range(bpp, len(out)):
+            a = out[i - bpp]
+            c = b[i - bpp]
+            p = a + b[i] - c
+            pa = abs(p - a)
+            pb = abs(p - b[i])
+            pc = abs(p - c)
+            if pa <= pb and pa <= pc:
+                predictor = a
+            elif pb <= pc:
+                predictor = b[i]
+            else:
+                predictor = c
+            out[i] = (out[i] + predictor) & 0xFF
+        return np.frombuffer(out, dtype=np.uint8)
+    raise ValueError(f"invalid filter type: {filter_type}")
+
+
+def savings_report(images: List[np.ndarray], bpp: int, level: int = 6, ours: bool = False) -> None:
+    """
+    Print the compressed size of the images under every filter selection.
+
+    :param images: Raw images, as uint8 of shape (h, stride).
+    :param bpp: The number of bytes per complete pixel of the images.
+    :param level: The compression level.
+    :param ours: Also compress with deflate.py, not only with zlib.
+    """
+    from deflate import BTYPE_DYNAMIC, zlib_compress
+
+    selections: Dict[str, Dict] = {name: dict(filter_type=t) for name, t in zip(FILTER_NAMES, FILTER_TYPES)}
+    selections[STRATEGY_MIN_SAD] = dict(strategy=STRATEGY_MIN_SAD)
+    selections[STRATEGY_BRUTE_FORCE] = dict(strategy=STRATEGY_BRUTE_FORCE)
+
+    stored = sum(img.shape[0] * (img.shape[1] + 1) for img in images)
+    print(f"{len(images)} images, {stored} bytes of scanlines, level {level}")
+    header = ["filter".ljust(10), "zlib".rjust(10), "saved".rjust(8)]
+    if ours:
+        header += ["deflate.py".rjust(12), "saved".rjust(8)]
+    print(*header, " rows")
+    baseline: List[int] = []
+    for name, kwargs in selections.items():
+        sizes = [0, 0]
+        counts = np.zeros(len(FILTER_TYPES), dtype=np.int64)
+        for img in images:
+            scanlines = filter_scanlines(img, bpp, **kwargs)
+            counts += np.bincount(scanlines[:, 0], minlength=len(FILTER_TYPES))
+            data = scanlines.tobytes()
+            sizes[0] += len(zlib.compress(data, level))
+            if ours:
+                sizes[1] += len(zlib_compress(data, BTYPE_DYNAMIC, level))
+        baseline = baseline or sizes
+        columns = [name.ljust(10)]
+        for size, base in list(zip(sizes, baseline))[: 2 if ours else 1]:
+            columns += [str(size).rjust(10 if len(columns) == 1 else 12), f"{1 - size / base:.1%}".rjust(8)]
+        rows = " ".join(f"{FILTER_NAMES[t]}={n}" for t, n in enumerate(counts.tolist()) if n)
+        print(*columns, "", rows)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    parser.add_argument("--level", type=int, default=6)
+    # also compress with deflate.py (slower)
+    parser.add_argument("--ours", action="store_true")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """
+    Report the compressed-size savings of filtering on the pattern corpus: the palette indices of the patterns, and
+    the same patterns rendered to RGBA (assets/assets/spritesheets), which is what PNG.sol encodes.
+    """
+    from decode import decode_file
+    from patterns import PATTERNS_DIR, pattern_paths, read_pattern_file
+
+    args = parse_args()
+    print("patterns (palette indices)")
+    images = [read_pattern_file(path).indices for path in pattern_paths()]
+    savings_report(images, bpp=1, level=args.level, ours=args.ours)
+
+    print()
+    print("spritesheets (RGBA)")
+    spritesheets = os.path.join(PATTERNS_DIR, "..", "spritesheets", "**", "*.png")
+    images = []
+    for path in sorted(glob.glob(spritesheets, recursive=True)):
+        png = decode_file(path)
+        # skip the indexed-color spritesheets
+        if png.ihdr.color_type == 6 and png.ihdr.bit_depth == 8:
+            pixels = png.pixels()
+            images.append(pixels.reshape(pixels.shape[0], -1))
+    savings_report(images, bpp=4, level=args.level, ours=args.ours)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,815 @@
+#!/usr/bin/env python3
+"""
+Offline estimate of the size and gas of rendering an avatar on-chain.
+
+Rendering a DNA (OpenAvatarGen0CanvasRenderer.renderURI) composites its 15 layers from contract storage, then encodes
+the image as a PNG (PNG.encodePNG: interlace, Adler32, CRC32), Base64, an SVG wrapping it and Base64 again. None of
+that work depends on anything but the DNA, so it is counted here from the asset files and the encoded bytes:
+
+    per layer          external calls and storage slots read (pattern header and data, palette), the pixels of the
+                       pattern's bounding box, and the opaque, copied and blended pixels drawn (_drawMaskedPattern)
+    per image byte     the interlace copy, Adler32 and CRC32 loops, Base64, and the abi.encodePacked copies
+    memory             the quadratic EVM memory expansion cost of every buffer allocated, which is never freed
+
+and priced with per-operation unit costs read off the Solidity loops. The unit costs fix the shape of the model; a
+scale factor for the storage reads and one for the loops and memory, fitted by least squares against gas measured
+on-chain by test/010_gas, fix its magnitude. Entry points that add a fixed amount of work around renderURI (tokenURI)
+get a constant offset. The error of the model is that of each measurement estimated by a calibration without it
+(cross_validation); an offset fitted to a single measurement is not validated.
+
+The asserted measurements of the test (MEASURED) hold a single renderURI, which alone fixes the scale of the loops:
+held out, it is estimated 145% too high, and the fitted scales put the unit costs off by about 2x. Estimates are only
+called calibrated when every measurement is estimated within CALIBRATION_TOLERANCE held out; until then they are
+extrapolations. The test also records renderURI of the zero DNA, of every layer alone and of sparse DNAs, and tokenURI
+of the zero DNA, to MEASURED_FILE, which is added to MEASURED when it exists.
+
+The per-layer costs are additive, apart from the blending of translucent pixels (which depends on what is drawn
+under them) and the memory cost (which is quadratic in the total). Scoring the trait space prices every layer option
+with an upper bound on those, finds the most expensive combinations of options with a k-best search, and re-scores
+them exactly.
+"""
+
+import base64
+import copy
+import heapq
+import json
+import os
+import time
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+import numpy as np
+from assets import CANVAS_HEIGHT, CANVAS_WIDTH, Assets, pose_crop
+from checksum import adler32, crc32
+from decode import IDAT, IHDR, decode_file, iter_chunks
+from definitions import DRAW_ORDER, LAYERS, Definitions
+from inflate import inflate
+from png import PNG
+from render import DNA, random_dnas
+
+# entry points
+ENTRY_COMPOSITION: str = "createLayerComposition"
+ENTRY_RENDER_URI: str = "renderURI"
+ENTRY_TOKEN_URI: str = "tokenURI"
+ENTRY_PFP_TOKEN_URI: str = "pfpTokenURI"
+ENTRIES: Tuple[str, ...] = (ENTRY_COMPOSITION, ENTRY_RENDER_URI, ENTRY_TOKEN_URI, ENTRY_PFP_TOKEN_URI)
+
+# OpenAvatarGen0CanvasRenderer.SVG_SCALE
+SVG_SCALE: int = 10
+
+# the pieces of ImageEncoder.encodeSVG around the Base64 PNG and the SVG size
+SVG_TEMPLATE: str = (
+    '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {w} {h}">\n\t<foreignObject width="{w}" height="{h}">'
+    '\n\t\t<img xmlns="http://www.w3.org/1999/xhtml" width="{w}" height="{h}" style="image-rendering: pixelated;" '
+    'src="data:image/png;base64,{png}"/>\n\t</foreignObject>\n</svg>'
+)
+SVG_URI_PREFIX: bytes = b"data:image/svg+xml;base64,"
+
+# the transaction itself, which estimateGas includes
+TX_GAS: int = 21000
+CALLDATA_ZERO_BYTE_GAS: int = 4
+CALLDATA_NONZERO_BYTE_GAS: int = 16
+# the first access to the assets contract
+COLD_ACCOUNT_GAS: int = 2600
+
+# the gas of one unit of each kind of work in Work, read off the Solidity (0.8.20, viaIR, optimizer on)
+UNIT_GAS: Dict[str, float] = {
+    # a view call to the assets contract: STATICCALL, ABI encoding of the arguments and decoding of the result
+    "calls": 900,
+    "cold_slots": 2100,
+    "warm_slots": 100,
+    # _drawLayer and the loop set up of _drawMaskedPattern
+    "layers": 400,
+    # a pixel of a pattern's bounding box: the mask check and the pattern read
+    "pixels": 150,
+    # a color index other than 0: the palette read and the alpha checks
+    "colored": 100,
+    # 4 byte writes
+    "opaque": 220,
+    # a translucent pixel over a transparent one, copied: 4 byte writes and the background alpha read
+    "copied": 250,
+    # a translucent pixel blended with the one under it: 3 blendPixel and a blendAlpha
+    "blended": 700,
+    # PNG.interlace, bounds checked read and write
+    "interlace_bytes": 150,
+    # Adler32.adler32, two modulos per byte
+    "adler32_bytes": 120,
+    # CRC32.crc32, 8 iterations of the bit loop, with checked arithmetic
+    "crc32_bytes": 800,
+    # Base64.encode, per input byte
+    "base64_bytes": 40,
+    # abi.encodePacked and ABI return copies, word by word
+    "copy_bytes": 0.25,
+    # the memory expansion cost, already in gas (see memory_gas)
+    "memory_gas": 1,
+}
+
+# the units calibrated together: storage reads and calls, whose cost is mostly fixed by the EVM, and the loops
+GROUP_STORAGE: str = "storage"
+GROUP_COMPUTE: str = "compute"
+GROUPS: Dict[str, Tuple[str, ...]] = {
+    GROUP_STORAGE: ("calls", "cold_slots", "warm_slots", "layers"),
+    GROUP_COMPUTE: tuple(name for name in UNIT_GAS if name not in ("calls", "cold_slots", "warm_slots", "layers")),
+}
+
+
+def memory_gas(n: int) -> int:
+    """
+    The EVM memory expansion cost of n bytes of memory: 3 gas per word plus the square of the words over 512.
+    """
+    words = -(-n // 32)
+    return 3 * words + words * words // 512
+
+
+def calldata_gas(data: bytes) -> int:
+    zeros = data.count(0)
+    return CALLDATA_ZERO_BYTE_GAS * zeros + CALLDATA_NONZERO_BYTE_GAS * (len(data) - zeros)
+
+
+def _word(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+
+# the function selectors are taken to be 4 nonzero bytes
+_SELECTOR: bytes = b"\xff" * 4
+
+
+def composition_calldata(layers: List[Tuple[int, int, int]], canvas_id: int = 0) -> bytes:
+    """
+    The calldata of createLayerComposition(canvasId, (layer, pattern, palette)[]).
+    """
+    head = _SELECTOR + _word(canvas_id) + _word(64) + _word(len(layers))
+    return head + b"".join(_word(layer) + _word(pattern) + _word(palette) for layer, pattern, palette in layers)
+
+
+@dataclass
+class Work:
+    """
+    Counts of the operations of a render, priced by UNIT_GAS.
+    """
+
+    calls: int = 0
+    cold_slots: int = 0
+    warm_slots: int = 0
+    layers: int = 0
+    pixels: int = 0
+    colored: int = 0
+    opaque: int = 0
+    copied: int = 0
+    blended: int = 0
+    interlace_bytes: int = 0
+    adler32_bytes: int = 0
+    crc32_bytes: int = 0
+    base64_bytes: int = 0
+    copy_bytes: int = 0
+    # bytes of memory allocated, priced by memory_gas
+    memory_bytes: int = 0
+    # not scaled: the transaction, its calldata and the first access to the assets contract
+    fixed_gas: int = 0
+    # storage objects (pattern data, palettes, array lengths) read so far, the second read of one is warm
+    read: Set[tuple] = field(default_factory=set, repr=False)
+
+    def read_storage(self, key: tuple, slots: int = 1) -> None:
+        """
+        Count the slots of a storage object read by the render.
+        """
+        if key in self.read:
+            self.warm_slots += slots
+        else:
+            self.read.add(key)
+            self.cold_slots += slots
+
+    def units(self) -> Dict[str, int]:
+        units = {f.name: getattr(self, f.name) for f in fields(self) if f.name in UNIT_GAS}
+        units["memory_gas"] = memory_gas(self.memory_bytes)
+        return units
+
+    def group_gas(self) -> Dict[str, float]:
+        """
+        The gas of the work of each group before calibration, without fixed_gas.
+        """
+        units = self.units()
+        return {group: sum(UNIT_GAS[name] * units[name] for name in names) for group, names in GROUPS.items()}
+
+    def print(self):
+        f = 18
+        for name, n in self.units().items():
+            print(name.ljust(f), str(n).rjust(10), f"{UNIT_GAS[name] * n:,.0f} gas".rjust(16))
+        print("fixed_gas".ljust(f), "".rjust(10), f"{self.fixed_gas:,} gas".rjust(16))
+
+
+def storage_bytes_slots(n: int) -> int:
+    """
+    The slots of a bytes value of length n in storage: inline under 32 bytes, else a length slot and the data words.
+    """
+    return 1 if n < 32 else 1 + -(-n // 32)
+
+
+@dataclass
+class LayerWork:
+    """
+    The work of drawing one layer option on its own (_drawLayer).
+    """
+
+    layer: str
+    pattern: int
+    palette: int
+    exists: bool
+    # the trimmed pattern as uploaded (PatternPose.trim): bounding box of the nonzero color indices
+    pattern_bytes: int
+    # the palette colors, 0 if there is no palette (then nothing is drawn)
+    colors: int
+    palette_code: int
+    colored: int
+    opaque: int
+    # pixels with 0 < alpha < 255, None if there are none
+    translucent: Optional[np.ndarray]
+    # pixels the layer leaves non-transparent
+    drawn: Optional[np.ndarray]
+
+    @property
+    def draws(self) -> bool:
+        return self.pattern_bytes > 0 and self.colors > 0
+
+    def add_to(self, work: Work, under: Optional[np.ndarray] = None) -> None:
+        """
+        Add the work of drawing the layer to a render.
+
+        :param under: the pixels already non-transparent, which translucent pixels are blended with. By default every
+            translucent pixel is counted as blended, an upper bound.
+        """
+        work.layers += 1
+        work.calls += 1
+        # getPatternHeader: the layer's pattern array length and the header
+        work.read_storage(("patterns", self.layer))
+        if not self.exists:
+            return
+        work.read_storage(("header", self.layer, self.pattern))
+        work.calls += 1
+        work.read_storage(("patterns", self.layer))
+        work.read_storage(("data", self.layer, self.pattern), storage_bytes_slots(self.pattern_bytes))
+        # the returned pattern, ABI encoded and decoded
+        work.memory_bytes += 2 * (64 + 32 * -(-self.pattern_bytes // 32))
+        work.copy_bytes += 2 * self.pattern_bytes
+        if self.pattern_bytes == 0:
+            return
+        work.calls += 1
+        work.read_storage(("palettes", self.palette_code))
+        # bytes4 packed 8 to a slot, after the length
+        work.read_storage(("palette", self.palette_code, self.palette), 1 + -(-self.colors // 8))
+        # a bytes4[] takes a word per element in memory and in the ABI
+        work.memory_bytes += 2 * (64 + 32 * self.colors)
+        work.copy_bytes += 64 * self.colors
+        if self.colors == 0:
+            return
+        # getCanvasNumPixels for the mask, getCanvasWidth
+        work.calls += 2
+        work.memory_bytes += 32 + CANVAS_WIDTH * CANVAS_HEIGHT
+        work.pixels += self.pattern_bytes
+        work.colored += self.colored
+        work.opaque += self.opaque
+        if self.translucent is not None:
+            if under is None:
+                work.blended += int(self.translucent.sum())
+            else:
+                blended = int((self.translucent & under).sum())
+                work.blended += blended
+                work.copied += int(self.translucent.sum()) - blended
+
+
+def layer_work(assets: Assets, canvas_id: int, layer: str, pattern: int, palette: int) -> LayerWork:
+    """
+    The work of drawing a layer option, from its pattern file and palette.
+    """
+    pattern_file = assets.pattern(layer, pattern)
+    if pattern_file is None:
+        return LayerWork(layer, pattern, palette, False, 0, 0, 0, 0, 0, None, None)
+    x, y = pose_crop(canvas_id)
+    indices = pattern_file.indices[y : y + CANVAS_HEIGHT, x : x + CANVAS_WIDTH]
+    rows, cols = np.nonzero(indices.any(axis=1))[0], np.nonzero(indices.any(axis=0))[0]
+    pattern_bytes = 0 if len(rows) == 0 else (rows[-1] - rows[0] + 1) * (cols[-1] - cols[0] + 1)
+    colors = assets.palette(pattern_file.palette_code, palette)
+    work = LayerWork(layer, pattern, palette, True, int(pattern_bytes), 0, pattern_file.palette_code, 0, 0, None, None)
+    if colors is None or len(colors) == 0 or pattern_bytes == 0:
+        return work
+    assert int(indices.max()) < len(colors), f"color index out of range for {layer} pattern {pattern}"
+    alpha = colors[indices, 3]
+    alpha[indices == 0] = 0
+    translucent = (alpha != 0) & (alpha != 255)
+    work.colors = len(colors)
+    work.colored = int(np.count_nonzero(indices))
+    work.opaque = int(np.count_nonzero(alpha == 255))
+    work.translucent = translucent if translucent.any() else None
+    work.drawn = alpha != 0
+    return work
+
+
+def composition_work(num_bytes: int, layers: List[LayerWork], calldata: bytes, under: bool = True) -> Work:
+    """
+    The work of compositing layers onto a new image of num_bytes bytes (_drawLayerComposition), without encoding it.
+
+    :param under: track the pixels drawn so far, to tell copied from blended translucent pixels. Otherwise every
+        translucent pixel is counted as blended.
+    """
+    work = Work(fixed_gas=TX_GAS + calldata_gas(calldata) + COLD_ACCOUNT_GAS)
+    # the layer array, the image and the canvas size checks (getCanvasNumBytes, the canvas header)
+    work.memory_bytes += 32 * (1 + len(layers)) + 96 * len(layers) + 32 + num_bytes
+    work.calls += 2
+    work.read_storage(("canvas",))
+    work.read_storage(("canvas",))
+    covered = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH), dtype=bool) if under else None
+    for layer in layers:
+        layer.add_to(work, covered)
+        if covered is not None and layer.draws and layer.drawn is not None:
+            covered |= layer.drawn
+    return work
+
+
+@dataclass
+class Sizes:
+    """
+    The bytes of each stage of encoding an image on-chain.
+    """
+
+    image: int
+    png: int
+    base64_png: int
+    svg: int
+    base64_svg: int
+    uri: int
+    # the zlib stream (the IDAT data) and the scanlines it stores
+    zlib: int
+    scanlines: int
+    # bytes covered by a computed CRC (IHDR and IDAT type and data; the IEND CRC is a constant)
+    crc32: int
+
+    def print(self):
+        f = 18
+        for name in ("image", "png", "base64_png", "svg", "base64_svg", "uri"):
+            print(name.ljust(f), f"{getattr(self, name):,} bytes")
+
+
+@lru_cache(maxsize=None)
+def encoding_sizes(width: int = CANVAS_WIDTH, height: int = CANVAS_HEIGHT, alpha: bool = True) -> Sizes:
+    """
+    The sizes of encoding a width x height image on-chain. The PNG is stored uncompressed, so they do not depend on
+    the pixels.
+    """
+    channels = 4 if alpha else 3
+    png = PNG(width, height, alpha=alpha).encode_png(bytes(channels * width * height))
+    # the CRC-32 and Adler-32 loops run over the bytes the checksums of the PNG are taken of, checked with checksum.py
+    zlib_data = bytearray()
+    crc_size = 0
+    for chunk in iter_chunks(png):
+        if isinstance(chunk, (IHDR, IDAT)):
+            covered = memoryview(png)[chunk.offset + 4 : chunk.offset + 8 + chunk.length]
+            assert crc32(covered) == int.from_bytes(chunk.crc, "big"), f"{bytes(covered[:4])!r} CRC differs"
+            crc_size += len(covered)
+        if isinstance(chunk, IDAT):
+            zlib_data += chunk.data
+    scanlines = inflate(zlib_data[2:-4])
+    assert adler32(scanlines) == zlib_data[-4:], "zlib trailer differs from the Adler-32 of the scanlines"
+    base64_png = len(base64.b64encode(png))
+    svg = len(SVG_TEMPLATE.format(w=SVG_SCALE * width, h=SVG_SCALE * height, png="")) + base64_png
+    base64_svg = 4 * -(-svg // 3)
+    return Sizes(
+        image=channels * width * height,
+        png=len(png),
+        base64_png=base64_png,
+        svg=svg,
+        base64_svg=base64_svg,
+        uri=len(SVG_URI_PREFIX) + base64_svg,
+        zlib=len(zlib_data),
+        scanlines=len(scanlines),
+        crc32=crc_size,
+    )
+
+
+def add_encoding_work(work: Work, sizes: Sizes) -> None:
+    """
+    Add the work of ImageEncoder.encodeBase64SVG and the renderURI data URI to a render.
+    """
+    # getCanvasWidth, getCanvasHeight, hasAlphaChannel
+    work.calls += 3
+    work.interlace_bytes += sizes.scanlines
+    work.adler32_bytes += sizes.scanlines
+    work.crc32_bytes += sizes.crc32
+    work.base64_bytes += sizes.png + sizes.svg
+    # zlib stream, IDAT type and data, IDAT chunk, PNG, SVG, URI and the returned URI
+    copies = 3 * sizes.zlib + sizes.png + sizes.svg + 2 * sizes.uri
+    work.copy_bytes += copies + sizes.base64_png + sizes.base64_svg
+    work.memory_bytes += sizes.scanlines + copies + sizes.base64_png + sizes.base64_svg + 32 * 10
+
+
+class Measurement(NamedTuple):
+    name: str
+    entry: str
+    # canvas width and height
+    size: int
+    # "zero" (every layer pattern 0, palette 0, uploaded transparent), "max" (the last pattern and palette of every
+    # layer) or a 0x-prefixed hex DNA of the uploaded assets
+    dna: str
+    gas: int
+
+
+# measured by test/010_gas/00_GasEstimateTest.test.ts
+MEASURED: Tuple[Measurement, ...] = (
+    Measurement("createLayerComposition(8x8)", ENTRY_COMPOSITION, 8, "zero", 241_491),
+    Measurement("createLayerComposition(32x32)", ENTRY_COMPOSITION, 32, "zero", 250_790),
+    Measurement("renderURI(max)", ENTRY_RENDER_URI, 32, "max", 10_785_118),
+    Measurement("tokenURI(max)", ENTRY_TOKEN_URI, 32, "max", 11_643_769),
+    Measurement("pfpTokenURI(max)", ENTRY_PFP_TOKEN_URI, 32, "max", 14_793_409),
+)
+
+# the measurements test/010_gas records but does not assert (GAS_MEASUREMENTS_FILE there)
+MEASURED_FILE: str = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "test", "data", "gas_measured.json")
+)
+
+# the largest held-out error (cross_validation) of a calibrated model
+CALIBRATION_TOLERANCE: float = 0.05
+
+
+def load_measurements(filename: str = MEASURED_FILE) -> Tuple[Measurement, ...]:
+    """
+    MEASURED and, if the file exists, the measurements recorded in it, which replace those of the same name.
+    """
+    measured = {m.name: m for m in MEASURED}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for record in json.load(f):
+                measured[record["name"]] = Measurement(**record)
+    return tuple(measured.values())
+
+
+def max_dna(definitions: Definitions) -> DNA:
+    """
+    The DNA of the last pattern and palette of every layer, as in the gas test.
+    """
+    data = bytearray(32)
+    for i, layer in enumerate(LAYERS):
+        patterns = definitions.patterns.get(layer.name, [])
+        if patterns:
+            data[2 * i] = len(patterns) - 1
+            data[2 * i + 1] = len(definitions.palettes[patterns[-1][1]]) - 1
+    return DNA(bytes(data))
+
+
+@dataclass
+class Estimate:
+    dna: str
+    entry: str
+    png_bytes: int
+    uri_bytes: int
+    gas: int
+    work: Work = field(repr=False)
+    # whether the model is calibrated (GasEstimator.calibrated), else the gas is an extrapolation
+    calibrated: bool = False
+
+    def print(self):
+        f = 18
+        print("dna".ljust(f), self.dna)
+        print("entry".ljust(f), self.entry)
+        print("png".ljust(f), f"{self.png_bytes:,} bytes")
+        print("uri".ljust(f), f"{self.uri_bytes:,} bytes")
+        print("gas".ljust(f), f"{self.gas:,}" + ("" if self.calibrated else " (uncalibrated)"))
+
+
+class GasEstimator:
+    """
+    Estimates the gas of rendering DNAs, calibrated against measured gas.
+
+    :param assets: The patterns and palettes.
+    :param canvas_id: The pose rendered.
+    :param measured: The measurements to calibrate against, by default those of load_measurements().
+    """
+
+    def __init__(
+        self,
+        assets: Optional[Assets] = None,
+        canvas_id: int = 0,
+        measured: Optional[Tuple[Measurement, ...]] = None,
+    ):
+        self.assets: Assets = assets or Assets()
+        self.canvas_id: int = canvas_id
+        self.measured: Tuple[Measurement, ...] = measured if measured is not None else load_measurements()
+        self._held_out_error: Optional[float] = None
+        self._layers: Dict[Tuple[str, int, int], LayerWork] = {}
+        self.scales: Dict[str, float] = {group: 1.0 for group in GROUPS}
+        self.offsets: Dict[str, float] = {}
+        self.calibrate()
+
+    def layer(self, layer: str, pattern: int, palette: int) -> LayerWork:
+        key = (layer, pattern, palette)
+        found = self._layers.get(key)
+        if found is None:
+            found = self._layers[key] = layer_work(self.assets, self.canvas_id, layer, pattern, palette)
+        return found
+
+    def work(self, dna: Union[DNA, str, bytes], entry: str = ENTRY_RENDER_URI) -> Work:
+        """
+        The work of rendering a DNA through an entry point.
+        """
+        if not isinstance(dna, DNA):
+            dna = DNA.parse(dna)
+        sizes = encoding_sizes()
+        options = dna.layers()
+        layers = [self.layer(name, *options[name]) for name in DRAW_ORDER]
+        if entry == ENTRY_COMPOSITION:
+            index = {layer.name: layer.index for layer in LAYERS}
+            calldata = composition_calldata([(index[name], *options[name]) for name in DRAW_ORDER], self.canvas_id)
+        else:
+            calldata = _SELECTOR + dna.data
+        work = composition_work(sizes.image, layers, calldata)
+        if entry == ENTRY_COMPOSITION:
+            work.copy_bytes += sizes.image
+            work.memory_bytes += 64 + sizes.image
+        else:
+            add_encoding_work(work, sizes)
+        return work
+
+    def measurement_work(self, m: Measurement) -> Work:
+        if m.dna == "max":
+            return self.work(max_dna(self.assets.definitions), m.entry)
+        if m.dna.startswith("0x"):
+            assert m.size == CANVAS_WIDTH, f"no model of a {m.size}x{m.size} canvas for {m.name}"
+            return self.work(m.dna, m.entry)
+        assert m.dna == "zero", f"invalid measurement DNA: {m.dna}"
+        assert m.entry == ENTRY_COMPOSITION, f"no model of {m.entry} for the zero DNA"
+        # every layer pattern 0, uploaded transparent by addLayers: the header exists, the data is empty
+        layers = [LayerWork(layer.name, 0, 0, True, 0, 0, 0, 0, 0, None, None) for layer in LAYERS]
+        calldata = composition_calldata([(layer.index, 0, 0) for layer in LAYERS])
+        num_bytes = 4 * m.size * m.size
+        work = composition_work(num_bytes, layers, calldata)
+        work.copy_bytes += num_bytes
+        work.memory_bytes += 64 + num_bytes
+        return work
+
+    def calibrate(self) -> None:
+        """
+        Fit the scales of the groups of unit costs to the composition and renderURI measurements by least squares,
+        then the offset of every other entry point to its measurements.
+        """
+        fitted = [m for m in self.measured if m.entry in (ENTRY_COMPOSITION, ENTRY_RENDER_URI)]
+        if len(fitted) >= len(GROUPS):
+            works = [self.measurement_work(m) for m in fitted]
+            x = np.array([[w.group_gas()[group] for group in GROUPS] for w in works])
+            y = np.array([m.gas - w.fixed_gas for m, w in zip(fitted, works)], dtype=np.float64)
+            self.scales = dict(zip(GROUPS, np.linalg.lstsq(x, y, rcond=None)[0].tolist()))
+        offsets: Dict[str, List[float]] = {}
+        for m in self.measured:
+            if m.entry in (ENTRY_COMPOSITION, ENTRY_RENDER_URI):
+                continue
+            work = self.measurement_work(m)
+            offsets.setdefault(m.entry, []).append(m.gas - self.gas(work, ENTRY_RENDER_URI))
+        self.offsets = {entry: float(np.mean(values)) for entry, values in offsets.items()}
+        self._held_out_error = None
+
+    def variable_gas(self, work: Work) -> float:
+        """
+        The calibrated gas of the work, without fixed_gas.
+        """
+        return sum(self.scales[group] * gas for group, gas in work.group_gas().items())
+
+    def gas(self, work: Work, entry: str = ENTRY_RENDER_URI) -> int:
+        return round(work.fixed_gas + self.variable_gas(work) + self.offsets.get(entry, 0.0))
+
+    def estimate(self, dna: Union[DNA, str, bytes], entry: str = ENTRY_RENDER_URI) -> Estimate:
+        """
+        Estimate the PNG size and gas of rendering a DNA through an entry point.
+        """
+        if not isinstance(dna, DNA):
+            dna = DNA.parse(dna)
+        assert entry in ENTRIES, f"unknown entry point: {entry}"
+        work = self.work(dna, entry)
+        sizes = encoding_sizes()
+        uri = sizes.image if entry == ENTRY_COMPOSITION else sizes.uri
+        return Estimate(dna.hex(), entry, sizes.png, uri, self.gas(work, entry), work, self.calibrated)
+
+    def estimate_image(self, width: int, height: int, alpha: bool = True) -> Estimate:
+        """
+        Estimate the PNG size and gas of encoding an image of the given size (ImageEncoder.encodeBase64SVG, as
+        renderURI), without compositing it. The on-chain PNG is uncompressed, so only the size matters.
+        """
+        sizes = encoding_sizes(width, height, alpha)
+        work = Work(fixed_gas=TX_GAS)
+        work.memory_bytes += sizes.image
+        add_encoding_work(work, sizes)
+        return Estimate(
+            f"{width}x{height}", ENTRY_RENDER_URI, sizes.png, sizes.uri, self.gas(work), work, self.calibrated
+        )
+
+    def calibration(self) -> List[Tuple[Measurement, int]]:
+        """
+        The measurements with the gas the model estimates for them.
+        """
+        return [(m, self.gas(self.measurement_work(m), m.entry)) for m in self.measured]
+
+    def cross_validation(self) -> List[Tuple[Measurement, Optional[int]]]:
+        """
+        The measurements with the gas the model estimates for them when calibrated without them (leave-one-out), or
+        None for a measurement the calibration cannot do without: one leaving fewer composition and renderURI
+        measurements than scales, or the only measurement of an entry point's offset.
+        """
+        scaled = (ENTRY_COMPOSITION, ENTRY_RENDER_URI)
+        held_out = []
+        for i, m in enumerate(self.measured):
+            rest = self.measured[:i] + self.measured[i + 1 :]
+            if m.entry in scaled:
+                valid = sum(r.entry in scaled for r in rest) >= len(GROUPS)
+            else:
+                valid = any(r.entry == m.entry for r in rest)
+            if not valid:
+                held_out.append((m, None))
+                continue
+            # a copy shares the layer works
+            estimator = copy.copy(self)
+            estimator.measured = rest
+            estimator.calibrate()
+            held_out.append((m, estimator.gas(estimator.measurement_work(m), m.entry)))
+        return held_out
+
+    def held_out_error(self) -> float:
+        """
+        The largest relative error of the cross-validation, infinite if a measurement cannot be held out.
+        """
+        if self._held_out_error is None:
+            errors = [abs(gas - m.gas) / m.gas if gas is not None else np.inf for m, gas in self.cross_validation()]
+            self._held_out_error = float(max(errors, default=np.inf))
+        return self._held_out_error
+
+    @property
+    def calibrated(self) -> bool:
+        """
+        Whether every measurement is estimated within CALIBRATION_TOLERANCE by a calibration without it.
+        """
+        return self.held_out_error() <= CALIBRATION_TOLERANCE
+
+    def layer_options(self) -> Dict[str, List[Tuple[float, LayerWork]]]:
+        """
+        Every (pattern, palette) option of every layer with an upper bound on its gas, most expensive first: every
+        translucent pixel blended, every storage read cold, and its memory priced at the marginal cost of memory in
+        the most expensive render measured.
+        """
+        definitions = self.assets.definitions
+        base = self.work(max_dna(definitions))
+        words = -(-base.memory_bytes // 32)
+        memory_byte_gas = (3 + 2 * words / 512) / 32
+        options = {}
+        for name in DRAW_ORDER:
+            choices = []
+            patterns = definitions.patterns.get(name, [])
+            for pattern, (_, code) in enumerate(patterns):
+                for palette in range(len(definitions.palettes.get(code, []))):
+                    layer = self.layer(name, pattern, palette)
+                    work = Work()
+                    layer.add_to(work)
+                    memory = work.memory_bytes
+                    work.memory_bytes = 0
+                    gas = self.variable_gas(work) + self.scales[GROUP_COMPUTE] * memory * memory_byte_gas
+                    choices.append((gas, layer))
+            options[name] = sorted(choices, key=lambda c: -c[0]) or [(0.0, self.layer(name, 0, 0))]
+        return options
+
+    def most_expensive(self, k: int = 10, candidates: int = 10) -> List[Estimate]:
+        """
+        The k most expensive DNAs of the trait space to render.
+
+        The combinations of layer options are enumerated in decreasing order of their upper bound (layer_options)
+        with a k-best search: each combination is reached from exactly one parent by moving one layer at or after the
+        last layer moved to its next cheaper option. Options of a layer with the same gas are searched once. The
+        k * candidates best are re-scored exactly.
+        """
+        options = self.layer_options()
+        # options of a layer costing the same gas under any layers (e.g. the palettes of a pattern drawing nothing)
+        # would give combinations that differ only in them, so they are searched as one group
+        lists: List[List[Tuple[float, List[LayerWork]]]] = []
+        for name in DRAW_ORDER:
+            groups: Dict[tuple, Tuple[float, List[LayerWork]]] = {}
+            for gas, layer in options[name]:
+                key = (gas, *(None if a is None else a.tobytes() for a in (layer.translucent, layer.drawn)))
+                groups.setdefault(key, (gas, []))[1].append(layer)
+            lists.append(list(groups.values()))
+        dna_order = {layer.name: i for i, layer in enumerate(LAYERS)}
+        start = (0,) * len(lists)
+        heap = [(-sum(choices[0][0] for choices in lists), start, 0)]
+        found = []
+        while heap and len(found) < k * candidates:
+            score, position, last = heapq.heappop(heap)
+            found.append(position)
+            for j in range(last, len(lists)):
+                i = position[j]
+                if i + 1 < len(lists[j]):
+                    child = position[:j] + (i + 1,) + position[j + 1 :]
+                    heapq.heappush(heap, (score + lists[j][i][0] - lists[j][i + 1][0], child, j))
+        estimates = []
+        for position in found:
+            groups = [choices[i][1] for choices, i in zip(lists, position)]
+            # the bound prices every storage read cold, but a palette another layer reads is warm: take the first
+            # option of each group whose palette no other layer uses
+            used = [(group[0].palette_code, group[0].palette) for group in groups]
+            data = bytearray(32)
+            for j, (name, group) in enumerate(zip(DRAW_ORDER, groups)):
+                others = set(used[:j] + used[j + 1 :])
+                layer = next((g for g in group if (g.palette_code, g.palette) not in others), group[0])
+                used[j] = (layer.palette_code, layer.palette)
+                data[2 * dna_order[name]] = layer.pattern
+                data[2 * dna_order[name] + 1] = layer.palette
+            estimates.append(self.estimate(DNA(bytes(data))))
+        return sorted(estimates, key=lambda e: -e.gas)[:k]
+
+    def trait_space(self) -> Dict[str, float]:
+        """
+        The size of the trait space and the mean and max of its upper bound gas, exact since the bound is additive:
+        the gas of rendering no layers, plus the mean and max of the options of every layer.
+        """
+        options = self.layer_options()
+        base = composition_work(encoding_sizes().image, [], _SELECTOR + bytes(32))
+        add_encoding_work(base, encoding_sizes())
+        combinations = 1
+        mean = maximum = float(self.gas(base))
+        for choices in options.values():
+            combinations *= len(choices)
+            mean += sum(gas for gas, _ in choices) / len(choices)
+            maximum += choices[0][0]
+        return {"combinations": combinations, "mean": mean, "max": maximum}
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    parser.add_argument("dna", nargs="*", help="DNAs to estimate, 0x-prefixed hex")
+    parser.add_argument("--entry", choices=ENTRIES, default=ENTRY_RENDER_URI)
+    parser.add_argument("--canvas", type=int, default=0)
+    parser.add_argument("--random", type=int, default=1000, help="number of random DNAs to score")
+    parser.add_argument("--top", type=int, default=10, help="number of most expensive DNAs of the trait space")
+    # estimate encoding an image of this size, e.g. 64x64, or of the size of this PNG file
+    parser.add_argument("--image")
+    parser.add_argument("--work", action="store_true", help="print the work of each DNA")
+    parser.add_argument("--measured", default=MEASURED_FILE, help="measurements recorded by test/010_gas")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    f = 32
+    start = time.perf_counter()
+    estimator = GasEstimator(canvas_id=args.canvas, measured=load_measurements(args.measured))
+    scales = ", ".join(f"{group} {scale:.3f}" for group, scale in estimator.scales.items())
+    print(f"calibrated in {time.perf_counter() - start:.2f}s, scales: {scales}")
+    print("measurement".ljust(f), "measured".rjust(12), "fitted".rjust(12), "error".rjust(8), "held out".rjust(12))
+    for (m, gas), (_, held_out) in zip(estimator.calibration(), estimator.cross_validation()):
+        error = f"{(held_out - m.gas) / m.gas:+.1%}" if held_out is not None else "n/a"
+        print(
+            m.name.ljust(f),
+            f"{m.gas:,}".rjust(12),
+            f"{gas:,}".rjust(12),
+            f"{(gas - m.gas) / m.gas:+.1%}".rjust(8),
+            error.rjust(12),
+        )
+    error = estimator.held_out_error()
+    if estimator.calibrated:
+        print(f"calibrated: held-out error at most {error:.1%}")
+    else:
+        reason = "a measurement cannot be held out" if np.isinf(error) else f"held-out error {error:.1%}"
+        print(
+            f"uncalibrated ({reason}, tolerance {CALIBRATION_TOLERANCE:.0%}): the estimates below are extrapolated "
+            f"from {len(estimator.measured)} measurements, record more with test/010_gas ({args.measured})"
+        )
+    note = "" if estimator.calibrated else " (uncalibrated)"
+
+    if args.image:
+        if args.image.lower().endswith(".png"):
+            ihdr = decode_file(args.image, lazy=True).ihdr
+            width, height = ihdr.width, ihdr.height
+        else:
+            width, height = (int(n) for n in args.image.split("x"))
+        estimator.estimate_image(width, height).print()
+        encoding_sizes(width, height).print()
+    for dna in args.dna:
+        estimate = estimator.estimate(dna, args.entry)
+        estimate.print()
+        if args.work:
+            estimate.work.print()
+
+    if args.random:
+        dnas = random_dnas(estimator.assets.definitions, args.random)
+        start = time.perf_counter()
+        gas = np.array([estimator.estimate(dna, args.entry).gas for dna in dnas])
+        elapsed = time.perf_counter() - start
+        print(f"{len(dnas)} random DNAs: {len(dnas) / elapsed:.0f} DNAs/s")
+        print(f"gas min/median/max{note}".ljust(f), f"{gas.min():,} / {int(np.median(gas)):,} / {gas.max():,}")
+
+    if args.top:
+        start = time.perf_counter()
+        space = estimator.trait_space()
+        top = estimator.most_expensive(args.top)
+        print(f"trait space: {space['combinations']:.3g} DNAs, scored in {time.perf_counter() - start:.2f}s")
+        print(f"upper bound mean/max{note}".ljust(f), f"{space['mean']:,.0f} / {space['max']:,.0f}")
+        for estimate in top:
+            print(estimate.dna, f"{estimate.gas:,}".rjust(12))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
+import timeit
 from dataclasses import dataclass
-from heapq import heapify, heappop, heappush
-from typing import Any, Dict, List, Optional
+from heapq import heapify, heappop, heappush, merge
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from bitstream import BitWriter
 
 
 @dataclass
@@ -52,7 +56,9 @@ def build_tree(data: List[Any]) -> Node:
     return pq[0]
 
 
-def build_encoding_table(node: Optional[Node], prefix: str = "", enc: Dict[Any, str] = {}) -> Dict[Any, str]:
+def build_encoding_table(
+    node: Optional[Node], prefix: str = "", enc: Optional[Dict[Any, str]] = None
+) -> Dict[Any, str]:
     """
     Build an encoding table for the given Huffman tree.
 
@@ -63,19 +69,25 @@ def build_encoding_table(node: Optional[Node], prefix: str = "", enc: Dict[Any,
         and the values being the corresponding Huffman codes.
     - returns: the completed encoding table.
 
-    The encoding table is constructed by recursively traversing the tree, starting at the given
-    node. If the current node is a leaf node (that is, it has no children), then it is added to
-    the encoding table with the corresponding prefix as its value. Otherwise, the function is
-    called recursively on the left and right children of the current node, with the prefix
-    argument being updated to reflect the path taken through the tree. This continues until all
-    nodes in the tree have been processed and the encoding table is complete.
-    """
-    if node is None:
-        return
-    if node.symbol is not None:
-        enc[node.symbol] = prefix
-    build_encoding_table(node.left, prefix + "0", enc)
-    build_encoding_table(node.right, prefix + "1", enc)
+    The encoding table is constructed by traversing the tree, starting at the given node. If the
+    current node is a leaf node (that is, it has no children), then it is added to the encoding
+    table with the corresponding prefix as its value. Otherwise, the left and right children of
+    the current node are visited next, with the prefix updated to reflect the path taken through
+    the tree. This continues until all nodes in the tree have been processed and the encoding
+    table is complete.
+    """
+    if enc is None:
+        enc = {}
+    # explicit stack instead of recursion, so deep (skewed) trees don't hit the recursion limit
+    stack = [(node, prefix)]
+    while stack:
+        node, prefix = stack.pop()
+        if node is None:
+            continue
+        if node.symbol is not None:
+            enc[node.symbol] = prefix
+        stack.append((node.right, prefix + "1"))
+        stack.append((node.left, prefix + "0"))
     return enc
 
 
@@ -98,11 +110,180 @@ def huffman_encode(data: List[Any]) -> Dict[Any, str]:
     return enc
 
 
+def canonical_code_lengths(freqs: Sequence[int], max_bits: int) -> List[int]:
+    """
+    Compute optimal length-limited Huffman code lengths with the package-merge algorithm.
+
+    Parameters:
+    - freqs: the frequency of each symbol, indexed by symbol. Symbols with frequency 0 get no code.
+    - max_bits: the maximum code length, e.g. 15 for the DEFLATE literal/length and distance codes
+        and 7 for the code length code.
+    - returns: the code length of each symbol (0 for unused symbols).
+
+    Package-merge solves the length-limited problem as a coin collector's problem. Each symbol is
+    a coin of weight equal to its frequency at each of the max_bits levels. Starting from the
+    deepest level, adjacent pairs of the cheapest items are packaged together and merged with the
+    coins of the next level up. The 2n - 2 cheapest items of the final list are selected, and the
+    code length of a symbol is the number of selected items (coins or packages) that contain it.
+    This takes O(n * max_bits) time after sorting the symbols by frequency.
+    """
+    lengths = [0] * len(freqs)
+    # leaves are represented by their symbol, packages by a (left, right) tuple of their contents
+    leaves: List[Tuple[int, Any]] = sorted((freq, symbol) for symbol, freq in enumerate(freqs) if freq)
+    n = len(leaves)
+    if n == 0:
+        return lengths
+    if n == 1:
+        lengths[leaves[0][1]] = 1
+        return lengths
+    assert n <= 1 << max_bits, f"{n} symbols do not fit in codes of at most {max_bits} bits"
+
+    items: List[Tuple[int, Any]] = leaves
+    for _ in range(max_bits - 1):
+        packages = [
+            (items[i][0] + items[i + 1][0], (items[i][1], items[i + 1][1])) for i in range(0, len(items) - 1, 2)
+        ]
+        items = list(merge(leaves, packages, key=lambda item: item[0]))
+
+    # count how many of the selected items each symbol appears in
+    stack = [node for _, node in items[: 2 * n - 2]]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            stack.extend(node)
+        else:
+            lengths[node] += 1
+    return lengths
+
+
+def reverse_bits(code: int, length: int) -> int:
+    """
+    Reverse the lowest `length` bits of `code`.
+    """
+    return int(format(code, f"0{length}b")[::-1], 2) if length else 0
+
+
+def canonical_codes(lengths: Sequence[int], reverse: bool = False) -> List[int]:
+    """
+    Assign the canonical Huffman codes for the given code lengths (RFC 1951, section 3.2.2).
+
+    Parameters:
+    - lengths: the code length of each symbol, indexed by symbol (0 for unused symbols).
+    - reverse: return the codes bit-reversed, as needed to pack them least significant bit first
+        into a DEFLATE stream.
+    - returns: the integer code of each symbol, indexed by symbol (0 for unused symbols).
+
+    Codes of the same length are consecutive integers in symbol order, and shorter codes
+    lexicographically precede longer codes, so the code is fully described by its lengths.
+    """
+    max_length = max(lengths, default=0)
+    bl_count = [0] * (max_length + 1)
+    for length in lengths:
+        if length:
+            bl_count[length] += 1
+
+    # find the numerical value of the smallest code for each code length
+    next_code = [0] * (max_length + 1)
+    code = 0
+    for bits in range(1, max_length + 1):
+        code = (code + bl_count[bits - 1]) << 1
+        next_code[bits] = code
+
+    # assign consecutive values to all codes of the same length
+    codes = [0] * len(lengths)
+    for symbol, length in enumerate(lengths):
+        if length:
+            code = next_code[length]
+            codes[symbol] = reverse_bits(code, length) if reverse else code
+            next_code[length] += 1
+    return codes
+
+
+def canonical_code(freqs: Sequence[int], max_bits: int, reverse: bool = False) -> Tuple[List[int], List[int]]:
+    """
+    Build a length-limited canonical Huffman code for the given symbol frequencies.
+
+    Parameters:
+    - freqs: the frequency of each symbol, indexed by symbol.
+    - max_bits: the maximum code length.
+    - reverse: return the codes bit-reversed (see canonical_codes).
+    - returns: the flat (codes, lengths) arrays, both indexed by symbol.
+    """
+    lengths = canonical_code_lengths(freqs, max_bits)
+    return canonical_codes(lengths, reverse=reverse), lengths
+
+
+def huffman_encode_bytes(data: bytes, max_bits: int = 15) -> Tuple[bytes, Dict[int, Tuple[int, int]]]:
+    """
+    Encode the given bytes with a canonical, length-limited Huffman code built from their frequencies.
+
+    Parameters:
+    - data: the bytes to encode.
+    - max_bits: the maximum code length.
+    - returns: the encoded bits packed least significant bit first as in DEFLATE (the last byte
+        zero-padded), and the encoding table mapping each byte value that occurs to its
+        (code, length), with the code in its natural most-significant-bit-first order.
+    """
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    freqs = np.bincount(symbols, minlength=256).tolist()
+    lengths = canonical_code_lengths(freqs, max_bits)
+    codes = canonical_codes(lengths)
+    reversed_codes = np.array([reverse_bits(c, l) for c, l in zip(codes, lengths)], dtype=np.int64)
+
+    writer = BitWriter()
+    writer.write_fields(reversed_codes[symbols], np.array(lengths, dtype=np.int64)[symbols])
+    table = {symbol: (codes[symbol], lengths[symbol]) for symbol in range(256) if lengths[symbol]}
+    return writer.getvalue(), table
+
+
+def benchmark_huffman_encode_bytes(size: int = 4 * 1024 * 1024) -> None:
+    """
+    Compare ways of writing the Huffman-coded bits of a multi-megabyte input: '0'/'1' string
+    concatenation (as debug.py used to), BitWriter.write per symbol, and huffman_encode_bytes,
+    which hands the whole input to BitWriter.write_fields.
+    """
+    rng = np.random.default_rng(0)
+    data = rng.geometric(0.05, size).clip(0, 255).astype(np.uint8).tobytes()
+    freqs = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256).tolist()
+    codes, lengths = canonical_code(freqs, max_bits=15, reverse=True)
+    # the bits of each code in the order they are written
+    strings = [format(c, f"0{l}b")[::-1] if l else "" for c, l in zip(codes, lengths)]
+
+    def string_concat(data: bytes) -> bytes:
+        encoded = "".join(strings[b] for b in data)
+        return bytes(int(encoded[i : i + 8][::-1], 2) for i in range(0, len(encoded), 8))
+
+    def write_per_symbol(data: bytes) -> bytes:
+        w = BitWriter()
+        for b in data:
+            w.write(codes[b], lengths[b])
+        return w.getvalue()
+
+    expected = huffman_encode_bytes(data)[0]
+    f = 22
+    print(f"{size / 1e6:.1f} MB input, {len(expected) / 1e6:.1f} MB encoded")
+    print("method".ljust(f), "seconds".ljust(f), "MB/s".ljust(f))
+    for name, fn in (
+        ("string concat", string_concat),
+        ("BitWriter.write", write_per_symbol),
+        ("huffman_encode_bytes", lambda data: huffman_encode_bytes(data)[0]),
+    ):
+        assert fn(data) == expected, name
+        seconds = min(timeit.repeat(lambda: fn(data), number=1, repeat=3))
+        print(name.ljust(f), f"{seconds:.3f}".ljust(f), f"{size / seconds / 1e6:.2f}".ljust(f))
+
+
 def main():
     data = list("Hello, World!")
     encoding = huffman_encode(data)
     print(f"Original data: {data}")
     print(f"Encoding table: {encoding}")
+    freqs = [data.count(chr(i)) for i in range(128)]
+    codes, lengths = canonical_code(freqs, max_bits=4)
+    canonical = {chr(i): format(codes[i], f"0{lengths[i]}b") for i in range(128) if lengths[i]}
+    print(f"Canonical encoding table (max 4 bits): {canonical}")
+    print()
+    benchmark_huffman_encode_bytes()
 
 
 if __name__ == "__main__":
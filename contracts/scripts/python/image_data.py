@@ -1,8 +1,144 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+from filters import FILTER_NONE, STRATEGY_FIXED, filter_scanlines
 
 RGBA = Tuple[int, int, int, int]
 
 
+def checkerboard_array(h: int, w: int) -> np.ndarray:
+    """
+    Generate a checkerboard pattern
+
+    :param h: height of the pattern
+    :param w: width of the pattern
+    :return: a uint8 array of shape (h, w, 4)
+    """
+    val = (np.arange(h * w, dtype=np.uint32).reshape(h, w) * 17).astype(np.uint8)
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    out[..., :3] = val[..., np.newaxis]
+    out[..., 3] = 255
+    return out
+
+
+def transparent_rainbow_array(h: int, w: int) -> np.ndarray:
+    """
+    Generate a transparent rainbow pattern
+
+    :return: a uint8 array of shape (h, w, 4)
+    """
+    a = np.arange(h, dtype=np.int64)[:, np.newaxis]
+    b = np.arange(w, dtype=np.int64)[np.newaxis, :]
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    out[..., 0] = ~(a & b) & 0xFF
+    out[..., 1] = (a | ~b) & 0xFF
+    out[..., 2] = (~a & b) & 0xFF
+    # the alpha channel is computed from the blue value, not the column
+    out[..., 3] = (a ^ out[..., 2]) & 0xFF
+    return out
+
+
+def with_row_prefix(
+    data: np.ndarray,
+    prefix: Union[int, np.ndarray] = FILTER_NONE,
+    strategy: str = STRATEGY_FIXED,
+    bpp: Optional[int] = None,
+) -> memoryview:
+    """
+    Lay out image rows as PNG scanlines, each filtered and prefixed with its filter type byte
+
+    :param data: an array of shape (h, w, channels) or (h, row bytes)
+    :param prefix: the filter type of every row, or an array of one per row (for the fixed strategy)
+    :param strategy: how to choose the filter type of each row (see filters.STRATEGIES)
+    :param bpp: bytes per pixel, by default the number of channels (1 for 2D data)
+    :return: a contiguous view of h * (1 + row bytes) bytes
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    rows = data.reshape(data.shape[0], int(np.prod(data.shape[1:])))
+    if bpp is None:
+        bpp = data.shape[2] if data.ndim == 3 else 1
+    return memoryview(filter_scanlines(rows, bpp, strategy, prefix).reshape(-1))
+
+
+def pack_samples(samples: np.ndarray, bit_depth: int) -> np.ndarray:
+    """
+    Pack rows of 1, 2 or 4 bit samples into bytes, leftmost sample in the high-order bits, each row padded to a whole
+    byte (as PNG scanlines)
+
+    :param samples: a uint8 array of shape (h, samples per row), each value less than 2 ** bit_depth
+    :return: a uint8 array of shape (h, ceil(samples per row * bit_depth / 8))
+    """
+    assert bit_depth in (1, 2, 4), f"invalid bit depth for packing: {bit_depth}"
+    per_byte = 8 // bit_depth
+    h, n = samples.shape
+    padded = np.zeros((h, -(-n // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :n] = samples
+    shifts = (8 - bit_depth * (np.arange(per_byte, dtype=np.uint8) + 1)).astype(np.uint8)
+    return np.bitwise_or.reduce(padded.reshape(h, -1, per_byte) << shifts, axis=2).astype(np.uint8)
+
+
+def unpack_samples(rows: np.ndarray, bit_depth: int, n: int) -> np.ndarray:
+    """
+    Unpack rows of 1, 2 or 4 bit samples, the inverse of pack_samples
+
+    :param rows: a uint8 array of shape (h, row bytes)
+    :param n: the number of samples per row
+    :return: a uint8 array of shape (h, n)
+    """
+    assert bit_depth in (1, 2, 4), f"invalid bit depth for unpacking: {bit_depth}"
+    per_byte = 8 // bit_depth
+    shifts = (8 - bit_depth * (np.arange(per_byte, dtype=np.uint8) + 1)).astype(np.uint8)
+    samples = (rows[:, :, np.newaxis] >> shifts) & ((1 << bit_depth) - 1)
+    return samples.reshape(rows.shape[0], -1)[:, :n]
+
+
+def palettize(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split an RGBA image into palette indices and a palette of its distinct colors
+
+    :param data: a uint8 array of shape (h, w, 4)
+    :return: the indices, a uint8 array of shape (h, w), and the palette, a uint8 array of shape (n, 4) in order of
+        first appearance
+    """
+    data = np.ascontiguousarray(data, dtype=np.uint8)
+    h, w, channels = data.shape
+    assert channels == 4, f"expected RGBA pixels, got {channels} channels"
+    colors = data.view(np.uint32).reshape(-1)
+    unique, first, inverse = np.unique(colors, return_index=True, return_inverse=True)
+    assert len(unique) <= 256, f"too many colors for a palette: {len(unique)}"
+    # renumber the colors in order of first appearance, so the palette does not depend on byte order
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.uint8)
+    rank[order] = np.arange(len(order))
+    palette = unique[order].view(np.uint8).reshape(-1, 4)
+    return rank[inverse].reshape(h, w), palette
+
+
+def palette_indices(data: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """
+    Map an RGBA image to the indices of its colors in a given palette
+
+    :param data: a uint8 array of shape (h, w, 4)
+    :param palette: a uint8 array of shape (n, 4), or (n, 3) for opaque colors
+    :return: the indices, a uint8 array of shape (h, w)
+    """
+    data = np.ascontiguousarray(data, dtype=np.uint8)
+    h, w, channels = data.shape
+    assert channels == 4, f"expected RGBA pixels, got {channels} channels"
+    colors = np.full((len(palette), 4), 255, dtype=np.uint8)
+    colors[:, : palette.shape[1]] = palette
+    codes = colors.view(np.uint32).reshape(-1)
+    order = np.argsort(codes, kind="stable")
+    pixels = data.view(np.uint32).reshape(-1)
+    found = np.minimum(np.searchsorted(codes[order], pixels), len(order) - 1)
+    assert (codes[order][found] == pixels).all(), "the image has colors that are not in the palette"
+    return order[found].astype(np.uint8).reshape(h, w)
+
+
+def _to_list(data: np.ndarray) -> List[List[RGBA]]:
+    return [[tuple(pixel) for pixel in row] for row in data.tolist()]
+
+
 def checkerboard(h: int, w: int) -> List[List[RGBA]]:
     """
     Generate a checkerboard pattern
@@ -11,56 +147,27 @@ def checkerboard(h: int, w: int) -> List[List[RGBA]]:
     :param w: width of the pattern
     :return: a list of lists of tuples of ints
     """
-    data = []
-
-    for a in range(h):
-        row = []
-        for b in range(w):
-            val = a * w + b
-            val = val * 16 + val
-            val = val % 256
-            row.append((val, val, val, 255))
-        data.append(row)
-    return data
+    return _to_list(checkerboard_array(h, w))
 
 
 def transparent_rainbow(h: int, w: int) -> List[List[RGBA]]:
     """
     Generate a transparent rainbow pattern
     """
-    data = []
-
-    for a in range(h):
-        row = []
-        for b in range(w):
-            r = ~(a & b) & 0xFF
-            g = (a | ~b) & 0xFF
-            b = (~a & b) & 0xFF
-            c = (a ^ b) & 0xFF
-            row.append((r, g, b, c))
+    return _to_list(transparent_rainbow_array(h, w))
 
-        data.append(row)
-    return data
 
-
-def flatten(data: List[List[RGBA]]) -> List[RGBA]:
+def flatten(data: List[List[RGBA]]) -> List[int]:
     """
     Flatten a 2D list of tuples of ints into a 1D list of ints
     """
-    flat = []
-    for row in data:
-        for col in row:
-            flat.extend(col)
-    return flat
+    return np.asarray(data, dtype=np.uint8).reshape(-1).tolist()
 
 
-def flatten_with_row_prefix(data: List[List[RGBA]], prefix: int) -> List[int]:
+def flatten_with_row_prefix(data: List[List[RGBA]], prefix: int, strategy: str = STRATEGY_FIXED) -> List[int]:
     """
     Flatten a 2D list of tuples of ints into a 1D list of ints with a prefix
+
+    Each row is filtered with the filter type given by the prefix, or chosen by the strategy (see with_row_prefix).
     """
-    flat = []
-    for row in data:
-        flat.append(prefix)
-        for col in row:
-            flat.extend(col)
-    return flat
+    return list(with_row_prefix(np.asarray(data, dtype=np.uint8), prefix, strategy))
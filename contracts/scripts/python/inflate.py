@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+DEFLATE and zlib decoding.
+
+https://www.ietf.org/rfc/rfc1951.txt
+https://www.rfc-editor.org/rfc/rfc1950
+
+Huffman codes are decoded with multi-level lookup tables, as in zlib's inflate: the next PRIMARY_BITS bits of the
+input index a primary table, which resolves every code of at most PRIMARY_BITS bits in a single lookup. Longer codes
+share a primary entry per PRIMARY_BITS-bit prefix that points to a subtable indexed by the remaining bits.
+"""
+
+import random
+import time
+import zlib
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from bitstream import BitReader, Buffer
+from checksum import adler32
+from deflate import (
+    BTYPE_DYNAMIC,
+    BTYPE_FIXED,
+    BTYPE_STORED,
+    CODE_LENGTH_ORDER,
+    DIST_BASE,
+    DIST_EXTRA,
+    END_OF_BLOCK,
+    FIXED_DISTANCE_LENGTHS,
+    FIXED_LITERAL_LENGTHS,
+    LENGTH_BASE,
+    LENGTH_EXTRA,
+)
+from huffman import canonical_codes
+from instrument import count, span
+
+# number of bits resolved by the primary lookup table
+PRIMARY_BITS: int = 9
+
+# longest possible code
+MAX_BITS: int = 15
+
+
+class HuffmanTable:
+    """
+    Multi-level lookup table for a canonical Huffman code.
+
+    Table entries are packed ints: a leaf is `symbol << 4 | length`, a link to a subtable is the negative number
+    `-(index << 4 | bits) - 1` where `bits` is the number of input bits the subtable resolves. Entries not covered by
+    any code (incomplete codes) are None.
+    """
+
+    def __init__(self, lengths: Sequence[int], primary_bits: int = PRIMARY_BITS):
+        self.lengths: List[int] = list(lengths)
+        self.max_length: int = max(lengths, default=0)
+        self.primary_bits: int = min(primary_bits, self.max_length) or 1
+        self.primary: List[Optional[int]] = [None] * (1 << self.primary_bits)
+        self.subtables: List[List[Optional[int]]] = []
+
+        codes = canonical_codes(self.lengths, reverse=True)
+        pb = self.primary_bits
+        pmask = (1 << pb) - 1
+
+        # size each subtable for the longest code sharing its primary prefix
+        sub_bits = {}
+        for symbol, length in enumerate(self.lengths):
+            if length > pb:
+                prefix = codes[symbol] & pmask
+                sub_bits[prefix] = max(sub_bits.get(prefix, 0), length - pb)
+        for prefix, bits in sorted(sub_bits.items()):
+            self.primary[prefix] = -((len(self.subtables) << 4) | bits) - 1
+            self.subtables.append([None] * (1 << bits))
+
+        for symbol, length in enumerate(self.lengths):
+            if not length:
+                continue
+            code = codes[symbol]
+            entry = (symbol << 4) | length
+            if length <= pb:
+                # every index whose low `length` bits are the code
+                for index in range(code, 1 << pb, 1 << length):
+                    self.primary[index] = entry
+            else:
+                link = -self.primary[code & pmask] - 1
+                subtable = self.subtables[link >> 4]
+                rest = length - pb
+                for index in range(code >> pb, len(subtable), 1 << rest):
+                    subtable[index] = (symbol << 4) | rest
+
+    def decode(self, reader: BitReader) -> int:
+        """
+        Read one symbol.
+        """
+        bits = reader.peek(self.max_length)
+        entry = self.primary[bits & ((1 << self.primary_bits) - 1)]
+        if entry is None:
+            raise ValueError("invalid Huffman code")
+        if entry >= 0:
+            reader.skip(entry & 0xF)
+            return entry >> 4
+        link = -entry - 1
+        subtable = self.subtables[link >> 4]
+        entry = subtable[(bits >> self.primary_bits) & ((1 << (link & 0xF)) - 1)]
+        if entry is None:
+            raise ValueError("invalid Huffman code")
+        reader.skip(self.primary_bits + (entry & 0xF))
+        return entry >> 4
+
+
+FIXED_LITERAL_TABLE: HuffmanTable = HuffmanTable(FIXED_LITERAL_LENGTHS)
+FIXED_DISTANCE_TABLE: HuffmanTable = HuffmanTable(FIXED_DISTANCE_LENGTHS)
+
+
+@dataclass
+class BlockTrace:
+    """
+    What inflate() saw in one block, as reported to the trace hook.
+    """
+
+    # index of the block in the stream
+    index: int
+    # bit offset of the block header in the input
+    bit_offset: int
+    bfinal: int
+    btype: int
+    # number of bytes the block produced
+    output_size: int = 0
+    literals: int = 0
+    matches: int = 0
+    # total length of all matches
+    match_bytes: int = 0
+    # dynamic blocks only
+    hlit: int = 0
+    hdist: int = 0
+    hclen: int = 0
+    code_length_lengths: List[int] = field(default_factory=list)
+    literal_lengths: List[int] = field(default_factory=list)
+    distance_lengths: List[int] = field(default_factory=list)
+
+    def print(self):
+        f = 18
+        print(f"block {self.index}")
+        print("bit_offset".ljust(f), self.bit_offset)
+        print("bfinal".ljust(f), self.bfinal)
+        print("btype".ljust(f), self.btype)
+        if self.btype == BTYPE_DYNAMIC:
+            print("hlit".ljust(f), self.hlit)
+            print("hdist".ljust(f), self.hdist)
+            print("hclen".ljust(f), self.hclen)
+            print("cl_lengths".ljust(f), self.code_length_lengths)
+            print("lit_lengths".ljust(f), {s: l for s, l in enumerate(self.literal_lengths) if l})
+            print("dist_lengths".ljust(f), {s: l for s, l in enumerate(self.distance_lengths) if l})
+        print("output_size".ljust(f), self.output_size)
+        print("literals".ljust(f), self.literals)
+        print("matches".ljust(f), self.matches)
+        print("match_bytes".ljust(f), self.match_bytes)
+
+
+Trace = Callable[[BlockTrace], None]
+
+
+def _read_dynamic_tables(reader: BitReader, block: BlockTrace) -> Tuple[HuffmanTable, HuffmanTable]:
+    """
+    Read the code length code and the literal/length and distance code lengths of a dynamic block.
+    """
+    hlit = reader.read(5) + 257
+    hdist = reader.read(5) + 1
+    hclen = reader.read(4) + 4
+    cl_lengths = [0] * 19
+    for symbol in CODE_LENGTH_ORDER[:hclen]:
+        cl_lengths[symbol] = reader.read(3)
+    cl_table = HuffmanTable(cl_lengths, primary_bits=7)
+
+    lengths: List[int] = []
+    while len(lengths) < hlit + hdist:
+        symbol = cl_table.decode(reader)
+        if symbol < 16:
+            lengths.append(symbol)
+        elif symbol == 16:
+            if not lengths:
+                raise ValueError("code length repeat with no previous length")
+            lengths.extend([lengths[-1]] * (3 + reader.read(2)))
+        elif symbol == 17:
+            lengths.extend([0] * (3 + reader.read(3)))
+        else:
+            lengths.extend([0] * (11 + reader.read(7)))
+    if len(lengths) > hlit + hdist:
+        raise ValueError("code lengths overflow HLIT + HDIST")
+    if lengths[END_OF_BLOCK] == 0:
+        raise ValueError("no code for the end-of-block symbol")
+
+    block.hlit = hlit
+    block.hdist = hdist
+    block.hclen = hclen
+    block.code_length_lengths = cl_lengths
+    block.literal_lengths = lengths[:hlit]
+    block.distance_lengths = lengths[hlit:]
+    return HuffmanTable(lengths[:hlit]), HuffmanTable(lengths[hlit:])
+
+
+def _inflate_huffman(
+    reader: BitReader, out: bytearray, lit_table: HuffmanTable, dist_table: HuffmanTable, block: BlockTrace
+) -> None:
+    """
+    Decode the literal/length and distance symbols of a Huffman-coded block up to its end-of-block symbol.
+    """
+    literals = matches = match_bytes = 0
+    while True:
+        symbol = lit_table.decode(reader)
+        if symbol < 256:
+            out.append(symbol)
+            literals += 1
+            continue
+        if symbol == END_OF_BLOCK:
+            break
+        symbol -= 257
+        if symbol >= 29:
+            raise ValueError(f"invalid length symbol: {symbol + 257}")
+        length = LENGTH_BASE[symbol] + reader.read(LENGTH_EXTRA[symbol])
+        symbol = dist_table.decode(reader)
+        if symbol >= 30:
+            raise ValueError(f"invalid distance symbol: {symbol}")
+        distance = DIST_BASE[symbol] + reader.read(DIST_EXTRA[symbol])
+        if distance > len(out):
+            raise ValueError(f"distance {distance} too far back ({len(out)} bytes of output)")
+        start = len(out) - distance
+        if length <= distance:
+            out += out[start : start + length]
+        else:
+            # the match overlaps the bytes it produces: repeat the last `distance` bytes
+            pattern = out[start:]
+            out += (pattern * (length // distance + 1))[:length]
+        matches += 1
+        match_bytes += length
+    block.literals = literals
+    block.matches = matches
+    block.match_bytes = match_bytes
+
+
+def inflate_reader(reader: BitReader, trace: Optional[Trace] = None) -> bytes:
+    """
+    Decode a raw DEFLATE stream from a bit reader, leaving the reader just past the final block.
+    """
+    out = bytearray()
+    index = 0
+    while True:
+        block = BlockTrace(index=index, bit_offset=reader.bits_consumed, bfinal=reader.read(1), btype=reader.read(2))
+        start = len(out)
+        if block.btype == BTYPE_STORED:
+            reader.align()
+            length = reader.read(16)
+            nlength = reader.read(16)
+            if length != ~nlength & 0xFFFF:
+                raise ValueError(f"stored block LEN {length:#06x} does not match NLEN {nlength:#06x}")
+            out += reader.read_bytes(length)
+            block.literals = length
+        elif block.btype == BTYPE_FIXED:
+            _inflate_huffman(reader, out, FIXED_LITERAL_TABLE, FIXED_DISTANCE_TABLE, block)
+        elif block.btype == BTYPE_DYNAMIC:
+            with span("huffman_build"):
+                lit_table, dist_table = _read_dynamic_tables(reader, block)
+            _inflate_huffman(reader, out, lit_table, dist_table, block)
+        else:
+            raise ValueError("invalid block type 11")
+        block.output_size = len(out) - start
+        count("inflate.blocks")
+        if trace is not None:
+            trace(block)
+        index += 1
+        if block.bfinal:
+            return bytes(out)
+
+
+def inflate(data: Buffer, trace: Optional[Trace] = None) -> bytes:
+    """
+    Decode a raw DEFLATE stream.
+
+    :param data: The compressed data.
+    :param trace: Called with a BlockTrace after each block is decoded.
+    :return: The decompressed data.
+    """
+    return inflate_reader(BitReader(data), trace)
+
+
+def zlib_decompress(data: Buffer, trace: Optional[Trace] = None) -> bytes:
+    """
+    Decode a zlib stream: check the header, inflate the DEFLATE blocks and verify the Adler-32 trailer.
+    """
+    mv = memoryview(data).cast("B")
+    if len(mv) < 6:
+        raise ValueError("zlib stream too short")
+    cmf, flg = mv[0], mv[1]
+    if cmf & 0x0F != 8:
+        raise ValueError(f"unsupported compression method: {cmf & 0x0F}")
+    if (cmf << 8 | flg) % 31:
+        raise ValueError("zlib header check bits (FCHECK) are wrong")
+    if flg & 0x20:
+        raise ValueError("preset dictionaries (FDICT) are not supported")
+
+    reader = BitReader(mv, pos=2)
+    with span("inflate"):
+        out = inflate_reader(reader, trace)
+    count("inflate.bytes", len(out))
+    pos = reader.byte_position
+    expected = bytes(mv[pos : pos + 4])
+    with span("adler32"):
+        actual = adler32(out)
+    if expected != actual:
+        raise ValueError(f"adler32 computed: {actual.hex(' ')} != {expected.hex(' ')}")
+    return out
+
+
+def fuzz(iterations: int = 500, seed: int = 0) -> None:
+    """
+    Check zlib_decompress against zlib on random inputs compressed by zlib at every level and strategy.
+
+    The inputs are drawn from the seed alone, so a failing iteration is reproduced by running again with its seed.
+    """
+    rng = random.Random(seed)
+    strategies = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_HUFFMAN_ONLY, zlib.Z_RLE, zlib.Z_FIXED]
+    start = time.perf_counter()
+    total = 0
+    for i in range(iterations):
+        size = rng.choice([0, 1, rng.randrange(2, 300), rng.randrange(300, 70000)])
+        kind = rng.randrange(4)
+        if kind == 0:
+            data = rng.randbytes(size)
+        elif kind == 1:
+            # few distinct symbols, long runs
+            data = bytes(rng.choice(b"\x00\x00\x00\xff\x11") for _ in range(size))
+        elif kind == 2:
+            # repeated rows with small differences, like scanlines
+            row = rng.randbytes(rng.randrange(1, 200))
+            data = b"".join(bytes([rng.randrange(5)]) + row for _ in range(size // (len(row) + 1) + 1))[:size]
+        else:
+            data = bytes(rng.randrange(256) >> rng.randrange(8) for _ in range(size))
+        compressor = zlib.compressobj(rng.randrange(10), zlib.DEFLATED, 15, 9, rng.choice(strategies))
+        compressed = compressor.compress(data) + compressor.flush()
+        assert zlib_decompress(compressed) == data, f"seed {seed}, iteration {i}: mismatch"
+        total += len(data)
+    elapsed = time.perf_counter() - start
+    print(f"{iterations} streams, {total / 1e6:.2f} MB in {elapsed:.2f}s: {total / 1e6 / elapsed:.2f} MB/s")
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    # PNG files whose IDAT stream to trace block by block
+    parser.add_argument("filenames", nargs="*")
+    # check against zlib on a random corpus of this many streams
+    parser.add_argument("--fuzz", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main() -> None:
+    from decode import decode_file
+
+    args = parse_args()
+    for filename in args.filenames:
+        print(filename)
+        data = zlib_decompress(decode_file(filename).idat_data(), trace=BlockTrace.print)
+        print("decompressed_size".ljust(18), len(data))
+    if args.fuzz:
+        fuzz(args.fuzz, args.seed)
+
+
+if __name__ == "__main__":
+    main()
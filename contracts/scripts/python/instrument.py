@@ -0,0 +1,167 @@
+"""
+Lightweight instrumentation of the PNG pipelines: timed spans and counters.
+
+    with span("inflate"):
+        ...
+    count("crc32.bytes", len(data))
+
+Instrumentation is off unless a recording is active, in which case span() returns a shared no-op context manager and
+count() returns immediately. Inside `with recording() as profile:` spans nest, and are aggregated by their stack of
+names (e.g. decode_png;pixels;unfilter) over everything run during the recording, so a batch of files gives one
+profile. A profile exports to JSON, or to the folded-stack format of flamegraph.pl and speedscope:
+
+    decode_png;pixels;unfilter 1234
+
+one line per stack, with the self time in microseconds.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Stack = Tuple[str, ...]
+
+
+@dataclass
+class SpanStats:
+    calls: int = 0
+    total_ns: int = 0
+
+
+class Profile:
+    """
+    Span times and counters aggregated over a recording.
+    """
+
+    def __init__(self) -> None:
+        self.spans: Dict[Stack, SpanStats] = {}
+        self.counters: Dict[str, int] = {}
+        self._stack: List[str] = []
+
+    def self_ns(self, stack: Stack) -> int:
+        """
+        The time in a span not spent in the spans nested in it.
+        """
+        children = sum(s.total_ns for k, s in self.spans.items() if len(k) == len(stack) + 1 and k[:-1] == stack)
+        return self.spans[stack].total_ns - children
+
+    def to_dict(self) -> dict:
+        return {
+            "spans": [
+                {
+                    "stack": list(stack),
+                    "calls": stats.calls,
+                    "total_us": stats.total_ns / 1e3,
+                    "self_us": self.self_ns(stack) / 1e3,
+                }
+                for stack, stats in sorted(self.spans.items())
+            ],
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_folded(self) -> str:
+        """
+        The spans in folded-stack format, with self times in whole microseconds.
+        """
+        lines = []
+        for stack in sorted(self.spans):
+            us = round(self.self_ns(stack) / 1e3)
+            if us > 0:
+                lines.append(f"{';'.join(stack)} {us}")
+        return "\n".join(lines) + "\n"
+
+    def print(self):
+        f = 40
+        print("span".ljust(f), "calls".rjust(10), "total ms".rjust(10), "self ms".rjust(10))
+        for stack, stats in sorted(self.spans.items()):
+            name = "  " * (len(stack) - 1) + stack[-1]
+            print(
+                name.ljust(f),
+                str(stats.calls).rjust(10),
+                f"{stats.total_ns / 1e6:.2f}".rjust(10),
+                f"{self.self_ns(stack) / 1e6:.2f}".rjust(10),
+            )
+        for name, value in sorted(self.counters.items()):
+            print(name.ljust(f), str(value).rjust(10))
+
+
+class _Span:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: Profile, name: str):
+        self.profile: Profile = profile
+        self.name: str = name
+        self.start: int = 0
+
+    def __enter__(self) -> "_Span":
+        self.profile._stack.append(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args) -> None:
+        elapsed = time.perf_counter_ns() - self.start
+        profile = self.profile
+        stack = tuple(profile._stack)
+        profile._stack.pop()
+        stats = profile.spans.get(stack)
+        if stats is None:
+            stats = profile.spans[stack] = SpanStats()
+        stats.calls += 1
+        stats.total_ns += elapsed
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+# the active recording, if any
+_profile: Optional[Profile] = None
+
+
+def enabled() -> bool:
+    return _profile is not None
+
+
+def span(name: str):
+    """
+    A context manager timing the code it wraps, under the spans it is nested in.
+    """
+    if _profile is None:
+        return _NULL_SPAN
+    return _Span(_profile, name)
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Add n to a counter.
+    """
+    if _profile is None:
+        return
+    _profile.counters[name] = _profile.counters.get(name, 0) + n
+
+
+@contextmanager
+def recording(profile: Optional[Profile] = None) -> Iterator[Profile]:
+    """
+    Record spans and counters into a profile (a new one by default) while the block runs.
+    """
+    global _profile
+    previous = _profile
+    _profile = profile if profile is not None else Profile()
+    try:
+        yield _profile
+    finally:
+        _profile = previous
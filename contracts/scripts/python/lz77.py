@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+LZ77 match finding for DEFLATE.
+
+https://www.ietf.org/rfc/rfc1951.txt (section 4)
+
+The input is turned into a sequence of tokens, each either a literal byte or a <length, distance> pair meaning "copy
+`length` bytes starting `distance` bytes back", with 3 <= length <= 258 and 1 <= distance <= 32768.
+
+As in zlib, candidate matches are found through hash chains: the 3 bytes at every position are hashed, `head[h]` is
+the most recent position with hash h and `prev[i]` the previous position with the same hash as position i. Walking a
+chain visits earlier positions starting with the same 3 bytes (modulo collisions), nearest first. The level sets how
+hard to look, with the parameters of zlib's configuration table:
+
+    good_length  reduce the chain walk to a quarter once the previous match is at least this long
+    max_lazy     greedy levels: only insert match positions into the chains for matches up to this long
+                 lazy levels: only look for a better match at the next position if the match is shorter than this
+    nice_length  stop the chain walk as soon as a match is at least this long
+    max_chain    maximum number of chain links to follow
+
+Levels 1-3 take the longest match found at each position (greedy). Levels 4-9 defer a match by one byte if the next
+position has a longer one (lazy matching).
+"""
+
+import glob
+import os
+import time
+import zlib
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+MIN_MATCH: int = 3
+MAX_MATCH: int = 258
+WINDOW_SIZE: int = 32768
+
+# a 3 byte match further back than this costs more than 3 literals
+TOO_FAR: int = 4096
+
+HASH_BITS: int = 15
+HASH_SHIFT: int = 5
+HASH_MASK: int = (1 << HASH_BITS) - 1
+
+
+class Config(NamedTuple):
+    good_length: int
+    max_lazy: int
+    nice_length: int
+    max_chain: int
+    lazy: bool
+
+
+# zlib's configuration_table
+LEVELS: Tuple[Config, ...] = (
+    Config(0, 0, 0, 0, False),
+    Config(4, 4, 8, 4, False),
+    Config(4, 5, 16, 8, False),
+    Config(4, 6, 32, 32, False),
+    Config(4, 4, 16, 16, True),
+    Config(8, 16, 32, 32, True),
+    Config(8, 16, 128, 128, True),
+    Config(8, 32, 128, 256, True),
+    Config(32, 128, 258, 1024, True),
+    Config(32, 258, 258, 4096, True),
+)
+
+# Tokens are two parallel arrays: `values` and `distances`. A token with distance 0 is the literal byte `value`,
+# otherwise it is a match of length `value`.
+Tokens = Tuple[np.ndarray, np.ndarray]
+
+
+def hashes(data: bytes) -> List[int]:
+    """
+    The hash of the 3 bytes at every position but the last two.
+
+    This is zlib's rolling UPDATE_HASH, h = ((h << HASH_SHIFT) ^ c) & HASH_MASK, unrolled: with a 15 bit hash and a
+    shift of 5 only the last 3 bytes remain in h, so all positions are hashed at once.
+    """
+    d = np.frombuffer(data, dtype=np.uint8).astype(np.int32)
+    if len(d) < MIN_MATCH:
+        return []
+    h = (d[:-2] << (2 * HASH_SHIFT)) ^ (d[1:-1] << HASH_SHIFT) ^ d[2:]
+    return (h & HASH_MASK).tolist()
+
+
+def _match_length(data: bytes, i: int, j: int, limit: int) -> int:
+    """
+    The length of the common prefix of data[i:] and data[j:], up to `limit`.
+    """
+    n = 0
+    while n + 16 <= limit and data[i + n : i + n + 16] == data[j + n : j + n + 16]:
+        n += 16
+    while n < limit and data[i + n] == data[j + n]:
+        n += 1
+    return n
+
+
+def literals(data: bytes) -> Tokens:
+    """
+    Tokens for the data without any matches.
+    """
+    values = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    return values, np.zeros(len(values), dtype=np.int64)
+
+
+def lz77(data: bytes, level: int = 6) -> Tokens:
+    """
+    Find LZ77 matches in the data.
+
+    :param data: The data to compress.
+    :param level: 0 (no matches) to 9 (slowest, best matches), as in zlib.
+    :return: The tokens, see Tokens.
+    """
+    assert 0 <= level <= 9, f"invalid level: {level}"
+    if level == 0:
+        return literals(data)
+    good_length, max_lazy, nice_length, max_chain, lazy = LEVELS[level]
+    data = bytes(data)
+    n = len(data)
+    hash_of = hashes(data)
+    head = [-1] * (1 << HASH_BITS)
+    prev = [-1] * n
+    # positions below `inserted` are in the hash chains
+    inserted = 0
+
+    def insert(upto: int) -> None:
+        nonlocal inserted
+        for k in range(inserted, min(upto, n - 2)):
+            h = hash_of[k]
+            prev[k] = head[h]
+            head[h] = k
+        inserted = max(inserted, upto)
+
+    def longest_match(i: int, prev_length: int) -> Tuple[int, int]:
+        """
+        The longest match at position i, longer than prev_length, as (length, distance).
+        """
+        limit = min(MAX_MATCH, n - i)
+        if limit < MIN_MATCH:
+            return 0, 0
+        chain = max_chain >> 2 if prev_length >= good_length else max_chain
+        best_length = prev_length
+        best_distance = 0
+        j = head[hash_of[i]]
+        while j >= 0 and i - j <= WINDOW_SIZE and chain > 0:
+            # a longer match must differ from the best one in its last byte
+            if best_length < limit and data[j + best_length] == data[i + best_length]:
+                length = _match_length(data, i, j, limit)
+                if length > best_length:
+                    best_length = length
+                    best_distance = i - j
+                    if length >= nice_length or length == limit:
+                        break
+            j = prev[j]
+            chain -= 1
+        if best_distance == 0 or (best_length == MIN_MATCH and best_distance > TOO_FAR):
+            return 0, 0
+        return best_length, best_distance
+
+    values: List[int] = []
+    distances: List[int] = []
+    i = 0
+    # lazy matching: the match found at i on the previous iteration
+    pending = None
+    while i < n:
+        if pending is not None:
+            length, distance = pending
+            pending = None
+        else:
+            insert(i)
+            length, distance = longest_match(i, MIN_MATCH - 1)
+        if lazy and length and length < max_lazy and i + 1 < n:
+            insert(i + 1)
+            next_length, next_distance = longest_match(i + 1, length)
+            if next_length > length:
+                values.append(data[i])
+                distances.append(0)
+                pending = next_length, next_distance
+                i += 1
+                continue
+        if length:
+            values.append(length)
+            distances.append(distance)
+            if lazy or length <= max_lazy:
+                insert(i + length)
+            else:
+                # zlib's deflate_fast: only the start of a long match is inserted
+                insert(i + 1)
+                inserted = i + length
+            i += length
+        else:
+            values.append(data[i])
+            distances.append(0)
+            i += 1
+    return np.array(values, dtype=np.int64), np.array(distances, dtype=np.int64)
+
+
+def expand(tokens: Tokens) -> bytes:
+    """
+    Decode tokens back to the data.
+    """
+    out = bytearray()
+    for value, distance in zip(*(t.tolist() for t in tokens)):
+        if distance == 0:
+            out.append(value)
+        else:
+            for _ in range(value):
+                out.append(out[-distance])
+    return bytes(out)
+
+
+def benchmark_lz77(paths: List[str]) -> None:
+    """
+    Compress the scanlines of the given PNG files at every level, with zlib for reference.
+    """
+    from deflate import BTYPE_DYNAMIC, zlib_compress
+    from inflate import zlib_decompress
+
+    corpus = [zlib.decompress(_idat_data(path)) for path in paths]
+    total = sum(len(data) for data in corpus)
+    print(f"{len(corpus)} files, {total} bytes of scanlines")
+    print("level".ljust(8), "ours".rjust(10), "ratio".rjust(8), "MB/s".rjust(8), "zlib".rjust(10), "ratio".rjust(8))
+    for level in range(10):
+        size = 0
+        start = time.perf_counter()
+        for data in corpus:
+            compressed = zlib_compress(data, BTYPE_DYNAMIC, level)
+            size += len(compressed)
+        elapsed = time.perf_counter() - start
+        for data in corpus[:5]:
+            assert zlib_decompress(zlib_compress(data, BTYPE_DYNAMIC, level)) == data
+        zsize = sum(len(zlib.compress(data, level)) for data in corpus)
+        print(
+            str(level).ljust(8),
+            str(size).rjust(10),
+            f"{total / size:.2f}".rjust(8),
+            f"{total / 1e6 / elapsed:.2f}".rjust(8),
+            str(zsize).rjust(10),
+            f"{total / zsize:.2f}".rjust(8),
+        )
+
+
+def _idat_data(path: str) -> bytes:
+    from decode import decode_file
+
+    return bytes(decode_file(path).idat_data())
+
+
+def main() -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(here, "../../../assets/assets/spritesheets/**/*.png"), recursive=True))
+    benchmark_lz77(paths[::16])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Palette files (assets/assets/palettes).
+
+Palettes are JASC-PAL files of RGBA colors, grouped in one directory per palette code, named "<code>:<name>". A
+"<name>.pal.indirect" file stands for all the palettes in palettes/base/<name> (see
+assets/src/render/read/PaletteFileReader.ts).
+
+    JASC-PAL
+    0100
+    8
+    0 0 0 0
+    47 18 33 255
+    ...
+
+The first color is always transparent (#00000000) and the second, if any, opaque black (#000000ff).
+"""
+
+import glob
+import os
+from typing import Dict, List
+
+import numpy as np
+from patterns import PATTERNS_DIR
+
+PALETTES_DIR: str = os.path.normpath(os.path.join(PATTERNS_DIR, "..", "palettes"))
+
+
+def decode_pal(contents: str) -> np.ndarray:
+    """
+    Decode a JASC-PAL palette.
+
+    :param contents: The text of the .pal file.
+    :return: The colors, as uint8 of shape (n, 4).
+    """
+    lines = [line.replace("\r", "") for line in contents.split("\n")]
+    lines = [line for line in lines if line]
+    assert lines[0] == "JASC-PAL", f"invalid palette file line #1 (expected 'JASC-PAL' but got '{lines[0]}')"
+    assert lines[1] == "0100", "invalid palette file line #2 (expected '0100')"
+    n = int(lines[2])
+    assert len(lines) == 3 + n, f"invalid palette file (expected {n} colors, got {len(lines) - 3})"
+    colors = np.array([[int(c) for c in line.split(" ")] for line in lines[3:]], dtype=np.int64).reshape(n, 4)
+    assert ((colors >= 0) & (colors <= 255)).all(), "invalid palette file (expected colors RRR GGG BBB AAA)"
+    colors = colors.astype(np.uint8)
+    assert n == 0 or colors[0].tolist() == [0, 0, 0, 0], "invalid palette file (first color should be #00000000)"
+    assert n <= 1 or colors[1].tolist() == [0, 0, 0, 255], "invalid palette file (second color should be #000000ff)"
+    return colors
+
+
+def read_palette_file(filename: str) -> np.ndarray:
+    with open(filename, "r") as f:
+        return decode_pal(f.read())
+
+
+def palette_dir(code: int, palettes_dir: str = PALETTES_DIR) -> str:
+    """
+    The directory of the palettes of a palette code.
+    """
+    dirs = glob.glob(os.path.join(palettes_dir, f"{code}:*"))
+    assert len(dirs) == 1, f"expected one palette directory for palette code {code}, found {len(dirs)}"
+    return dirs[0]
+
+
+def read_palettes(code: int, palettes_dir: str = PALETTES_DIR) -> Dict[str, np.ndarray]:
+    """
+    All the palettes of a palette code, by name, with indirect palettes resolved.
+    """
+    directory = palette_dir(code, palettes_dir)
+    paths: List[str] = glob.glob(os.path.join(directory, "*.pal"))
+    for indirect in glob.glob(os.path.join(directory, "*.pal.indirect")):
+        ref = os.path.basename(indirect)[: -len(".pal.indirect")]
+        found = glob.glob(os.path.join(palettes_dir, "base", ref, "*.pal"))
+        assert found, f"no indirect palette files found for {ref}"
+        paths += found
+    return {os.path.basename(path)[: -len(".pal")]: read_palette_file(path) for path in sorted(paths)}
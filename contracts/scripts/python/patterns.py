@@ -0,0 +1,67 @@
+"""
+Pattern files (assets/assets/patterns).
+
+A pattern is a 128x128 spritesheet of palette indices, one byte per pixel, stored as JSON with one hex string per
+scanline (see assets/src/render/read/PatternFileReader.ts).
+"""
+
+import glob
+import json
+import os
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+PATTERNS_DIR: str = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "assets", "assets", "patterns")
+)
+
+
+@dataclass
+class PatternFile:
+    layer: str
+    pattern_name: str
+    palette_code: int
+    width: int
+    height: int
+    # palette indices, shape (height, width)
+    indices: np.ndarray
+
+    @staticmethod
+    def parse(contents: dict) -> "PatternFile":
+        width = contents["imageProperties"]["size"]["width"]
+        height = contents["imageProperties"]["size"]["height"]
+        scanlines = contents["scanlines"]
+        assert len(scanlines) == height, f"expected {height} scanlines, got {len(scanlines)}"
+        for i, scanline in enumerate(scanlines):
+            assert len(scanline) == 2 + 2 * width, f"invalid scanline[{i}] length: {len(scanline)}"
+        indices = np.frombuffer(bytes.fromhex("".join(s[2:] for s in scanlines)), dtype=np.uint8)
+        return PatternFile(
+            layer=contents["layer"],
+            pattern_name=contents["patternName"],
+            palette_code=contents["paletteCode"],
+            width=width,
+            height=height,
+            indices=indices.reshape(height, width),
+        )
+
+    def print(self):
+        f = 18
+        print("layer".ljust(f), self.layer)
+        print("pattern_name".ljust(f), self.pattern_name)
+        print("palette_code".ljust(f), self.palette_code)
+        print("size".ljust(f), f"{self.width}x{self.height}")
+        print("colors".ljust(f), len(np.unique(self.indices)))
+
+
+def read_pattern_file(filename: str) -> PatternFile:
+    with open(filename, "r") as f:
+        return PatternFile.parse(json.load(f))
+
+
+def pattern_paths(layer: str = "*", patterns_dir: str = PATTERNS_DIR) -> List[str]:
+    """
+    The pattern files of a layer (by default of every layer), sorted.
+    """
+    return sorted(glob.glob(os.path.join(patterns_dir, layer, "*.json")))
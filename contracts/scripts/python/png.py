@@ -0,0 +1,522 @@
+"""
+PNG encoding.
+
+A Python port of PNG.sol (PNG.encodePNG), used to predict on-chain output offline. With the default compression level
+0 the output is byte-identical to the contract: a single zlib stream of stored blocks, with filter type 0 on every
+scanline. Higher levels compress the same scanlines with LZ77 matching (lz77.py) and Huffman-coded blocks instead.
+
+The chunk CRCs and the zlib trailer are computed with zlib.crc32 and zlib.adler32, which are a few hundred times
+faster than the pure-Python checksum.py on an avatar's 4 KB of scanlines. checksum.py stays the reference
+implementation: debug.py checks the encoder's trailer and IDAT CRC against it.
+
+http://www.libpng.org/pub/png/spec/1.2/PNG-Contents.html
+"""
+
+import zlib
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+from checksum import adler32_combine
+from deflate import BTYPE_DYNAMIC, BTYPE_STORED, MAX_STORED_BLOCK_SIZE, deflate, zlib_flevel, zlib_header
+from filters import FILTER_NONE, FILTER_TYPES, STRATEGIES, STRATEGY_FIXED, filter_scanlines
+from image_data import pack_samples, palettize
+from instrument import count, span
+
+# The PNG signature is a fixed eight-byte sequence:
+# 89 50 4e 47 0d 0a 1a 0a
+PNG_SIGNATURE: bytes = b"\x89PNG\r\n\x1a\n"
+
+# The IEND chunk marks the end of the PNG datastream.
+# It contains no data.
+#
+# The IEND chunk is always equal to 12 bytes
+# 00 00 00 00 49 45 4e 44 ae 42 60 82
+IEND: bytes = bytes.fromhex("0000000049454e44ae426082")
+
+
+def encode_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """
+    Encode a chunk: length, type, data and the CRC-32 of the type and data.
+    """
+    with span("crc32"):
+        crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    count("crc32.bytes", 4 + len(data))
+    return len(data).to_bytes(4, byteorder="big") + chunk_type + data + crc.to_bytes(4, byteorder="big")
+
+
+def min_bit_depth(num_colors: int) -> int:
+    """
+    The smallest indexed-color bit depth (1, 2, 4 or 8) for a palette of num_colors colors.
+    """
+    assert 1 <= num_colors <= 256, f"invalid number of palette colors: {num_colors}"
+    for bit_depth in (1, 2, 4, 8):
+        if num_colors <= 1 << bit_depth:
+            return bit_depth
+
+
+def encode_indexed(data: np.ndarray, **kwargs) -> bytes:
+    """
+    Encode an RGBA image of at most 256 colors as indexed-color, with a palette of its colors at the smallest bit depth.
+
+    :param data: A uint8 array of shape (h, w, 4).
+    :param kwargs: Encoder settings, as for PNG.
+    """
+    indices, palette = palettize(data)
+    h, w = indices.shape
+    return PNG(w, h, bit_depth=min_bit_depth(len(palette)), palette=palette, **kwargs).bytes(indices)
+
+
+class PNG:
+    """
+    Encoder for 8 bit RGB or RGBA images, and indexed-color images.
+
+    With a palette, the image is indexed-color (color type 3): the raw image data is one palette index per pixel, the
+    palette is written as a PLTE chunk and its alpha values, if any are below 255, as a tRNS chunk. Indices are packed
+    1, 2 or 4 to a byte at the lower bit depths.
+
+    :param width: The width of the image, in pixels.
+    :param height: The height of the image, in pixels.
+    :param alpha: Whether the image has an alpha channel.
+    :param bit_depth: The bit depth, 8 for RGB and RGBA (as on-chain), 1, 2, 4 or 8 for indexed-color.
+    :param compression_level: 0 stores the scanlines uncompressed, as on-chain. Levels 1-9 are LZ77 levels, as in zlib.
+    :param filter_type: The filter type applied to every scanline, 0 (None) on-chain.
+    :param filter_strategy: How to choose the filter type of each scanline (see filters.STRATEGIES). The default applies
+        filter_type to every scanline.
+    :param btype: Override the DEFLATE block type (deflate.BTYPE_STORED, BTYPE_FIXED or BTYPE_DYNAMIC) otherwise chosen
+        by the compression level.
+    :param palette: The palette of an indexed-color image, a uint8 array of shape (n, 3) or (n, 4) with at most
+        2 ** bit_depth colors (see min_bit_depth).
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        alpha: bool = True,
+        bit_depth: int = 8,
+        compression_level: int = 0,
+        filter_type: int = FILTER_NONE,
+        btype: Optional[int] = None,
+        filter_strategy: str = STRATEGY_FIXED,
+        palette: Optional[np.ndarray] = None,
+    ):
+        if palette is None:
+            assert bit_depth == 8, f"unsupported bit depth: {bit_depth}"
+        else:
+            palette = np.asarray(palette, dtype=np.uint8)
+            assert palette.ndim == 2 and palette.shape[1] in (3, 4), f"invalid palette shape: {palette.shape}"
+            assert bit_depth in (1, 2, 4, 8), f"unsupported indexed-color bit depth: {bit_depth}"
+            assert 1 <= len(palette) <= 1 << bit_depth, f"{len(palette)} colors do not fit bit depth {bit_depth}"
+        assert filter_type in FILTER_TYPES, f"invalid filter type: {filter_type}"
+        assert filter_strategy in STRATEGIES, f"invalid filter strategy: {filter_strategy}"
+        self.width: int = width
+        self.height: int = height
+        self.alpha: bool = alpha
+        self.bit_depth: int = bit_depth
+        self.compression_level: int = compression_level
+        self.filter_type: int = filter_type
+        self.filter_strategy: str = filter_strategy
+        if btype is None:
+            btype = BTYPE_STORED if compression_level == 0 else BTYPE_DYNAMIC
+        self.btype: int = btype
+        self.palette: Optional[np.ndarray] = palette
+
+    @property
+    def color_type(self) -> int:
+        if self.palette is not None:
+            return 3
+        return 6 if self.alpha else 2
+
+    @property
+    def pixel_width(self) -> int:
+        """
+        The number of bytes per pixel of the raw image data.
+        """
+        if self.palette is not None:
+            return 1
+        return 4 if self.alpha else 3
+
+    @property
+    def bpp(self) -> int:
+        """
+        The number of bytes per complete pixel of the scanlines, rounded up to 1 (the filter distance).
+        """
+        return max(1, self.pixel_width * self.bit_depth // 8)
+
+    @property
+    def stride(self) -> int:
+        """
+        The number of bytes in a scanline, excluding the filter type byte.
+        """
+        return (self.width * self.pixel_width * self.bit_depth + 7) // 8
+
+    def bytes(self, data: Union[np.ndarray, Sequence[Sequence[Sequence[int]]]]) -> bytes:
+        """
+        Encode a PNG image from rows of pixels, e.g. as generated by image_data: an (h, w, channels) uint8 array or
+        nested lists, or an (h, w) array of palette indices for an indexed-color image.
+        """
+        return self.encode_png(np.asarray(data, dtype=np.uint8).tobytes())
+
+    def encode_png(self, data: bytes) -> bytes:
+        """
+        Encodes a PNG image from raw image data (PNG.encodePNG).
+
+        :param data: Raw image data, pixel_width * width * height bytes.
+        :return: PNG image
+        """
+        # Check that the length of the data is correct
+        assert len(data) == self.pixel_width * self.width * self.height, "Invalid image data length"
+        with span("encode_png"):
+            return PNG_SIGNATURE + self.encode_ihdr() + self.encode_palette() + self.encode_idat(data) + IEND
+
+    def encode_ihdr(self) -> bytes:
+        """
+        Generates an IHDR chunk (PNG.encodeIHDR).
+
+        The IHDR chunk data consists of the following fields:
+        4 bytes: width
+        4 bytes: height
+        1 byte: bit depth (8, or 1, 2, 4 or 8 for indexed-color)
+        1 byte: color type (2 for RGB, 6 for RGBA, 3 for indexed-color)
+        1 byte: compression method (0)
+        1 byte: filter method (0)
+        1 byte: interlace method (0)
+        """
+        ihdr = (
+            self.width.to_bytes(4, byteorder="big")
+            + self.height.to_bytes(4, byteorder="big")
+            + bytes([self.bit_depth, self.color_type, 0, 0, 0])
+        )
+        return encode_chunk(b"IHDR", ihdr)
+
+    def encode_palette(self) -> bytes:
+        """
+        Generates the PLTE chunk and, if any color is not opaque, the tRNS chunk of an indexed-color image, or nothing.
+
+        PLTE holds the RGB values of the palette entries. tRNS holds their alpha values, up to the last one below 255
+        (the entries past it are opaque).
+        """
+        if self.palette is None:
+            return b""
+        chunks = encode_chunk(b"PLTE", self.palette[:, :3].tobytes())
+        if self.palette.shape[1] == 4:
+            alpha = self.palette[:, 3]
+            translucent = np.flatnonzero(alpha != 255)
+            if len(translucent):
+                chunks += encode_chunk(b"tRNS", alpha[: translucent[-1] + 1].tobytes())
+        return chunks
+
+    def interlace(self, data: bytes) -> bytes:
+        """
+        Prefix each scanline with its filter type byte (PNG.interlace).
+
+        PNG.sol does not filter (filter type 0). Any other filter type or strategy filters the scanlines first.
+        """
+        row_width = self.pixel_width * self.width
+        if self.filter_type != FILTER_NONE or self.filter_strategy != STRATEGY_FIXED or self.bit_depth < 8:
+            rows = self.pack(np.frombuffer(data, dtype=np.uint8).reshape(self.height, row_width))
+            return filter_scanlines(rows, self.bpp, self.filter_strategy, self.filter_type).tobytes()
+        mv = memoryview(data)
+        rows: List[bytes] = []
+        prefix = bytes([self.filter_type])
+        for row in range(self.height):
+            rows.append(prefix)
+            rows.append(mv[row * row_width : (row + 1) * row_width])
+        return b"".join(rows)
+
+    def pack(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Pack rows of raw image data into scanline bytes: several indices to a byte below bit depth 8.
+        """
+        if self.bit_depth < 8:
+            return pack_samples(rows, self.bit_depth)
+        return rows
+
+    def zlib_compress_deflate(self, data: bytes) -> bytes:
+        """
+        Generates the zlib stream of the scanlines (PNG.zlibCompressDeflate).
+
+        On-chain the scanlines are written as a single stored block. A stored block holds at most 65535 bytes, so
+        larger images are split into several stored blocks here.
+        """
+        with span("filter"):
+            scanlines = self.interlace(data)
+        level = self.compression_level
+        header = zlib_header(zlib_flevel(level))
+        with span("deflate"):
+            compressed = deflate(scanlines, self.btype, level)
+        with span("adler32"):
+            adler = zlib.adler32(scanlines)
+        return header + compressed + adler.to_bytes(4, byteorder="big")
+
+    def encode_idat(self, data: bytes) -> bytes:
+        """
+        Generates the IDAT chunk (PNG.encodeIDAT).
+        """
+        return encode_chunk(b"IDAT", self.zlib_compress_deflate(data))
+
+
+class IncrementalPNG:
+    """
+    Encoder for successive versions of the same image that re-encodes only the scanlines that changed.
+
+    The scanlines are cut into segments of rows_per_segment rows, and each encode compares them with the previous
+    version. Segments that are unchanged keep their encoded bytes and Adler-32; the Adler-32 of the whole is
+    combined from the segments (checksum.adler32_combine), and the IDAT CRC-32 is continued from the end of the
+    last unchanged leading segment.
+
+    - Stored blocks (compression level 0): the scanlines are a single stored block, as in PNG.encode_png, so the
+      output is byte-identical to it and a changed segment is just copied in.
+    - Huffman-coded blocks: every segment is compressed on its own into a DEFLATE piece ending on a byte boundary
+      (deflate with final=False), so unchanged pieces are reused wherever they are in the stream. Matches do not
+      cross segments, so the output is somewhat larger than PNG.encode_png.
+
+    Filters other than None make a scanline depend on the one above: a pixel change re-encodes the next segment too
+    when it shifts the filtered bytes.
+
+    :param png: The encoder settings.
+    :param rows_per_segment: The granularity of re-encoding.
+    """
+
+    def __init__(self, png: PNG, rows_per_segment: int = 4):
+        assert rows_per_segment > 0, f"invalid rows per segment: {rows_per_segment}"
+        self.png: PNG = png
+        self.rows_per_segment: int = rows_per_segment
+        self._ihdr: bytes = png.encode_ihdr() + png.encode_palette()
+        self._segments: List[bytes] = []
+        self._pieces: List[bytes] = []
+        self._adlers: List[int] = []
+        self._crcs: List[int] = []
+        self._prefix: bytes = b""
+        self._output: Optional[bytes] = None
+        # segments re-encoded by the last call to encode
+        self.encoded_segments: int = 0
+
+    @property
+    def num_segments(self) -> int:
+        return -(-self.png.height // self.rows_per_segment)
+
+    def _single_stored_block(self, size: int) -> bool:
+        return self.png.btype == BTYPE_STORED and size <= MAX_STORED_BLOCK_SIZE
+
+    def _encode_piece(self, i: int, segment: bytes, single_stored_block: bool) -> bytes:
+        if single_stored_block:
+            return segment
+        return deflate(segment, self.png.btype, self.png.compression_level, final=i == self.num_segments - 1)
+
+    def encode(self, data: bytes) -> bytes:
+        """
+        Encode the next version of the image.
+
+        :param data: Raw image data, as for PNG.encode_png.
+        :return: The PNG image.
+        """
+        png = self.png
+        assert len(data) == png.pixel_width * png.width * png.height, "Invalid image data length"
+        scanlines = png.interlace(data)
+        segment_size = self.rows_per_segment * (1 + png.stride)
+        segments = [scanlines[i : i + segment_size] for i in range(0, len(scanlines), segment_size)]
+        single_stored_block = self._single_stored_block(len(scanlines))
+        if not self._segments:
+            self._prefix = zlib_header(zlib_flevel(png.compression_level))
+            if single_stored_block:
+                # BFINAL = 1, BTYPE = 00, LEN, NLEN
+                n = len(scanlines)
+                self._prefix += bytes([1, n & 0xFF, n >> 8, ~n & 0xFF, (~n >> 8) & 0xFF])
+            self._segments = [b""] * len(segments)
+            self._pieces = [b""] * len(segments)
+            self._adlers = [1] * len(segments)
+            self._crcs = [0] * len(segments)
+
+        changed = [i for i, segment in enumerate(segments) if segment != self._segments[i]]
+        self.encoded_segments = len(changed)
+        if not changed and self._output is not None:
+            return self._output
+        for i in changed:
+            self._segments[i] = segments[i]
+            self._pieces[i] = self._encode_piece(i, segments[i], single_stored_block)
+            self._adlers[i] = zlib.adler32(segments[i])
+
+        first = changed[0] if changed else 0
+        crc = self._crcs[first - 1] if first else zlib.crc32(self._prefix, zlib.crc32(b"IDAT"))
+        for i in range(first, len(segments)):
+            crc = zlib.crc32(self._pieces[i], crc)
+            self._crcs[i] = crc
+        adler = self._adlers[0]
+        for i in range(1, len(segments)):
+            adler = adler32_combine(adler, self._adlers[i], len(segments[i]))
+        trailer = adler.to_bytes(4, byteorder="big")
+        crc = zlib.crc32(trailer, crc)
+
+        size = len(self._prefix) + sum(len(piece) for piece in self._pieces) + len(trailer)
+        self._output = b"".join(
+            [PNG_SIGNATURE, self._ihdr, size.to_bytes(4, byteorder="big"), b"IDAT", self._prefix]
+            + self._pieces
+            + [trailer, crc.to_bytes(4, byteorder="big"), IEND]
+        )
+        return self._output
+
+
+class PNGWriter:
+    """
+    Streaming PNG encoder: rows go in, PNG bytes go out as they are ready.
+
+    Only the rows of the current DEFLATE block and one IDAT chunk are buffered, so peak memory is O(row size + chunk
+    size) whatever the image height. The output is written to any object with a write(bytes) method: a file, a
+    socket's makefile("wb"), a BytesIO.
+
+    - Stored blocks (compression level 0): the stored block headers are written ahead of their data, as the total
+      size is known from the IHDR, so nothing is buffered but the IDAT chunk. With a single IDAT chunk the output is
+      byte-identical to PNG.encode_png.
+    - Huffman-coded blocks: every rows_per_block rows are compressed as one block (deflate with final=False), with
+      matches within the block only.
+
+    The zlib stream is cut into IDAT chunks of idat_size bytes (the last one shorter). The Adler-32 of the scanlines
+    and the CRC-32 of the current chunk are kept as running values.
+
+        with open("out.png", "wb") as f, PNGWriter(f, PNG(width, height)) as writer:
+            for rows in blocks:
+                writer.write_rows(rows)
+
+    :param out: The output stream.
+    :param png: The encoder settings.
+    :param idat_size: The size of the data of every IDAT chunk but the last.
+    :param rows_per_block: For Huffman-coded blocks, the number of rows compressed together; by default about 32 KB
+        of scanlines.
+    """
+
+    def __init__(self, out, png: PNG, idat_size: int = 65536, rows_per_block: Optional[int] = None):
+        assert idat_size > 0, f"invalid IDAT size: {idat_size}"
+        self.out = out
+        self.png: PNG = png
+        self.idat_size: int = idat_size
+        # bytes per row of raw image data, and of scanline excluding the filter type byte
+        self.row_size: int = png.pixel_width * png.width
+        self.stride: int = png.stride
+        self.rows_per_block: int = rows_per_block or max(1, 32768 // (1 + self.stride))
+        self.rows_written: int = 0
+        self.bytes_written: int = 0
+        self._previous_row: Optional[np.ndarray] = None
+        self._pending: List[bytes] = []
+        self._pending_rows: int = 0
+        self._adler: int = 1
+        self._idat = bytearray()
+        self._idat_crc: int = zlib.crc32(b"IDAT")
+        # scanline bytes left in the current stored block
+        self._stored_left: int = 0
+        self._stored_total: int = png.height * (1 + self.stride)
+        self._closed: bool = False
+        self._write(PNG_SIGNATURE + png.encode_ihdr() + png.encode_palette())
+        self._append_idat(zlib_header(zlib_flevel(png.compression_level)))
+
+    def __enter__(self) -> "PNGWriter":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+
+    def _write(self, data: bytes) -> None:
+        self.out.write(data)
+        self.bytes_written += len(data)
+
+    def _flush_idat(self) -> None:
+        data = bytes(self._idat)
+        crc = self._idat_crc.to_bytes(4, byteorder="big")
+        self._write(len(data).to_bytes(4, byteorder="big") + b"IDAT" + data + crc)
+        count("png_writer.idat_chunks")
+        self._idat = bytearray()
+        self._idat_crc = zlib.crc32(b"IDAT")
+
+    def _append_idat(self, data: bytes) -> None:
+        mv = memoryview(data)
+        while mv:
+            n = min(len(mv), self.idat_size - len(self._idat))
+            self._idat += mv[:n]
+            self._idat_crc = zlib.crc32(mv[:n], self._idat_crc)
+            mv = mv[n:]
+            if len(self._idat) == self.idat_size:
+                self._flush_idat()
+
+    def _filter(self, rows: np.ndarray) -> bytes:
+        """
+        Filter rows into scanlines, continuing from the last row of the previous call.
+        """
+        png = self.png
+        rows = png.pack(rows)
+        if png.filter_type == FILTER_NONE and png.filter_strategy == STRATEGY_FIXED:
+            scanlines = filter_scanlines(rows, png.bpp)
+        elif self._previous_row is None:
+            scanlines = filter_scanlines(rows, png.bpp, png.filter_strategy, png.filter_type)
+        else:
+            # the previous row is the prior of the first one, its own scanline is dropped
+            rows_with_prior = np.concatenate([self._previous_row[np.newaxis], rows])
+            scanlines = filter_scanlines(rows_with_prior, png.bpp, png.filter_strategy, png.filter_type)[1:]
+        self._previous_row = rows[-1].copy()
+        return scanlines.tobytes()
+
+    def _write_stored(self, scanlines: bytes) -> None:
+        mv = memoryview(scanlines)
+        while mv:
+            if self._stored_left == 0:
+                offset = self.rows_written * (1 + self.stride) - len(mv)
+                remaining = self._stored_total - offset
+                n = min(remaining, MAX_STORED_BLOCK_SIZE)
+                # BFINAL, BTYPE = 00, LEN, NLEN
+                final = 1 if n == remaining else 0
+                self._append_idat(bytes([final, n & 0xFF, n >> 8, ~n & 0xFF, (~n >> 8) & 0xFF]))
+                self._stored_left = n
+            n = min(len(mv), self._stored_left)
+            self._append_idat(mv[:n])
+            self._stored_left -= n
+            mv = mv[n:]
+
+    def _deflate_pending(self, final: bool) -> None:
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_rows = 0
+        with span("deflate"):
+            self._append_idat(deflate(data, self.png.btype, self.png.compression_level, final=final))
+
+    def write_rows(self, rows: Union[np.ndarray, bytes]) -> None:
+        """
+        Write the next rows of the image.
+
+        :param rows: Raw rows, as an array of shape (n, width, channels), (n, width) palette indices or
+            (n, row bytes), or bytes.
+        """
+        assert not self._closed, "PNGWriter is closed"
+        rows = np.frombuffer(rows, dtype=np.uint8) if isinstance(rows, (bytes, bytearray, memoryview)) else rows
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(-1, self.row_size)
+        assert self.rows_written + len(rows) <= self.png.height, "more rows than the image height"
+        if not len(rows):
+            return
+        with span("filter"):
+            scanlines = self._filter(rows)
+        with span("adler32"):
+            self._adler = zlib.adler32(scanlines, self._adler)
+        self.rows_written += len(rows)
+        if self.png.btype == BTYPE_STORED:
+            self._write_stored(scanlines)
+            return
+        row_size = 1 + self.stride
+        for i in range(len(rows)):
+            self._pending.append(scanlines[i * row_size : (i + 1) * row_size])
+            self._pending_rows += 1
+            if self._pending_rows == self.rows_per_block and self.rows_written - len(rows) + i + 1 < self.png.height:
+                self._deflate_pending(final=False)
+
+    def close(self) -> None:
+        """
+        Finish the zlib stream and write the last IDAT chunk and IEND.
+        """
+        if self._closed:
+            return
+        assert self.rows_written == self.png.height, f"{self.rows_written} of {self.png.height} rows written"
+        if self.png.btype != BTYPE_STORED:
+            self._deflate_pending(final=True)
+        self._append_idat(self._adler.to_bytes(4, byteorder="big"))
+        if self._idat:
+            self._flush_idat()
+        self._write(IEND)
+        self._closed = True
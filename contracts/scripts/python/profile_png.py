@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Profile of the PNG pipelines.
+
+Decodes a batch of PNG files (by default every 8th spritesheet) and re-encodes their pixels, once with instrumentation
+off and once recording (instrument.py), and prints the profile. --json and --folded write it for flamegraph.pl or
+speedscope.
+"""
+
+import glob
+import os
+import time
+from argparse import ArgumentParser, Namespace
+
+from decode import decode_file, iter_png_paths
+from instrument import recording, span
+from png import PNG
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    # PNG files, directories and glob patterns, by default the spritesheets
+    parser.add_argument("filenames", nargs="*")
+    parser.add_argument("--json", help="write the profile as JSON to this file")
+    parser.add_argument("--folded", help="write the profile as folded stacks to this file")
+    # also re-encode every image with this compression level
+    parser.add_argument("--level", type=int, default=6)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """
+    Profile decoding a batch of PNG files and re-encoding their pixels, and time the pipeline with instrumentation off
+    to show the overhead of the disabled spans.
+    """
+    args = parse_args()
+    if args.filenames:
+        paths = list(iter_png_paths(args.filenames))
+    else:
+        here = os.path.dirname(os.path.abspath(__file__))
+        pattern = os.path.join(here, "../../../assets/assets/spritesheets/**/*.png")
+        paths = sorted(glob.glob(pattern, recursive=True))[::8]
+
+    def run() -> None:
+        for path in paths:
+            with span("decode_file"):
+                decoded = decode_file(path)
+                if decoded.ihdr.color_type != 6 or decoded.ihdr.bit_depth != 8:
+                    continue
+                pixels = decoded.pixels()
+            h, w, _ = pixels.shape
+            PNG(w, h, compression_level=args.level).bytes(pixels)
+
+    start = time.perf_counter()
+    run()
+    disabled = time.perf_counter() - start
+    with recording() as profile:
+        start = time.perf_counter()
+        run()
+        recorded = time.perf_counter() - start
+    profile.print()
+    print(f"{len(paths)} files: {disabled:.3f}s without recording, {recorded:.3f}s recording")
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(profile.to_json())
+    if args.folded:
+        with open(args.folded, "w") as f:
+            f.write(profile.to_folded())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Offline avatar renderer.
+
+Renders an avatar from its DNA the way OpenAvatarGen0AssetsCanvasLayerCompositor.sol does on-chain, from the asset
+files (assets/assets/patterns and palettes) instead of the contract storage:
+
+    for each layer, in the renderer's draw order:
+        pattern = the pose (canvas) crop of the layer's pattern
+        palette = the layer's palette
+        for each pixel with color index i != 0:
+            rgba = palette[i]
+            alpha 255          copy rgb, alpha 255
+            alpha 0            nothing
+            background alpha 0 copy rgba
+            otherwise          blendPixel each of rgb, blendAlpha the alpha (PixelBlender.sol)
+
+A missing pattern or palette is skipped, as on-chain. The compositing is vectorized: a layer is rendered once to
+RGBA (palette lookup of the crop), cached, then composited onto the image with whole-array operations. Layers
+without semi-transparent colors, most of them, are a single masked copy.
+"""
+
+import glob
+import json
+import os
+import time
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from assets import CANVAS_HEIGHT, CANVAS_WIDTH, Assets, LayerImage, layer_image
+from cache import LRUCache, digest
+from definitions import DRAW_ORDER, LAYERS, Definitions
+from image_data import palette_indices
+from png import PNG, PNGWriter, encode_indexed, min_bit_depth
+
+# about 7000 uncompressed 32x32 PNGs
+DEFAULT_PNG_CACHE_SIZE: int = 32 * 1024 * 1024
+
+FIRST100_DIR: str = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "avatars", "first100")
+)
+
+
+@dataclass
+class DNA:
+    """
+    32 bytes, two per layer in LAYERS order: the pattern index then the palette index (DNA.sol).
+    """
+
+    data: bytes
+
+    @staticmethod
+    def parse(dna: Union[str, bytes]) -> "DNA":
+        if isinstance(dna, str):
+            dna = bytes.fromhex(dna[2:] if dna.startswith("0x") else dna)
+        assert len(dna) == 32, f"invalid DNA length: {len(dna)}"
+        return DNA(bytes(dna))
+
+    def pattern(self, layer: int) -> int:
+        return self.data[2 * layer]
+
+    def palette(self, layer: int) -> int:
+        return self.data[2 * layer + 1]
+
+    def layers(self) -> Dict[str, Tuple[int, int]]:
+        """
+        The (pattern index, palette index) of every layer, by layer name.
+        """
+        return {layer.name: (self.pattern(i), self.palette(i)) for i, layer in enumerate(LAYERS)}
+
+    def hex(self) -> str:
+        return "0x" + self.data.hex()
+
+    def print(self, definitions: Optional[Definitions] = None):
+        f = 18
+        print("dna".ljust(f), self.hex())
+        for name, (pattern, palette) in self.layers().items():
+            if pattern == 0 and palette == 0:
+                continue
+            description = f"{pattern} {palette}"
+            if definitions is not None:
+                found = definitions.pattern(name, pattern)
+                if found is not None:
+                    description += f" ({found[0]}, {definitions.palette(found[1], palette)})"
+            print(name.ljust(f), description)
+
+
+def draw_layer(image: np.ndarray, layer: LayerImage) -> None:
+    """
+    Composite a layer onto an image in place (_drawMaskedPattern, without a mask).
+    """
+    if layer.translucent is not None:
+        fg = layer.rgba[layer.translucent].astype(np.int32)
+        bg = image[layer.translucent].astype(np.int32)
+        a = fg[:, 3:4]
+        blended = np.empty_like(fg)
+        # blendPixel
+        blended[:, :3] = (fg[:, :3] * a + bg[:, :3] * (255 - a)) // 255
+        # blendAlpha, background alpha 255 stays 255
+        blended[:, 3] = np.where(bg[:, 3] == 255, 255, a[:, 0] + bg[:, 3] * (255 - a[:, 0]) // 255)
+        # a transparent background pixel is replaced
+        empty = bg[:, 3] == 0
+        blended[empty] = fg[empty]
+        image[layer.translucent] = blended
+    np.copyto(image, layer.rgba, where=layer.opaque[..., np.newaxis])
+
+
+class Renderer:
+    """
+    :param assets: The patterns and palettes, and the layer cache.
+    :param png_cache: The cache of PNG bytes, by default bounded to DEFAULT_PNG_CACHE_SIZE bytes.
+    """
+
+    def __init__(self, assets: Optional[Assets] = None, png_cache: Optional[LRUCache] = None):
+        self.assets: Assets = assets or Assets()
+        self.png_cache: LRUCache = png_cache if png_cache is not None else LRUCache(DEFAULT_PNG_CACHE_SIZE)
+
+    def render(self, dna: Union[DNA, str, bytes], canvas_id: int = 0) -> np.ndarray:
+        """
+        Render an avatar.
+
+        :param dna: The avatar DNA.
+        :param canvas_id: The pose, 0 (IdleDown0) to 11 (WalkUp1).
+        :return: The image, uint8 of shape (32, 32, 4).
+        """
+        if not isinstance(dna, DNA):
+            dna = DNA.parse(dna)
+        layers = dna.layers()
+        image = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH, 4), dtype=np.uint8)
+        for name in DRAW_ORDER:
+            pattern, palette = layers[name]
+            layer = self.assets.layer(canvas_id, name, pattern, palette)
+            if layer is not None:
+                draw_layer(image, layer)
+        return image
+
+    def render_png(self, dna: Union[DNA, str, bytes], canvas_id: int = 0, png: Optional[PNG] = None) -> bytes:
+        """
+        Render an avatar to a PNG, by default encoded as on-chain (uncompressed).
+
+        The PNG is cached by the content addresses of its layers and the encoder settings, so DNAs differing only in
+        layers that draw nothing share an entry. An encoder without alpha drops the alpha channel, one with a palette
+        is given the palette indices of the image, which must only have colors of the palette.
+        """
+        if not isinstance(dna, DNA):
+            dna = DNA.parse(dna)
+        png = png or PNG(CANVAS_WIDTH, CANVAS_HEIGHT)
+        layers = dna.layers()
+        layer_keys = [self.assets.layer_key(canvas_id, name, *layers[name]) for name in DRAW_ORDER]
+        settings = []
+        for name, value in sorted(vars(png).items()):
+            # arrays (the palette) by content: their str() elides elements past 1000
+            settings += [name, value.shape, value] if isinstance(value, np.ndarray) else [name, value]
+        key = digest(canvas_id, *settings, *layer_keys)
+        return self.png_cache.get_or_compute(key, lambda: encode_image(png, self.render(dna, canvas_id)))
+
+
+def encode_image(png: PNG, image: np.ndarray) -> bytes:
+    """
+    Encode a rendered RGBA image with an encoder of any color type: RGBA, RGB (the alpha channel dropped) or
+    indexed-color (the palette indices of the image's colors).
+    """
+    if png.palette is not None:
+        return png.bytes(palette_indices(image, png.palette))
+    return png.bytes(image if png.alpha else image[..., :3])
+
+
+def draw_pattern_scalar(image: bytearray, indices: bytes, colors: List[Tuple[int, int, int, int]]) -> None:
+    """
+    A pixel by pixel port of _drawMaskedPattern for a full canvas pattern and no mask, to check draw_layer against.
+    """
+    for pixel, color_index in enumerate(indices):
+        if color_index == 0:
+            continue
+        r, g, b, a = colors[color_index]
+        offset = 4 * pixel
+        if a == 255:
+            image[offset : offset + 4] = bytes((r, g, b, 255))
+        elif a == 0:
+            pass
+        elif image[offset + 3] == 0:
+            image[offset : offset + 4] = bytes((r, g, b, a))
+        else:
+            for k, c in enumerate((r, g, b)):
+                image[offset + k] = (c * a + image[offset + k] * (255 - a)) // 255
+            background_alpha = image[offset + 3]
+            image[offset + 3] = 255 if background_alpha == 255 else a + background_alpha * (255 - a) // 255
+
+
+def check_blend(iterations: int = 200, seed: int = 0) -> None:
+    """
+    Composite random layers with both draw_layer and draw_pattern_scalar and compare.
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(iterations):
+        image = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH, 4), dtype=np.uint8)
+        reference = bytearray(image.tobytes())
+        for _ in range(int(rng.integers(1, 6))):
+            colors = rng.integers(0, 256, size=(int(rng.integers(2, 32)), 4), dtype=np.uint8)
+            # mostly opaque or transparent colors, like the real palettes
+            colors[:, 3] = rng.choice([0, 255, int(rng.integers(1, 255)), int(rng.integers(1, 255))], size=len(colors))
+            colors[0] = 0
+            indices = rng.integers(0, len(colors), size=(CANVAS_HEIGHT, CANVAS_WIDTH), dtype=np.uint8)
+            layer = layer_image(indices, colors)
+            if layer is not None:
+                draw_layer(image, layer)
+            draw_pattern_scalar(reference, indices.tobytes(), [tuple(c) for c in colors.tolist()])
+            assert image.tobytes() == bytes(reference), "draw_layer differs from _drawMaskedPattern"
+    print(f"blend: {iterations} random compositions match _drawMaskedPattern")
+
+
+def check_first100(definitions: Definitions) -> List[DNA]:
+    """
+    Check the DNA decoding against the pattern and palette names of the avatars in src/avatars/first100.
+    """
+    dnas = []
+    for path in sorted(glob.glob(os.path.join(FIRST100_DIR, "0x*.json"))):
+        dna = DNA.parse(os.path.basename(path)[: -len(".json")])
+        with open(path, "r") as f:
+            expected = json.load(f)
+        decoded = {}
+        for name, (pattern, palette) in dna.layers().items():
+            found = definitions.pattern(name, pattern)
+            assert found is not None, f"{dna.hex()}: no {name} pattern {pattern}"
+            if pattern == 0:
+                continue
+            decoded[name] = {"patternName": found[0], "paletteName": definitions.palette(found[1], palette)}
+        assert decoded == expected, f"{dna.hex()}: decoded {decoded}, expected {expected}"
+        dnas.append(dna)
+    print(f"first100: {len(dnas)} DNAs decode to the expected patterns and palettes")
+    return dnas
+
+
+def random_dnas(definitions: Definitions, n: int, seed: int = 0) -> List[DNA]:
+    """
+    Random valid DNAs.
+    """
+    rng = np.random.default_rng(seed)
+    dnas = []
+    for _ in range(n):
+        data = bytearray(32)
+        for i, layer in enumerate(LAYERS):
+            patterns = definitions.patterns.get(layer.name, [])
+            if not patterns:
+                continue
+            pattern = int(rng.integers(0, len(patterns)))
+            data[2 * i] = pattern
+            data[2 * i + 1] = int(rng.integers(0, len(definitions.palettes[patterns[pattern][1]])))
+        dnas.append(DNA(bytes(data)))
+    return dnas
+
+
+def write_contact_sheet(
+    renderer: Renderer, dnas: List[DNA], out, columns: int = 10, canvas_id: int = 0, png: Optional[PNG] = None
+) -> int:
+    """
+    Write a grid of avatars as one PNG, streaming one row of avatars at a time (see png.PNGWriter).
+
+    :param out: The output stream.
+    :param png: The encoder settings, for the size of the whole sheet.
+    :return: The number of bytes written.
+    """
+    columns = max(1, min(columns, len(dnas)))
+    rows = -(-len(dnas) // columns)
+    png = png or PNG(columns * CANVAS_WIDTH, rows * CANVAS_HEIGHT)
+    assert (png.width, png.height) == (columns * CANVAS_WIDTH, rows * CANVAS_HEIGHT), "invalid contact sheet size"
+    blank = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH, 4), dtype=np.uint8)
+    with PNGWriter(out, png) as writer:
+        for row in range(rows):
+            avatars = [renderer.render(dna, canvas_id) for dna in dnas[row * columns : (row + 1) * columns]]
+            avatars += [blank] * (columns - len(avatars))
+            writer.write_rows(np.concatenate(avatars, axis=1))
+    return writer.bytes_written
+
+
+def benchmark(renderer: Renderer, dnas: List[DNA]) -> None:
+    f = 18
+    start = time.perf_counter()
+    for dna in dnas:
+        renderer.render(dna)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for dna in dnas:
+        renderer.render(dna)
+    warm = time.perf_counter() - start
+    start = time.perf_counter()
+    for dna in dnas:
+        renderer.render_png(dna)
+    png = time.perf_counter() - start
+    print("avatars".ljust(f), len(dnas))
+    print("cold (loading)".ljust(f), f"{len(dnas) / cold:.0f} avatars/s")
+    print("warm".ljust(f), f"{len(dnas) / warm:.0f} avatars/s")
+    print("warm + png".ljust(f), f"{len(dnas) / png:.0f} avatars/s")
+
+
+def compare_indexed(renderer: Renderer, dnas: List[DNA], levels: Tuple[int, ...] = (0, 6)) -> None:
+    """
+    Compare indexed-color (color type 3, PLTE and tRNS) with RGBA output at each compression level: total size and
+    encode and decode throughput, on every pattern spritesheet with its first palette, and on rendered avatars.
+
+    A spritesheet is encoded straight from its palette indices, with palette entry 0 transparent as when rendering. An
+    avatar is palettized from its composite (png.encode_indexed).
+    """
+    from decode import decode_png
+
+    f = 12
+    assets = renderer.assets
+    sheets: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+    for layer, patterns in assets.definitions.patterns.items():
+        for index in range(len(patterns)):
+            pattern_file = assets.pattern(layer, index)
+            if pattern_file is None:
+                continue
+            colors = assets.palette(pattern_file.palette_code, 0)
+            if colors is None or int(pattern_file.indices.max()) >= len(colors):
+                continue
+            palette = colors.copy()
+            palette[0] = 0
+            sheets.append((palette[pattern_file.indices], pattern_file.indices, palette))
+    avatars = [renderer.render(dna) for dna in dnas]
+
+    print("images".ljust(f), "level".ljust(f), "format".ljust(f), "KB".rjust(f), "ratio".rjust(f), end=" ")
+    print("encode/s".rjust(f), "decode/s".rjust(f))
+    for name, count in (("sheets", len(sheets)), ("avatars", len(avatars))):
+        for level in levels:
+            if name == "sheets":
+                rgba = lambda: [PNG(128, 128, compression_level=level).bytes(image) for image, _, _ in sheets]
+                indexed = lambda: [
+                    PNG(128, 128, bit_depth=min_bit_depth(len(p)), palette=p, compression_level=level).bytes(i)
+                    for _, i, p in sheets
+                ]
+                expected = [image for image, _, _ in sheets]
+            else:
+                rgba = lambda: [PNG(CANVAS_WIDTH, CANVAS_HEIGHT, compression_level=level).bytes(a) for a in avatars]
+                indexed = lambda: [encode_indexed(a, compression_level=level) for a in avatars]
+                expected = avatars
+            sizes = {}
+            for kind, encode in (("rgba", rgba), ("indexed", indexed)):
+                start = time.perf_counter()
+                encoded = encode()
+                encode_time = time.perf_counter() - start
+                start = time.perf_counter()
+                decoded = [decode_png(b).pixels() for b in encoded]
+                decode_time = time.perf_counter() - start
+                for pixels, image in zip(decoded, expected):
+                    assert np.array_equal(pixels, image), f"{name}: {kind} round trip differs"
+                sizes[kind] = sum(len(b) for b in encoded)
+                print(
+                    f"{count} {name}".ljust(f),
+                    str(level).ljust(f),
+                    kind.ljust(f),
+                    f"{sizes[kind] / 1e3:.1f}".rjust(f),
+                    f"{sizes[kind] / sizes['rgba']:.2f}".rjust(f),
+                    f"{count / encode_time:.0f}".rjust(f),
+                    f"{count / decode_time:.0f}".rjust(f),
+                )
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+    parser.add_argument("dna", nargs="*", help="DNAs to render, 0x-prefixed hex")
+    parser.add_argument("--canvas", type=int, default=0)
+    parser.add_argument("--out", help="directory to write <dna>.png files to")
+    parser.add_argument("--benchmark", type=int, default=1000, help="number of random avatars to render")
+    parser.add_argument("--contact-sheet", help="PNG file to write a grid of all the avatars to")
+    parser.add_argument("--columns", type=int, default=10)
+    # write indexed-color PNGs (with --out)
+    parser.add_argument("--indexed", action="store_true")
+    parser.add_argument("--compare-indexed", action="store_true", help="compare indexed-color with RGBA output")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    renderer = Renderer()
+    definitions = renderer.assets.definitions
+    check_blend()
+    dnas = [DNA.parse(dna) for dna in args.dna] or check_first100(definitions)
+    if args.benchmark:
+        benchmark(renderer, random_dnas(definitions, args.benchmark))
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for dna in dnas:
+            with open(os.path.join(args.out, f"{dna.hex()}.png"), "wb") as f:
+                if args.indexed:
+                    f.write(encode_indexed(renderer.render(dna, args.canvas)))
+                else:
+                    f.write(renderer.render_png(dna, args.canvas))
+        print(f"wrote {len(dnas)} PNGs to {args.out}")
+    if args.contact_sheet:
+        with open(args.contact_sheet, "wb") as f:
+            size = write_contact_sheet(renderer, dnas, f, args.columns, args.canvas)
+        print(f"wrote {len(dnas)} avatars to {args.contact_sheet} ({size} bytes)")
+    if args.compare_indexed:
+        compare_indexed(renderer, random_dnas(definitions, 200))
+
+
+if __name__ == "__main__":
+    main()
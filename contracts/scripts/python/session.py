@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Incremental avatar rendering for editing one trait at a time.
+
+A RenderSession keeps the composite of the avatar after each layer of the draw order. Changing a layer's pattern or
+palette recomposites from the composite below it, stops as soon as a composite comes out unchanged (every layer
+above then draws the same), and re-encodes only the scanlines that changed (png.IncrementalPNG).
+"""
+
+import time
+from typing import List, Optional, Union
+
+import numpy as np
+from cache import LRUCache
+from definitions import DRAW_ORDER, LAYERS
+from png import PNG, IncrementalPNG
+from render import CANVAS_HEIGHT, CANVAS_WIDTH, DNA, Renderer, draw_layer, random_dnas
+
+
+class RenderSession:
+    """
+    An avatar being edited.
+
+    :param dna: The initial DNA.
+    :param canvas_id: The pose.
+    :param renderer: The renderer, for its assets and layer cache.
+    :param png: The PNG encoder settings, by default as on-chain.
+    :param rows_per_segment: The granularity of PNG re-encoding (see png.IncrementalPNG).
+    """
+
+    def __init__(
+        self,
+        dna: Union[DNA, str, bytes],
+        canvas_id: int = 0,
+        renderer: Optional[Renderer] = None,
+        png: Optional[PNG] = None,
+        rows_per_segment: int = 4,
+    ):
+        self.renderer: Renderer = renderer or Renderer()
+        self.canvas_id: int = canvas_id
+        self.data: bytearray = bytearray((dna if isinstance(dna, DNA) else DNA.parse(dna)).data)
+        self.encoder: IncrementalPNG = IncrementalPNG(png or PNG(CANVAS_WIDTH, CANVAS_HEIGHT), rows_per_segment)
+        # composites[k] is the image after drawing DRAW_ORDER[: k + 1]; layers that draw nothing share the array
+        # below them, so composites are never modified in place
+        self._composites: List[np.ndarray] = []
+        # layers recomposited by the last edit
+        self.recomposited: int = 0
+        self._recomposite(0)
+
+    @property
+    def dna(self) -> DNA:
+        return DNA(bytes(self.data))
+
+    @property
+    def image(self) -> np.ndarray:
+        return self._composites[-1]
+
+    def _recomposite(self, start: int) -> None:
+        dna = self.dna
+        layers = dna.layers()
+        below = self._composites[start - 1] if start else np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH, 4), dtype=np.uint8)
+        self.recomposited = 0
+        for k in range(start, len(DRAW_ORDER)):
+            layer = self.renderer.assets.layer(self.canvas_id, DRAW_ORDER[k], *layers[DRAW_ORDER[k]])
+            composite = below
+            if layer is not None:
+                composite = below.copy()
+                draw_layer(composite, layer)
+            self.recomposited += 1
+            if k < len(self._composites):
+                if np.array_equal(composite, self._composites[k]):
+                    # same input to every layer above
+                    return
+                self._composites[k] = composite
+            else:
+                self._composites.append(composite)
+            below = composite
+
+    def set_layer(self, layer: str, pattern: int, palette: int) -> None:
+        """
+        Change the pattern and palette of a layer.
+        """
+        i = [l.name for l in LAYERS].index(layer)
+        if self.data[2 * i] == pattern and self.data[2 * i + 1] == palette:
+            self.recomposited = 0
+            return
+        self.data[2 * i] = pattern
+        self.data[2 * i + 1] = palette
+        self._recomposite(DRAW_ORDER.index(layer))
+
+    def png(self) -> bytes:
+        """
+        The PNG of the current image.
+        """
+        return self.encoder.encode(self.image.tobytes())
+
+
+def benchmark_edits(renderer: Renderer, png: PNG, n: int = 200, seed: int = 0) -> None:
+    """
+    Apply random single-layer edits to random avatars, timing each edit against a full render, and check that both
+    produce the same image.
+    """
+    from decode import decode_png
+
+    f = 18
+    definitions = renderer.assets.definitions
+    rng = np.random.default_rng(seed)
+    dnas = random_dnas(definitions, n, seed)
+    # warm the layer cache so both sides only composite and encode
+    for dna in dnas:
+        renderer.render(dna)
+    full = LRUCache(0)
+    edit_times: List[float] = []
+    full_times: List[float] = []
+    recomposited = 0
+    encoded = 0
+    for dna in dnas:
+        session = RenderSession(dna, renderer=renderer, png=png)
+        session.png()
+        name = DRAW_ORDER[int(rng.integers(0, len(DRAW_ORDER)))]
+        patterns = definitions.patterns[name]
+        pattern = int(rng.integers(0, len(patterns)))
+        palette = int(rng.integers(0, len(definitions.palettes[patterns[pattern][1]])))
+
+        start = time.perf_counter()
+        session.set_layer(name, pattern, palette)
+        edited = session.png()
+        edit_times.append(time.perf_counter() - start)
+        recomposited += session.recomposited
+        encoded += session.encoder.encoded_segments
+
+        start = time.perf_counter()
+        expected = Renderer(renderer.assets, full).render_png(session.dna, png=png)
+        full_times.append(time.perf_counter() - start)
+        if png.btype == 0:
+            assert edited == expected, f"{session.dna.hex()}: incremental PNG differs"
+        else:
+            assert np.array_equal(decode_png(edited).pixels(), decode_png(expected).pixels())
+    print("edits".ljust(f), n)
+    print("layers / edit".ljust(f), f"{recomposited / n:.1f} of {len(DRAW_ORDER)}")
+    print("segments / edit".ljust(f), f"{encoded / n:.1f} of {session.encoder.num_segments}")
+    print("edit".ljust(f), f"{1e6 * np.median(edit_times):.0f} us (median)")
+    print("full render".ljust(f), f"{1e6 * np.median(full_times):.0f} us (median)")
+
+
+def main() -> None:
+    renderer = Renderer()
+    print("stored (on-chain)")
+    benchmark_edits(renderer, PNG(CANVAS_WIDTH, CANVAS_HEIGHT))
+    print("compressed (level 6)")
+    benchmark_edits(renderer, PNG(CANVAS_WIDTH, CANVAS_HEIGHT, compression_level=6), n=50)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ import {
 } from '@openavatar/types'
 import { expect } from 'chai'
 import { BigNumber } from 'ethers'
+import fs from 'fs'
 import hre, { ethers } from 'hardhat'
 import { GasParams } from '../../src/client/GasParams'
 import { OpenAvatarGen0Assets } from '../../src/client/OpenAvatarGen0Assets'
@@ -66,6 +67,17 @@ const HEIGHT_32x32 = 32
 
 const POSE: AvatarPose = AvatarPose.IdleDown0
 
+// more measurements, not asserted, recorded for the calibration of scripts/python/gas.py
+interface GasMeasurement {
+  name: string
+  entry: string
+  size: number
+  dna: string
+  gas: number
+}
+const GAS_MEASUREMENTS: GasMeasurement[] = []
+const GAS_MEASUREMENTS_FILE = `${__dirname}/../data/gas_measured.json`
+
 const RED = '\x1b[31m'
 const GREEN = '\x1b[32m'
 const ENDC = '\x1b[0m'
@@ -279,6 +291,46 @@ describe('Gas Estimate Tests', function () {
         console.error(tokenURI.errorMsg)
       }
 
+      ////////////////////////////////////////////////////////////////////////////////
+      // calibration measurements: renderURI of the zero DNA, of the max pattern/palette
+      // of each layer alone and of every other layer, and tokenURI of the zero DNA
+      ////////////////////////////////////////////////////////////////////////////////
+      const calibrationDNAs: [string, DNA][] = [['zero', DNA.ZERO]]
+      const layers = [...AvatarLayerStack.iter()]
+      for (const layer of layers) {
+        calibrationDNAs.push([layer.name, DNA.ZERO.replace({ [layer.name]: dna.get(layer) })])
+      }
+      for (const parity of [0, 1]) {
+        let sparse: DNA = DNA.ZERO
+        for (const layer of layers.filter((_, i) => i % 2 === parity)) {
+          sparse = sparse.replace({ [layer.name]: dna.get(layer) })
+        }
+        calibrationDNAs.push([parity === 0 ? 'even layers' : 'odd layers', sparse])
+      }
+      for (const [name, calibrationDNA] of calibrationDNAs) {
+        const found: BigNumber = await ethers.provider.estimateGas(
+          await openAvatarGen0Renderer.contract.populateTransaction.renderURI(calibrationDNA.buffer)
+        )
+        GAS_MEASUREMENTS.push({
+          name: `renderURI(${name})`,
+          entry: 'renderURI',
+          size: WIDTH_32x32,
+          dna: calibrationDNA.toString(),
+          gas: found.toNumber(),
+        })
+      }
+      // token 0 is the zero DNA
+      const tokenURIZero: BigNumber = await ethers.provider.estimateGas(
+        await openAvatarGen0Token.contract.populateTransaction.tokenURI(0)
+      )
+      GAS_MEASUREMENTS.push({
+        name: 'tokenURI(zero)',
+        entry: 'tokenURI',
+        size: WIDTH_32x32,
+        dna: DNA.ZERO.toString(),
+        gas: tokenURIZero.toNumber(),
+      })
+
       ////////////////////////////////////////////////////////////////////////////////
       // pfp
       ////////////////////////////////////////////////////////////////////////////////
@@ -291,6 +343,17 @@ describe('Gas Estimate Tests', function () {
       if (!pfpTokenURI.expected.eq(pfpTokenURI.found)) {
         console.error(pfpTokenURI.errorMsg)
       }
+      const pfpTokenURIZero: BigNumber = await ethers.provider.estimateGas(
+        await openAvatarGen0Token.contract.populateTransaction.tokenURI(0)
+      )
+      GAS_MEASUREMENTS.push({
+        name: 'pfpTokenURI(zero)',
+        entry: 'pfpTokenURI',
+        size: WIDTH_32x32,
+        dna: DNA.ZERO.toString(),
+        gas: pfpTokenURIZero.toNumber(),
+      })
+      fs.writeFileSync(GAS_MEASUREMENTS_FILE, JSON.stringify(GAS_MEASUREMENTS, null, 2) + '\n')
     })
 
     it(`Should cost ${fmtCommas(